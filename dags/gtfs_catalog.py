@@ -0,0 +1,184 @@
+"""
+Glue catalog and Athena helpers shared by the daily GTFS DAGs
+(uta_gtfs_pipeline.py on MWAA, uta_gtfs_pipeline_ec2.py on EC2).
+
+The DAGs used to run the uta-gtfs-crawler over the whole raw/ prefix every
+day, so the crawl got longer as history built up. Each run now only touches
+the tables the ingest Lambda reports as changed:
+
+- register_partitions() adds one dt=YYYY-MM-DD partition per changed table
+  to uta_gtfs_raw.<table> with batch_create_partition, pointing at
+  raw/YYYY-MM-DD/<table>/. A table seen for the first time is created from
+  its CSV header (every column a string, as the crawler made them).
+- conversion_payloads() / validation_payloads() are the ingest Lambda
+  events for the per-table tasks the DAG maps over.
+- view_queries() re-points the uta_gtfs_clean view of each changed table at
+  its new partition; the views of unchanged tables are left alone.
+
+Not a DAG itself: Airflow puts the dags folder on sys.path, so the DAG files
+import it directly.
+"""
+import csv
+import io
+import json
+
+RAW_DATABASE = 'uta_gtfs_raw'
+CLEAN_DATABASE = 'uta_gtfs_clean'
+RAW_PREFIX = 'raw'
+PARTITION_KEY = 'dt'
+HEADER_BYTES = 64 * 1024   # enough for any GTFS header line
+
+# Tables the Lambda converts to Parquet (ingest_lambda.PARQUET_TABLES)
+PARQUET_TABLES = ['stops', 'routes', 'trips', 'stop_times']
+
+# Same SELECTs as sql/athena_transformation.sql, limited to one partition
+CLEAN_VIEWS = {
+    'stops': """
+SELECT
+  CAST(stop_id AS VARCHAR) AS stop_id,
+  stop_name,
+  CAST(stop_lat AS DOUBLE) AS stop_lat,
+  CAST(stop_lon AS DOUBLE) AS stop_lon,
+  parent_station
+FROM uta_gtfs_raw.stops
+WHERE dt = '{dt}'
+  AND CAST(stop_lat AS DOUBLE) BETWEEN -90 AND 90
+  AND CAST(stop_lon AS DOUBLE) BETWEEN -180 AND 180""",
+    'routes': """
+SELECT
+  CAST(route_id AS VARCHAR) AS route_id,
+  route_short_name,
+  route_long_name,
+  CAST(route_type AS INTEGER) AS route_type
+FROM uta_gtfs_raw.routes
+WHERE dt = '{dt}'""",
+    'trips': """
+SELECT
+  CAST(route_id AS VARCHAR) AS route_id,
+  CAST(service_id AS VARCHAR) AS service_id,
+  CAST(trip_id AS VARCHAR) AS trip_id,
+  trip_headsign,
+  CAST(direction_id AS INTEGER) AS direction_id,
+  shape_id
+FROM uta_gtfs_raw.trips
+WHERE dt = '{dt}'""",
+    'stop_times': """
+SELECT
+  CAST(trip_id AS VARCHAR) AS trip_id,
+  arrival_time,
+  departure_time,
+  CAST(stop_id AS VARCHAR) AS stop_id,
+  CAST(stop_sequence AS INTEGER) AS stop_sequence
+FROM uta_gtfs_raw.stop_times
+WHERE dt = '{dt}'""",
+}
+
+
+def parse_ingest_response(payload):
+    """Body of the ingest Lambda's response (the LambdaInvokeFunctionOperator XCom)."""
+    try:
+        return json.loads(json.loads(payload)['body'])
+    except (TypeError, KeyError, ValueError):
+        raise ValueError(f"Unexpected ingest Lambda response: {payload!r}")
+
+
+def partition_date(body):
+    """'raw/2025-11-20' -> '2025-11-20'."""
+    return body['partition'].split('/')[-1]
+
+
+def read_header(s3, bucket, key):
+    """Column names from the first line of a CSV in S3 (one ranged GET)."""
+    data = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{HEADER_BYTES - 1}")['Body'].read()
+    line = data.decode('utf-8-sig').splitlines()[0] if data else ''
+    return [column.strip().lower() for column in next(csv.reader(io.StringIO(line)), [])]
+
+
+def storage_descriptor(location, columns):
+    return {
+        'Columns': [{'Name': column, 'Type': 'string'} for column in columns],
+        'Location': location,
+        'InputFormat': 'org.apache.hadoop.mapred.TextInputFormat',
+        'OutputFormat': 'org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat',
+        'SerdeInfo': {
+            'SerializationLibrary': 'org.apache.hadoop.hive.serde2.OpenCSVSerde',
+            'Parameters': {'separatorChar': ',', 'quoteChar': '"'},
+        },
+        'Parameters': {'skip.header.line.count': '1'},
+    }
+
+
+def table_input(table, bucket, columns):
+    return {
+        'Name': table,
+        'TableType': 'EXTERNAL_TABLE',
+        'Parameters': {'classification': 'csv', 'skip.header.line.count': '1', 'EXTERNAL': 'TRUE'},
+        'PartitionKeys': [{'Name': PARTITION_KEY, 'Type': 'string'}],
+        'StorageDescriptor': storage_descriptor(f"s3://{bucket}/{RAW_PREFIX}/", columns),
+    }
+
+
+def ensure_table(glue, database, table, bucket, columns):
+    """Creates the raw table, or updates its columns when the header changed."""
+    try:
+        existing = glue.get_table(DatabaseName=database, Name=table)['Table']
+    except glue.exceptions.EntityNotFoundException:
+        print(f"🆕 Creating {database}.{table} ({len(columns)} columns)")
+        glue.create_table(DatabaseName=database, TableInput=table_input(table, bucket, columns))
+        return
+    if [c['Name'] for c in existing['StorageDescriptor']['Columns']] != columns:
+        print(f"⚠️ {database}.{table}: header changed, updating the table columns")
+        glue.update_table(DatabaseName=database, TableInput=table_input(table, bucket, columns))
+
+
+def register_partitions(glue, s3, bucket, body, database=RAW_DATABASE):
+    """
+    Adds today's partition to the raw table of every changed table. Each
+    partition keeps its own header as columns, so older days still read
+    correctly after UTA adds a column. Safe to re-run (existing partitions
+    are left as they are).
+    """
+    dt = partition_date(body)
+    registered = []
+    for table in body.get('changed_tables', []):
+        columns = read_header(s3, bucket, f"{body['partition']}/{table}/{table}.txt")
+        ensure_table(glue, database, table, bucket, columns)
+        partition = {
+            'Values': [dt],
+            'StorageDescriptor': storage_descriptor(f"s3://{bucket}/{body['partition']}/{table}/", columns),
+        }
+        response = glue.batch_create_partition(DatabaseName=database, TableName=table,
+                                               PartitionInputList=[partition])
+        errors = [e['ErrorDetail'] for e in response.get('Errors', [])
+                  if e['ErrorDetail'].get('ErrorCode') != 'AlreadyExistsException']
+        if errors:
+            raise RuntimeError(f"Could not register {database}.{table} {PARTITION_KEY}={dt}: {errors}")
+        print(f"📇 {database}.{table}: {PARTITION_KEY}={dt}")
+        registered.append(table)
+    return registered
+
+
+def table_payloads(body, action, tables):
+    return [json.dumps({'action': action, 'table': table, 'partition': body['partition']}) for table in tables]
+
+
+def conversion_payloads(body):
+    """
+    One Lambda event per changed table that has a Parquet copy. None when
+    the Lambda reports Parquet output off (PARQUET_OUTPUT=false or no pyarrow).
+    """
+    if not body.get('parquet_output', True):
+        return []
+    return table_payloads(body, 'convert', [t for t in body.get('changed_tables', []) if t in PARQUET_TABLES])
+
+
+def validation_payloads(body):
+    """One Lambda event per changed table."""
+    return table_payloads(body, 'validate', body.get('changed_tables', []))
+
+
+def view_queries(body):
+    """CREATE OR REPLACE VIEW for every changed table that has a clean view."""
+    dt = partition_date(body)
+    return [f"CREATE OR REPLACE VIEW {CLEAN_DATABASE}.{table} AS{CLEAN_VIEWS[table].format(dt=dt)}"
+            for table in body.get('changed_tables', []) if table in CLEAN_VIEWS]
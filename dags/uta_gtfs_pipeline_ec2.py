@@ -1,14 +1,52 @@
 from airflow import DAG
+from airflow.operators.python import PythonOperator, ShortCircuitOperator
+from airflow.providers.amazon.aws.hooks.base_aws import AwsBaseHook
+from airflow.providers.amazon.aws.operators.athena import AthenaOperator
 from airflow.providers.amazon.aws.operators.lambda_function import LambdaInvokeFunctionOperator
-from airflow.providers.amazon.aws.operators.glue_crawler import GlueCrawlerOperator
 import pendulum
 from datetime import timedelta
 
+from gtfs_catalog import (CLEAN_DATABASE, conversion_payloads, parse_ingest_response, register_partitions,
+                          validation_payloads, view_queries)
+
 # CONFIGURATION
 LAMBDA_FUNCTION_NAME = 'uta-gtfs-ingest'
-GLUE_CRAWLER_NAME = 'uta-gtfs-crawler'
+# Same bucket as the ingest Lambda's BUCKET_NAME
+BUCKET_NAME = 'your-bucket-name'
+ATHENA_OUTPUT = f's3://{BUCKET_NAME}/athena-results/'
+
 AWS_REGION = 'us-east-1'
 
+# Table conversion is done by the mapped tasks below, not by the ingest
+# call. Trigger with {"force": true} to re-ingest (and re-register) every table.
+INGEST_PAYLOAD = '{"parquet": false, "force": {{ (dag_run.conf or {}).get("force", false) | tojson }}}'
+
+
+def archive_changed(ti):
+    """
+    Reads the ingest Lambda's response from XCom. The Lambda reports
+    'changed': false when UTA's archive (or every table in it) is unchanged,
+    in which case there is nothing new to register and the run stops here.
+    """
+    body = parse_ingest_response(ti.xcom_pull(task_ids='ingest_gtfs_data'))
+    print(f"Changed tables: {body.get('changed_tables')}")
+    return body.get('changed', True)
+
+
+def register_changed_partitions(ti):
+    """
+    Registers today's raw partition of each changed table in the Glue
+    catalog (no crawler), then hands the per-table work to the mapped tasks.
+    """
+    body = parse_ingest_response(ti.xcom_pull(task_ids='ingest_gtfs_data'))
+    glue = AwsBaseHook(aws_conn_id=None, client_type='glue', region_name=AWS_REGION).get_conn()
+    s3 = AwsBaseHook(aws_conn_id=None, client_type='s3', region_name=AWS_REGION).get_conn()
+    register_partitions(glue, s3, BUCKET_NAME, body)
+    ti.xcom_push(key='convert', value=conversion_payloads(body))
+    ti.xcom_push(key='validate', value=validation_payloads(body))
+    ti.xcom_push(key='views', value=view_queries(body))
+
+
 default_args = {
     'owner': 'ec2-user',
     'depends_on_past': False,
@@ -33,16 +71,52 @@ with DAG(
         function_name=LAMBDA_FUNCTION_NAME,
         invocation_type='RequestResponse',
         log_type='Tail',
+        payload=INGEST_PAYLOAD,
         region_name=AWS_REGION,
         aws_conn_id=None,
     )
 
-    # Step 2: Trigger Crawler
-    crawler_task = GlueCrawlerOperator(
-        task_id='catalog_data',
-        config={'Name': GLUE_CRAWLER_NAME},
+    # Step 2: Skip the rest of the run when nothing changed
+    check_changed_task = ShortCircuitOperator(
+        task_id='check_archive_changed',
+        python_callable=archive_changed,
+    )
+
+    # Step 3: Register only the new partitions (replaces the full Glue crawl)
+    register_task = PythonOperator(
+        task_id='register_partitions',
+        python_callable=register_changed_partitions,
+    )
+
+    # Step 4: Convert each changed core table to Parquet, one Lambda call per table, in parallel
+    convert_task = LambdaInvokeFunctionOperator.partial(
+        task_id='convert_table',
+        function_name=LAMBDA_FUNCTION_NAME,
+        invocation_type='RequestResponse',
+        log_type='Tail',
         region_name=AWS_REGION,
         aws_conn_id=None,
-    )
+    ).expand(payload=register_task.output['convert'])
+
+    # Step 5: Validate each changed table (runs even when no core table needed converting)
+    validate_task = LambdaInvokeFunctionOperator.partial(
+        task_id='validate_table',
+        function_name=LAMBDA_FUNCTION_NAME,
+        invocation_type='RequestResponse',
+        log_type='Tail',
+        region_name=AWS_REGION,
+        aws_conn_id=None,
+        trigger_rule='none_failed',
+    ).expand(payload=register_task.output['validate'])
+
+    # Step 6: Point the clean views of the changed tables at their new partition
+    refresh_views_task = AthenaOperator.partial(
+        task_id='refresh_clean_view',
+        database=CLEAN_DATABASE,
+        output_location=ATHENA_OUTPUT,
+        region_name=AWS_REGION,
+        aws_conn_id=None,
+        trigger_rule='none_failed',
+    ).expand(query=register_task.output['views'])
 
-    ingest_task >> crawler_task
\ No newline at end of file
+    ingest_task >> check_changed_task >> register_task >> convert_task >> validate_task >> refresh_views_task
\ No newline at end of file
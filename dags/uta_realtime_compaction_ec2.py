@@ -0,0 +1,38 @@
+from airflow import DAG
+from airflow.providers.amazon.aws.operators.lambda_function import LambdaInvokeFunctionOperator
+import pendulum
+from datetime import timedelta
+
+# CONFIGURATION
+COMPACTION_FUNCTION_NAME = 'uta-realtime-compaction'
+
+AWS_REGION = 'us-east-1'
+
+default_args = {
+    'owner': 'ec2-user',
+    'depends_on_past': False,
+    'email_on_failure': False,
+    'retries': 1,
+    'retry_delay': timedelta(minutes=5),
+}
+
+with DAG(
+    'uta_realtime_compaction',
+    default_args=default_args,
+    description='Hourly compaction of the realtime vehicle archive running on EC2',
+    # 20 past every hour; the Lambda only touches hours that ended 2h ago
+    schedule='20 * * * *',
+    start_date=pendulum.datetime(2025, 11, 1, tz="UTC"),
+    catchup=False,
+    max_active_runs=1,
+) as dag:
+
+    # Merge small archive files into one sorted Parquet file per hour
+    compact_task = LambdaInvokeFunctionOperator(
+        task_id='compact_realtime_archive',
+        function_name=COMPACTION_FUNCTION_NAME,
+        invocation_type='RequestResponse',
+        log_type='Tail',
+        region_name=AWS_REGION,
+        aws_conn_id=None,
+    )
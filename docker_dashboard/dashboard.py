@@ -1,87 +1,100 @@
+import os
+import sys
 import time
-import json
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
 import boto3
+import numpy as np
 import pandas as pd
 import streamlit as st
 
+# Shared helpers live in scripts/ (the Docker image copies them next to this file)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from spatial_index import REGIONS, StopIndex
+from stream_hub import StreamHub
+from vehicle_store import VehicleStore
+
 # --- CONFIGURATION ---
 STREAM_NAME = "uta-gtfs-kinesis-stream-v2"
 REGION_NAME = "us-east-1"
+LIST_ROWS = 200   # fastest vehicles shown in the side list
+# GTFS zip, stops.txt or the typed stops Parquet; enables the nearest-stop panel
+STOPS_PATH = os.environ.get("STOPS_PATH")
+# Time-indexed archive written by archive.py (local dir or s3://); Replay Mode reads it
+ARCHIVE_ROOT = os.environ.get("ARCHIVE_ROOT")
+DISPLAY_TIMEZONE = ZoneInfo("America/Denver")
+PLAYBACK_SPEEDS = [1, 10, 30, 60, 300, 900]
+# Stream of headway.py events (bunching/gaps per route); enables that panel
+HEADWAY_STREAM_NAME = os.environ.get("HEADWAY_STREAM_NAME")
 
 @st.cache_resource
 def get_kinesis_client():
     return boto3.client('kinesis', region_name=REGION_NAME)
 
-client = get_kinesis_client()
-
-# --- HELPER FUNCTIONS ---
-
-def get_initial_iterator(mode):
+@st.cache_resource
+def get_stream_hub():
     """
-    LATEST: Start reading from now.
-    TRIM_HORIZON: Start reading from the oldest record in the stream (up to 24h).
+    One background Kinesis reader per server process, shared by all sessions.
+    Sessions never call get_records themselves.
     """
-    response = client.describe_stream(StreamName=STREAM_NAME)
-    shard_id = response['StreamDescription']['Shards'][0]['ShardId']
-    
-    iterator_type = 'LATEST' if mode == 'Live Mode' else 'TRIM_HORIZON'
-    
-    return client.get_shard_iterator(
-        StreamName=STREAM_NAME,
-        ShardId=shard_id,
-        ShardIteratorType=iterator_type
-    )['ShardIterator']
+    return StreamHub(get_kinesis_client(), STREAM_NAME, archive_root=ARCHIVE_ROOT,
+                     events_stream_name=HEADWAY_STREAM_NAME)
+
+@st.cache_resource
+def get_stop_index():
+    """Grid index over the stops table, built once per server process."""
+    if not STOPS_PATH:
+        return None
+    return StopIndex.load(STOPS_PATH)
+
+hub = get_stream_hub()
+
+# --- HELPER FUNCTIONS ---
 
 def fetch_records():
     """
-    Fetches records using the SAVED iterator in session state.
+    Live Mode: returns the hub's current immutable snapshot of all vehicles.
+    Replay Mode: advances this session's Playback to the current playback
+    time and applies the chunk (numpy columns) to the session's VehicleStore.
+    Returns (VehicleFrame, lag_seconds).
     """
-    # 1. Handle Mode Switching (Reset iterator if mode changes)
+    # 1. Handle Mode Switching (Start a new playback if mode changes)
     if 'last_mode' not in st.session_state:
         st.session_state['last_mode'] = st.session_state.view_mode
         
     if st.session_state.view_mode != st.session_state['last_mode']:
-        # Mode changed! Clear iterator to force a fresh start
-        if 'shard_iterator' in st.session_state:
-            del st.session_state['shard_iterator']
-        st.session_state['vehicle_map'] = {} # Clear map for replay
+        # Mode changed! Replay starts again from the chosen time
+        reset_playback()
         st.session_state['last_mode'] = st.session_state.view_mode
 
-    # 2. Get Iterator if missing
-    if 'shard_iterator' not in st.session_state:
-        try:
-            st.session_state['shard_iterator'] = get_initial_iterator(st.session_state.view_mode)
-        except Exception as e:
-            st.error(f"Error connecting to Kinesis: {e}")
-            return [], 0
-
-    # 3. Fetch Data
+    # 2. Live: read the shared snapshot
+    if st.session_state.view_mode == 'Live Mode':
+        snapshot = hub.snapshot()
+        return snapshot.vehicles, snapshot.lag_seconds
+
+    # 3. Replay: seek once per start time, then play at the chosen speed
+    playback = st.session_state.get('playback')
+    if playback is None or st.session_state.get('playback_start') != replay_start:
+        reset_playback()
+        playback = st.session_state['playback'] = hub.open_playback(replay_start, replay_speed)
+        st.session_state['playback_start'] = replay_start
+    elif playback.speed != replay_speed:
+        playback.set_speed(replay_speed)
     try:
-        response = client.get_records(
-            ShardIterator=st.session_state['shard_iterator'],
-            Limit=200 
-        )
-        # Store the pointer for the NEXT batch
-        st.session_state['shard_iterator'] = response['NextShardIterator']
-        
-        data = []
-        for r in response['Records']:
-            json_data = json.loads(r['Data'])
-            data.append(json_data)
-            
-        # Calculate Lag (Time difference between NOW and the record time)
-        lag = 0
-        if data:
-            last_ts = data[-1].get('source_timestamp', time.time())
-            lag = time.time() - last_ts
-            
-        return data, lag
-
+        st.session_state['replay_store'].apply_columns(playback.advance())
+        st.session_state['replay_error'] = None
     except Exception as e:
-        # If iterator expires, clear it
-        if 'shard_iterator' in st.session_state:
-            del st.session_state['shard_iterator']
-        return [], 0
+        # Like StreamHub.last_error: keep the page up, the same range is read again next rerun
+        st.session_state['replay_error'] = str(e)
+    return st.session_state['replay_store'].freeze(), time.time() - playback.cursor
+
+def reset_playback():
+    playback = st.session_state.pop('playback', None)
+    if playback is not None:
+        playback.close()
+    st.session_state.pop('playback_start', None)
+    st.session_state['replay_store'] = VehicleStore() # Clear store for replay
 
 # --- UI CONFIGURATION ---
 st.set_page_config(layout="wide", page_title="UTA Bus Tracker")
@@ -94,16 +107,32 @@ mode = st.sidebar.radio(
     "Stream Mode:", 
     ('Live Mode', 'Replay Mode'), 
     key="view_mode",
-    help="Live: Shows current location. Replay: Plays back history from Kinesis."
+    help="Live: Shows current location. Replay: Plays back history from the archive (and Kinesis)."
 )
 
+# 1b. Replay start time and speed
+replay_start, replay_speed = None, 1
+if mode == 'Replay Mode':
+    coverage = hub.archive_coverage()
+    if coverage:
+        first, last = (datetime.fromtimestamp(t, DISPLAY_TIMEZONE) for t in coverage)
+        st.sidebar.caption(f"Archive: {first:%Y-%m-%d %H:%M} → {last:%Y-%m-%d %H:%M}")
+    # Fixed once per session, so the inputs keep their value across reruns
+    if 'replay_default' not in st.session_state:
+        st.session_state['replay_default'] = datetime.now(DISPLAY_TIMEZONE) - timedelta(hours=1)
+    default_start = st.session_state['replay_default']
+    replay_date = st.sidebar.date_input("Replay from (date)", default_start.date())
+    replay_time = st.sidebar.time_input("Replay from (time)", default_start.time().replace(second=0, microsecond=0))
+    replay_start = datetime.combine(replay_date, replay_time, DISPLAY_TIMEZONE).timestamp()
+    replay_speed = st.sidebar.select_slider("Playback speed (x real time)", PLAYBACK_SPEEDS, value=60)
+
 # 2. Speed Filter
 min_speed = st.sidebar.slider("Filter: Min Speed (MPH)", 0, 60, 0)
 
-# 3. City/Region Filter (Lat/Lon Bounding Box Logic)
+# 3. City/Region Filter (named polygons from spatial_index.REGIONS)
 region_filter = st.sidebar.selectbox(
     "Filter: Region",
-    ["All Regions", "Salt Lake City", "Ogden (North)", "Provo (South)"]
+    ["All Regions"] + list(REGIONS)
 )
 
 # 4. Vehicle Specific Filter
@@ -113,88 +142,106 @@ if 'all_vehicle_ids' not in st.session_state:
 
 selected_vehicles = st.sidebar.multiselect(
     "Filter: Specific Vehicle ID",
-    options=sorted(list(st.session_state['all_vehicle_ids']))
+    options=st.session_state.get('vehicle_id_options', [])
 )
 
 # Reset Button
 if st.sidebar.button("Reset Stream"):
-    if 'shard_iterator' in st.session_state:
-        del st.session_state['shard_iterator']
-        st.session_state['vehicle_map'] = {}
+    reset_playback()
     st.rerun()
 
 st.title("UTA Real-Time Tracker")
 
 # --- MAIN DATA LOOP ---
-if 'vehicle_map' not in st.session_state:
-    st.session_state['vehicle_map'] = {}
+if 'replay_store' not in st.session_state:
+    st.session_state['replay_store'] = VehicleStore()
 
-# Fetch Batch
-new_records, lag_seconds = fetch_records()
+# Read the shared snapshot (Live) or this session's playback position (Replay)
+frame, lag_seconds = fetch_records()
 
-# Update Cache
-if new_records:
-    for record in new_records:
-        v_id = record['id']
-        st.session_state['vehicle_map'][v_id] = record
-        st.session_state['all_vehicle_ids'].add(v_id)
+# Only re-sort the id options when new vehicles show up
+seen = st.session_state['all_vehicle_ids']
+new_ids = set(frame.ids.tolist()) - seen
+if new_ids:
+    seen.update(new_ids)
+    st.session_state['vehicle_id_options'] = sorted(seen)
 
-# --- DISPLAY LOGIC ---
-if st.session_state['vehicle_map']:
-    # Convert dict to DataFrame
-    df = pd.DataFrame(list(st.session_state['vehicle_map'].values()))
-    
-    # Cleaning
-    df['latitude'] = pd.to_numeric(df['latitude'])
-    df['longitude'] = pd.to_numeric(df['longitude'])
-    if 'speed_mph' not in df.columns: df['speed_mph'] = 0.0
+if hub.last_error:
+    st.sidebar.error(f"Kinesis: {hub.last_error}")
+if mode == 'Replay Mode' and st.session_state.get('replay_error'):
+    st.sidebar.error(f"Replay: {st.session_state['replay_error']}")
 
+# --- DISPLAY LOGIC ---
+if len(frame):
     # --- APPLY FILTERS ---
-    
-    # 1. Speed
-    df = df[df['speed_mph'] >= min_speed]
-    
-    # 2. Region (Approximate Latitudes)
-    if region_filter == "Ogden (North)":
-        df = df[df['latitude'] > 41.1]
-    elif region_filter == "Provo (South)":
-        df = df[df['latitude'] < 40.5]
-    elif region_filter == "Salt Lake City":
-        df = df[(df['latitude'] >= 40.5) & (df['latitude'] <= 41.1)]
-        
-    # 3. Specific Vehicle
-    if selected_vehicles:
-        df = df[df['id'].isin(selected_vehicles)]
-
-    # Map Config
-    df['color'] = df['speed_mph'].apply(lambda x: '#00ff00' if x > 1 else '#ff0000')
+    # Speed, region and vehicle id combine into one boolean mask over the columns
+    mask = frame.mask(
+        min_speed=min_speed,
+        region=REGIONS.get(region_filter),
+        vehicle_ids=selected_vehicles,
+    )
+
+    # Map Config (only the selected rows are copied out)
+    map_df = pd.DataFrame({
+        'lat': frame.columns['latitude'][mask],
+        'lon': frame.columns['longitude'][mask],
+        'color': frame.colors(mask),
+    })
     
     # Layout
     col1, col2 = st.columns([3, 1])
     
     with col1:
-        st.map(df.rename(columns={'latitude': 'lat', 'longitude': 'lon'}), color='color', zoom=10, use_container_width=True)
+        st.map(map_df, color='color', zoom=10, use_container_width=True)
         
     with col2:
-        st.metric("Active Vehicles", len(df))
+        st.metric("Active Vehicles", len(map_df))
+        on_time = frame.on_time_share(mask)
+        if on_time is not None:
+            st.metric("On Time", f"{on_time:.0%}", help="Between 1 min early and 5 min late, vehicles matched to the schedule")
         
         # Lag Indicator
         if mode == 'Replay Mode':
-            st.warning(f"Replay Lag: {lag_seconds/60:.1f} min behind")
+            played = datetime.fromtimestamp(time.time() - lag_seconds, DISPLAY_TIMEZONE)
+            st.warning(f"Replay at {played:%Y-%m-%d %H:%M:%S} ({lag_seconds/60:.1f} min behind, {replay_speed}x)")
         else:
             st.success("Live Feed")
             
         st.write("#### Vehicle List")
         st.dataframe(
-            df[['id', 'speed_mph', 'latitude', 'longitude', 'trip_id']].sort_values(by='speed_mph', ascending=False),
+            frame.to_frame(frame.top_by_speed(mask, LIST_ROWS)),
             hide_index=True
         )
 
+        # Nearest stops for the selected vehicles (grid lookup, no scan of all stops)
+        stop_index = get_stop_index()
+        if stop_index is not None and selected_vehicles:
+            st.write("#### Nearest Stops")
+            rows = np.flatnonzero(mask)[:10]
+            nearest = []
+            for row in rows:
+                for stop in stop_index.nearest(frame.columns['latitude'][row], frame.columns['longitude'][row], k=3):
+                    nearest.append({'vehicle': frame.ids[row], **stop})
+            st.dataframe(pd.DataFrame(nearest), hide_index=True)
+
+    # Bunching and gaps per route (from the headway stream, read once by the hub)
+    if HEADWAY_STREAM_NAME:
+        st.write("#### Bunching & Gaps")
+        routes_col, events_col = st.columns([1, 2])
+        with routes_col:
+            routes = hub.route_headways()
+            if routes:
+                st.dataframe(pd.DataFrame(routes).drop(columns=['event']), hide_index=True)
+        with events_col:
+            events = hub.headway_events()
+            if events:
+                st.dataframe(pd.DataFrame(events), hide_index=True)
+
 else:
     st.info("Just waiting for the data guys... We make sure Lambda is running")
 
 # Refresh Rate
-# Replay Mode runs faster to "catch up"
+# Replay Mode redraws faster so fast playback stays smooth
 refresh_rate = 0.5 if mode == 'Replay Mode' else 2.0
 time.sleep(refresh_rate)
 st.rerun()
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""
+One Kinesis reader per Streamlit server process, shared by every session.
+
+Before this, each browser session kept its own shard iterator and called
+get_records on every rerun, so N viewers meant N times the reads and we hit
+the 5 reads/sec/shard limit. The hub instead runs:
+
+- a live thread (LATEST) that applies each batch to one columnar
+  VehicleStore and publishes a frozen, versioned VehicleFrame of it, so
+  sessions only ever read an immutable snapshot.
+- no replay thread: each replay session gets its own archive.Playback,
+  which seeks the time-indexed Parquet archive (one shared ArchiveReader,
+  so hourly indexes are read once) and only opens an AT_TIMESTAMP Kinesis
+  iterator for the part newer than the archive.
+- optionally, an events thread (LATEST) on the headway stream written by
+  headway.py: recent bunching/gap events and the latest counters per route.
+
+Live reads therefore stay the same no matter how many viewers there are;
+replay only touches the stream for the last few minutes not archived yet.
+"""
+import threading
+import time
+from collections import deque, namedtuple
+
+from archive import ArchiveReader, Playback
+from kinesis_consumer import KinesisConsumer
+from vehicle_store import VehicleStore
+
+POLL_INTERVAL = 1.0          # seconds between reads (stays under 5 reads/s/shard)
+EVENT_LOG_SIZE = 200         # headway events kept for the dashboards
+
+Snapshot = namedtuple("Snapshot", ["version", "vehicles", "lag_seconds", "updated_at"])
+
+
+class StreamHub:
+
+    def __init__(self, client, stream_name, poll_interval=POLL_INTERVAL, archive_root=None,
+                 events_stream_name=None):
+        self.client = client
+        self.stream_name = stream_name
+        self.events_stream_name = events_stream_name
+        self.poll_interval = poll_interval
+        self.last_error = None
+
+        self._snapshot = Snapshot(0, VehicleStore(capacity=0).freeze(), 0.0, None)
+        self._live_store = VehicleStore()
+        self._live_lock = threading.Lock()
+
+        self.archive = ArchiveReader(archive_root) if archive_root else None
+
+        self._events = deque(maxlen=EVENT_LOG_SIZE)   # newest last
+        self._routes = {}        # (route_id, direction_id) -> latest route counters
+
+        self._live_thread = threading.Thread(target=self._run_live, name="stream-hub-live", daemon=True)
+        self._live_thread.start()
+        if events_stream_name:
+            self._events_thread = threading.Thread(target=self._run_events, name="stream-hub-events", daemon=True)
+            self._events_thread.start()
+
+    # --- Background readers --------------------------------------------
+
+    def _run_live(self):
+        consumer = None
+        while True:
+            try:
+                if consumer is None:
+                    consumer = KinesisConsumer(self.client, self.stream_name, initial_position='LATEST', limit=1000)
+                records = consumer.poll_vehicles()
+                if records:
+                    with self._live_lock:
+                        self._live_store.apply(records)
+                        frame = self._live_store.freeze()
+                    previous = self._snapshot
+                    # Publish a new immutable snapshot; readers holding the old one are unaffected
+                    self._snapshot = Snapshot(
+                        previous.version + 1,
+                        frame,
+                        consumer.max_lag_ms() / 1000,
+                        time.time(),
+                    )
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            time.sleep(self.poll_interval)
+
+    def _run_events(self):
+        consumer = None
+        while True:
+            try:
+                if consumer is None:
+                    consumer = KinesisConsumer(self.client, self.events_stream_name, initial_position='LATEST', limit=1000)
+                for event in consumer.poll_vehicles():
+                    if event.get('event') == 'route':
+                        self._routes[(event.get('route_id'), event.get('direction_id'))] = event
+                    else:
+                        self._events.append(event)
+            except Exception as e:
+                self.last_error = str(e)
+            time.sleep(self.poll_interval)
+
+    # --- Session API ---------------------------------------------------
+
+    def snapshot(self):
+        """The latest live snapshot (immutable, safe to keep across reruns)."""
+        return self._snapshot
+
+    def headway_events(self, limit=50):
+        """Most recent bunching/gap/cleared events, newest first."""
+        events = list(self._events)
+        return events[::-1][:limit]
+
+    def route_headways(self):
+        """Latest counters per route and direction, most bunched first."""
+        routes = list(self._routes.values())
+        return sorted(routes, key=lambda r: (-(r.get('bunching') or 0), -(r.get('gaps') or 0), str(r.get('route_id'))))
+
+    def open_playback(self, start_ts, speed=1.0):
+        """A Playback for one replay session, starting at start_ts (unix seconds)."""
+        return Playback(start_ts, speed, archive=self.archive, client=self.client, stream_name=self.stream_name)
+
+    def archive_coverage(self):
+        """(first ts, last ts) of the archive, or None without one."""
+        return self.archive.coverage() if self.archive is not None else None
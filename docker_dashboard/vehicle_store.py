@@ -0,0 +1,218 @@
+"""
+Columnar vehicle state for the dashboard.
+
+Instead of a dict of record dicts that is turned into a new DataFrame (with
+pd.to_numeric and a per-row .apply) on every rerun, vehicles live in numpy
+columns with an id -> row index:
+
+- VehicleStore.apply(records) updates rows in place from each new batch
+  (tombstones swap-remove the row), so the cost follows the batch size,
+  not the history. apply_columns() does the same for numpy columns read
+  from the archive during playback.
+- VehicleStore.freeze() returns a read-only VehicleFrame that sessions can
+  share. Filters and colours are vectorized masks over its columns, and a
+  DataFrame is only built for the rows actually shown.
+"""
+import numpy as np
+import pandas as pd
+
+from spatial_index import points_in_polygon
+
+MOVING_COLOR = '#00ff00'
+STOPPED_COLOR = '#ff0000'
+MOVING_MPH = 1.0
+
+# (column name, dtype, value used when the record does not have the field)
+COLUMNS = [
+    ('trip_id', object, ''),
+    ('route_id', object, ''),
+    ('latitude', np.float64, np.nan),
+    ('longitude', np.float64, np.nan),
+    ('speed_mph', np.float32, 0.0),
+    ('bearing', np.float32, np.nan),
+    ('delay_seconds', np.float32, np.nan),
+    ('next_stop_id', object, ''),
+    ('schedule_status', object, ''),
+    ('vehicle_timestamp', np.int64, 0),
+    ('source_timestamp', np.int64, 0),
+]
+
+
+def _empty_columns(capacity):
+    columns = {'id': np.empty(capacity, dtype=object)}
+    for name, dtype, default in COLUMNS:
+        columns[name] = np.full(capacity, default, dtype=dtype)
+    return columns
+
+
+class VehicleFrame:
+    """Read-only, columnar snapshot of the fleet."""
+
+    def __init__(self, columns, version=0):
+        self.columns = columns
+        self.version = version
+        for values in columns.values():
+            values.flags.writeable = False
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    @property
+    def ids(self):
+        return self.columns['id']
+
+    def mask(self, min_speed=0, region=None, vehicle_ids=None):
+        """Boolean mask for the speed, region (a (lat, lon) polygon) and vehicle-id filters."""
+        keep = self.columns['speed_mph'] >= min_speed
+        latitude = self.columns['latitude']
+        longitude = self.columns['longitude']
+        if region is not None:
+            keep &= points_in_polygon(latitude, longitude, region)
+        if vehicle_ids:
+            keep &= np.isin(self.columns['id'], list(vehicle_ids))
+        return keep
+
+    def colors(self, mask=None):
+        speed = self.columns['speed_mph'] if mask is None else self.columns['speed_mph'][mask]
+        return np.where(speed > MOVING_MPH, MOVING_COLOR, STOPPED_COLOR)
+
+    def on_time_share(self, mask):
+        """Share of the selected vehicles matched to the schedule that are on time (None if none)."""
+        status = self.columns['schedule_status'][mask]
+        matched = np.isin(status, ['early', 'on_time', 'late'])
+        if not matched.any():
+            return None
+        return float((status[matched] == 'on_time').mean())
+
+    def to_frame(self, mask, names=('id', 'speed_mph', 'delay_seconds', 'next_stop_id', 'latitude', 'longitude',
+                                    'trip_id')):
+        """DataFrame of only the selected rows and columns."""
+        return pd.DataFrame({name: self.columns[name][mask] for name in names})
+
+    def top_by_speed(self, mask, limit):
+        """Row numbers of the `limit` fastest selected vehicles, fastest first."""
+        rows = np.flatnonzero(mask)
+        speed = self.columns['speed_mph'][rows]
+        if len(rows) > limit:
+            keep = np.argpartition(-speed, limit - 1)[:limit]
+            rows, speed = rows[keep], speed[keep]
+        return rows[np.argsort(-speed, kind='stable')]
+
+
+class VehicleStore:
+    """Mutable columnar store, updated in place from record batches."""
+
+    def __init__(self, capacity=1024):
+        self.columns = _empty_columns(capacity)
+        self.index = {}          # vehicle id -> row
+        self.size = 0
+        self.version = 0
+
+    def _grow(self, needed):
+        capacity = len(self.columns['id'])
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        grown = _empty_columns(new_capacity)
+        for name, values in self.columns.items():
+            grown[name][:self.size] = values[:self.size]
+        self.columns = grown
+
+    def _remove(self, vehicle_id):
+        row = self.index.pop(vehicle_id, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            # Move the last row into the hole so rows stay contiguous
+            for values in self.columns.values():
+                values[row] = values[last]
+            self.index[self.columns['id'][row]] = row
+        self.size = last
+
+    def apply(self, records):
+        """Upserts a batch of vehicle records; tombstones remove the vehicle."""
+        if not records:
+            return
+        # Last record per vehicle wins within a batch
+        latest = {}
+        for record in records:
+            latest[record['id']] = record
+
+        updates = []
+        for vehicle_id, record in latest.items():
+            if record.get('deleted'):
+                self._remove(vehicle_id)
+            else:
+                updates.append(record)
+        if not updates:
+            self.version += 1
+            return
+
+        self._grow(self.size + len(updates))
+        rows = np.empty(len(updates), dtype=np.int64)
+        for i, record in enumerate(updates):
+            vehicle_id = record['id']
+            row = self.index.get(vehicle_id)
+            if row is None:
+                row = self.size
+                self.index[vehicle_id] = row
+                self.columns['id'][row] = vehicle_id
+                self.size += 1
+            rows[i] = row
+
+        # One vectorized assignment per column for the whole batch
+        for name, dtype, default in COLUMNS:
+            values = [record.get(name) for record in updates]
+            values = [default if v is None else v for v in values]
+            self.columns[name][rows] = np.asarray(values, dtype=dtype)
+        self.version += 1
+
+    def apply_columns(self, columns):
+        """
+        Same as apply() for a batch already in numpy columns (archive
+        playback), without building a dict per record. Only the last row of
+        each vehicle in the batch is applied.
+        """
+        ids = columns['id']
+        if not len(ids):
+            return
+        # Last occurrence of each id: first occurrence in the reversed batch
+        _, first_reversed = np.unique(ids[::-1], return_index=True)
+        last = np.sort(len(ids) - 1 - first_reversed)
+        deleted = columns.get('deleted')
+        if deleted is not None:
+            for vehicle_id in ids[last[deleted[last]]].tolist():
+                self._remove(vehicle_id)
+            last = last[~deleted[last]]
+        if not len(last):
+            self.version += 1
+            return
+
+        update_ids = ids[last].tolist()
+        self._grow(self.size + len(update_ids))
+        rows = np.empty(len(update_ids), dtype=np.int64)
+        for i, vehicle_id in enumerate(update_ids):
+            row = self.index.get(vehicle_id)
+            if row is None:
+                row = self.size
+                self.index[vehicle_id] = row
+                self.columns['id'][row] = vehicle_id
+                self.size += 1
+            rows[i] = row
+
+        for name, dtype, default in COLUMNS:
+            if name not in columns:
+                self.columns[name][rows] = default
+                continue
+            values = columns[name][last]
+            # Missing values (None, or NaN in archive float columns) get the
+            # same default as apply(), e.g. speed 0 rather than NaN
+            if values.dtype == object or values.dtype.kind == 'f':
+                values = np.where(pd.isna(values), default, values)
+            self.columns[name][rows] = values.astype(dtype, copy=False)
+        self.version += 1
+
+    def freeze(self):
+        """Read-only copy of the live rows, safe to hand to other threads."""
+        return VehicleFrame({name: values[:self.size].copy() for name, values in self.columns.items()}, self.version)
@@ -0,0 +1,240 @@
+"""
+Schedule adherence for every vehicle in a poll.
+
+Joins the realtime records (trip_id, lat/lon, vehicle_timestamp) to the
+compiled schedule index (schedule_index.py, version 2 with shapes):
+
+1. The first time a trip shows up, its shape and stop_times are turned
+   into a TripPlan: the shape as planar x/y metres, the distance along it
+   of every stop, and the scheduled arrival/departure seconds. Plans are
+   cached, so later updates never touch the index.
+2. Each vehicle is projected onto its trip's shape. The search starts at
+   the segment where the vehicle was last time and only falls back to all
+   segments when it is not near, so an update costs a few microseconds.
+3. Bisecting the stop distances gives the last and next stop; the scheduled
+   time at the vehicle's position is interpolated between them by distance.
+4. delay_seconds = observed local time - scheduled time (positive = late).
+
+Adds to each record: delay_seconds, last_stop_id, next_stop_id,
+shape_dist_m, direction_id and schedule_status ('early', 'on_time', 'late'
+or 'unmatched' when the trip is unknown, has fewer than two scheduled stops,
+or the vehicle is far off its shape).
+"""
+import math
+import os
+from bisect import bisect_right
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from schedule_index import EARTH_RADIUS_M, ScheduleIndex, project_onto_polyline
+
+SERVICE_TIMEZONE = "America/Denver"
+MAX_OFF_ROUTE_M = 200.0      # farther than this from the shape: not on its trip
+WINDOW_BEFORE = 2            # segments searched behind the last known segment
+WINDOW_AFTER = 64            # at most this many segments ahead of it
+WALK_PAST_M = 100.0          # stop walking once segments are this much farther than the best
+WINDOW_MAX_OFFSET_M = 40.0   # a windowed match farther than this triggers a full search
+
+# On-time window (seconds): up to 1 minute early, up to 5 minutes late
+EARLY_SECONDS = -60
+LATE_SECONDS = 300
+
+
+class TripPlan:
+    """Per-trip lookup arrays as plain Python lists (fast scalar access)."""
+
+    __slots__ = ("trip_id", "route_id", "direction_id", "kx", "ky", "xs", "ys", "cum", "segments", "stop_dist", "stop_ids", "arrivals",
+                 "departures")
+
+    def __init__(self, index, trip):
+        self.trip_id = index.trip_ids[trip]
+        self.route_id = index.route_ids[int(index.trip_route[trip])]
+        direction = int(index.trip_direction[trip]) if hasattr(index, "trip_direction") else -1
+        self.direction_id = direction if direction >= 0 else None
+        rows = index.trip_rows(trip)
+        stops = index.st_stop[rows]
+        lat0 = float(index.stop_lat[stops].mean())
+        self.kx = math.radians(1) * EARTH_RADIUS_M * math.cos(math.radians(lat0))
+        self.ky = math.radians(1) * EARTH_RADIUS_M
+
+        shape = int(index.trip_shape[trip])
+        if shape >= 0:
+            shape_rows = index.shape_rows(shape)
+            lats, lons = index.shape_lat[shape_rows], index.shape_lon[shape_rows]
+        else:
+            lats, lons = index.stop_lat[stops], index.stop_lon[stops]
+        self.xs = (lons * self.kx).tolist()
+        self.ys = (lats * self.ky).tolist()
+        cum = [0.0]
+        for i in range(1, len(self.xs)):
+            cum.append(cum[-1] + math.hypot(self.xs[i] - self.xs[i - 1], self.ys[i] - self.ys[i - 1]))
+        self.cum = cum
+        # Per segment: (x0, y0, dx, dy, 1 / length^2 or 0, distance at start, length)
+        self.segments = []
+        for i in range(len(self.xs) - 1):
+            dx, dy = self.xs[i + 1] - self.xs[i], self.ys[i + 1] - self.ys[i]
+            length_sq = dx * dx + dy * dy
+            self.segments.append((self.xs[i], self.ys[i], dx, dy, 1.0 / length_sq if length_sq else 0.0,
+                                  cum[i], cum[i + 1] - cum[i]))
+
+        self.stop_dist = index.st_dist[rows].tolist()
+        self.stop_ids = [index.stop_ids[s] for s in stops.tolist()]
+        self.arrivals = index.st_arr[rows].tolist()
+        self.departures = index.st_dep[rows].tolist()
+
+    def locate(self, lat, lon, hint=None):
+        """(distance along the shape, offset from it, segment) for one position."""
+        px, py = lon * self.kx, lat * self.ky
+        xs, ys, cum = self.xs, self.ys, self.cum
+        segments = len(xs) - 1
+        if segments < 1:
+            return 0.0, math.hypot(px - xs[0], py - ys[0]), 0
+
+        if hint is not None:
+            # Walk forward from where the vehicle was, until the shape clearly
+            # moves away from it again
+            best = None
+            best_offset = math.inf
+            for i in range(max(0, hint - WINDOW_BEFORE), min(segments, hint + WINDOW_AFTER)):
+                x0, y0, dx, dy, inv_length_sq, start, length = self.segments[i]
+                t = ((px - x0) * dx + (py - y0) * dy) * inv_length_sq
+                t = 0.0 if t < 0.0 else 1.0 if t > 1.0 else t
+                offset = math.hypot(x0 + t * dx - px, y0 + t * dy - py)
+                if offset < best_offset:
+                    best_offset = offset
+                    best = (start + t * length, offset, i)
+                elif offset > best_offset + WALK_PAST_M and i > hint:
+                    break
+            if best_offset <= WINDOW_MAX_OFFSET_M:
+                return best
+
+        # Full search (first sighting, or the vehicle left the window)
+        along, offset = project_onto_polyline(np.array(xs), np.array(ys), np.array(cum), px, py)
+        segment = max(0, min(segments - 1, bisect_right(cum, along) - 1))
+        return along, offset, segment
+
+    def scheduled_at(self, along):
+        """(scheduled seconds at this distance, last stop index, next stop index or None)."""
+        stop_dist = self.stop_dist
+        next_stop = bisect_right(stop_dist, along)
+        if next_stop == 0:
+            return self.departures[0], None, 0
+        last = next_stop - 1
+        if next_stop >= len(stop_dist):
+            return self.arrivals[last], last, None
+        span = stop_dist[next_stop] - stop_dist[last]
+        fraction = (along - stop_dist[last]) / span if span > 0 else 0.0
+        depart = self.departures[last]
+        arrive = self.arrivals[next_stop]
+        return depart + fraction * (arrive - depart), last, next_stop
+
+
+class AdherenceEngine:
+
+    def __init__(self, index, timezone=SERVICE_TIMEZONE, max_off_route_m=MAX_OFF_ROUTE_M):
+        if not index.has_shapes:
+            raise ValueError("Schedule index has no shape data; recompile it with schedule_index.py")
+        self.index = index
+        self.tz = ZoneInfo(timezone)
+        self.max_off_route_m = max_off_route_m
+        self._plans = {}      # trip_id -> TripPlan, or None for trips not in the index
+        self._segments = {}   # vehicle id -> (trip_id, last segment)
+        self._midnight = None  # (local date, unix time of its midnight)
+
+    def plan(self, trip_id):
+        """TripPlan of a scheduled trip, or None (the vehicle is 'unmatched')."""
+        if trip_id not in self._plans:
+            trip = self.index.trip_position(trip_id) if trip_id else -1
+            if trip >= 0:
+                rows = self.index.trip_rows(trip)
+                # In trips.txt but with fewer than 2 usable stop_times (e.g. all
+                # dropped for an unknown stop_id): nothing to measure along
+                if rows.stop - rows.start < 2:
+                    trip = -1
+            self._plans[trip_id] = TripPlan(self.index, trip) if trip >= 0 else None
+        return self._plans[trip_id]
+
+    def _local_seconds(self, timestamp):
+        """Seconds since local midnight of the service day the timestamp falls on."""
+        local = datetime.fromtimestamp(timestamp, self.tz)
+        if self._midnight is None or self._midnight[0] != local.date():
+            midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+            self._midnight = (local.date(), midnight.timestamp())
+        return timestamp - self._midnight[1]
+
+    def update(self, entity_list):
+        """Adds the adherence fields to every record in place. Returns a summary."""
+        summary = {"vehicles": len(entity_list), "matched": 0,
+                   "early": 0, "on_time": 0, "late": 0, "unmatched": 0}
+        seen = set()
+        for entity in entity_list:
+            vehicle_id = entity.get("id")
+            seen.add(vehicle_id)
+            result = self._match(vehicle_id, entity)
+            entity.update(result)
+            summary[result["schedule_status"]] += 1
+            if result["delay_seconds"] is not None:
+                summary["matched"] += 1
+
+        # Forget vehicles that left the feed
+        for vehicle_id in [v for v in self._segments if v not in seen]:
+            del self._segments[vehicle_id]
+        return summary
+
+    def _match(self, vehicle_id, entity):
+        unmatched = {"delay_seconds": None, "last_stop_id": None, "next_stop_id": None,
+                     "shape_dist_m": None, "direction_id": None, "schedule_status": "unmatched"}
+        lat, lon = entity.get("latitude"), entity.get("longitude")
+        timestamp = entity.get("vehicle_timestamp") or entity.get("source_timestamp")
+        trip_id = entity.get("trip_id")
+        plan = self.plan(trip_id)
+        if plan is None or lat is None or lon is None or not timestamp:
+            return unmatched
+
+        previous = self._segments.get(vehicle_id)
+        hint = previous[1] if previous and previous[0] == trip_id else None
+        along, offset, segment = plan.locate(lat, lon, hint)
+        if offset > self.max_off_route_m:
+            self._segments.pop(vehicle_id, None)
+            return unmatched
+        self._segments[vehicle_id] = (trip_id, segment)
+
+        scheduled, last, next_stop = plan.scheduled_at(along)
+        observed = self._local_seconds(timestamp)
+        # Trips after midnight are scheduled as 24:xx:xx on the previous service day
+        if observed + 43200 < scheduled:
+            observed += 86400
+        delay = int(round(observed - scheduled))
+
+        if delay < EARLY_SECONDS:
+            status = "early"
+        elif delay > LATE_SECONDS:
+            status = "late"
+        else:
+            status = "on_time"
+        return {
+            "delay_seconds": delay,
+            "last_stop_id": plan.stop_ids[last] if last is not None else None,
+            "next_stop_id": plan.stop_ids[next_stop] if next_stop is not None else None,
+            "shape_dist_m": round(along, 1),
+            "direction_id": plan.direction_id,
+            "schedule_status": status,
+        }
+
+
+def load_engine(location, download_dir="/tmp"):
+    """
+    AdherenceEngine over an index file. `location` is a local path or
+    s3://bucket/key (downloaded once into download_dir).
+    """
+    if location.startswith("s3://"):
+        import boto3
+
+        bucket, key = location[5:].split("/", 1)
+        path = os.path.join(download_dir, os.path.basename(key))
+        if not os.path.exists(path):
+            boto3.client("s3").download_file(bucket, key, path)
+        location = path
+    return AdherenceEngine(ScheduleIndex.open(location))
@@ -0,0 +1,578 @@
+"""
+Time-indexed archive of the vehicle stream, and replay from any moment.
+
+Kinesis only keeps a day of records and can only be read forward, so the
+archive keeps every vehicle position as hour-partitioned Parquet:
+
+    <root>/vehicles/dt=YYYY-MM-DD/hour=HH/part-<first ts>-<uuid>.parquet
+    <root>/index/dt=YYYY-MM-DD/hour=HH.json
+
+- ArchiveWriter micro-batches records (MAX_BATCH_ROWS or MAX_BATCH_SECONDS)
+  and writes one file per hour touched, sorted by time, in row groups of
+  ROW_GROUP_ROWS. The hour's index lists each file with its time range and
+  the time range and row offset of every row group, so a seek reads one
+  small JSON file and then only the row groups it needs.
+- compact_hour() merges a finished hour's small files into one, drops the
+  duplicates an at-least-once restart leaves, and sorts it by route_id,
+  trip_id, id and time so Athena can skip row groups on route filters
+  (sql/athena_realtime_tables.sql). Run hourly through archive_lambda.py.
+- ArchiveReader.read(start_ts, end_ts) returns numpy columns for a time
+  range, one Parquet read per overlapping row group.
+- Playback replays from a start time at a speed factor, loading CHUNK_SECONDS
+  of archive at a time. Past the end of the archive (the part not flushed
+  yet) it continues from Kinesis with an AT_TIMESTAMP iterator, as long as
+  that moment is inside the stream's retention.
+
+<root> is a local directory or s3://bucket/prefix (pyarrow file systems).
+For an S3-compatible store (MinIO, LocalStack) set ARCHIVE_S3_ENDPOINT.
+The time of a record is its source_timestamp (poll time), or its
+vehicle_timestamp when that is missing.
+
+    python scripts/archive.py write --stream uta_Gtfs_kinesis_stream --root s3://[BUCKET]/archive
+    python scripts/archive.py info --root s3://[BUCKET]/archive
+    python scripts/archive.py compact --root s3://[BUCKET]/archive
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+
+from vehicle_codec import FIELDS
+
+MAX_BATCH_ROWS = 200000       # flush when this many records are buffered
+MAX_BATCH_SECONDS = 300       # or when the oldest buffered record waited this long
+ROW_GROUP_ROWS = 20000        # seek granularity inside a file
+CHUNK_SECONDS = 600           # archive time loaded per playback read
+KINESIS_RETENTION_SECONDS = 24 * 3600
+KINESIS_POLL_SECONDS = 1.0    # a replay session reads each shard at most this often
+KINESIS_MAX_BACKOFF_SECONDS = 8.0
+INDEX_REFRESH_SECONDS = 30    # re-read an hour's index after this long (it may have grown)
+COMPACT_AFTER_SECONDS = 7200  # an hour is compacted once it ended this long ago
+COMPACT_ROW_GROUP_ROWS = 131072
+
+# Archive columns follow the stream's codec fields; lat/lon keep full precision
+TIME_COLUMN = "ts"
+_ARROW_TYPES = {"s": "string", "f": "float32", "q": "int64", "B": "bool"}
+ARCHIVE_COLUMNS = [(TIME_COLUMN, "int64")] + [
+    (name, "float64" if name in ("latitude", "longitude") else _ARROW_TYPES[type_code])
+    for name, type_code in FIELDS
+]
+_NUMPY_DEFAULTS = {"string": (object, None), "float32": (np.float32, np.nan), "float64": (np.float64, np.nan),
+                   "int64": (np.int64, 0), "bool": (bool, False)}
+
+
+def record_time(record):
+    return int(record.get("source_timestamp") or record.get("vehicle_timestamp") or 0)
+
+
+def hour_partition(ts):
+    moment = datetime.fromtimestamp(ts, timezone.utc)
+    return f"dt={moment:%Y-%m-%d}/hour={moment:%H}"
+
+
+def hour_start(ts):
+    return ts - ts % 3600
+
+
+def open_filesystem(root):
+    """(pyarrow FileSystem, base path) for a local directory or s3:// URI."""
+    from pyarrow import fs
+
+    if "://" not in root:
+        root = os.path.abspath(root)
+        os.makedirs(root, exist_ok=True)
+        return fs.LocalFileSystem(), root
+    endpoint = os.environ.get("ARCHIVE_S3_ENDPOINT")
+    if root.startswith("s3://") and endpoint:
+        return fs.S3FileSystem(endpoint_override=endpoint), root[5:].rstrip("/")
+    return fs.FileSystem.from_uri(root)
+
+
+def empty_columns():
+    return {name: np.empty(0, dtype=_NUMPY_DEFAULTS[arrow_type][0]) for name, arrow_type in ARCHIVE_COLUMNS}
+
+
+def records_to_columns(records):
+    """Vehicle dicts -> numpy columns in ARCHIVE_COLUMNS order, sorted by time."""
+    columns = {TIME_COLUMN: np.array([record_time(r) for r in records], dtype=np.int64)}
+    for name, arrow_type in ARCHIVE_COLUMNS[1:]:
+        dtype, default = _NUMPY_DEFAULTS[arrow_type]
+        values = [r.get(name) for r in records]
+        if dtype is not object:
+            values = [default if v is None else v for v in values]
+        columns[name] = np.array(values, dtype=dtype)
+    order = np.argsort(columns[TIME_COLUMN], kind="stable")
+    return {name: values[order] for name, values in columns.items()}
+
+
+def concat_columns(parts):
+    parts = [p for p in parts if len(p[TIME_COLUMN])]
+    if not parts:
+        return empty_columns()
+    if len(parts) == 1:
+        return parts[0]
+    return {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+
+
+def slice_columns(columns, start, stop):
+    return {name: values[start:stop] for name, values in columns.items()}
+
+
+def columns_to_table(columns):
+    import pyarrow as pa
+
+    schema = pa.schema([(name, arrow_type) for name, arrow_type in ARCHIVE_COLUMNS])
+    return pa.Table.from_pydict(
+        {name: pa.array(columns[name], type=arrow_type, from_pandas=True) for name, arrow_type in ARCHIVE_COLUMNS},
+        schema=schema,
+    )
+
+
+def row_group_ranges(times, row_group_rows):
+    """[min ts, max ts, first row] of every row group, for the index."""
+    return [[int(times[offset:offset + row_group_rows].min()), int(times[offset:offset + row_group_rows].max()),
+             int(offset)] for offset in range(0, len(times), row_group_rows)]
+
+
+def table_to_columns(table):
+    """Arrow table -> numpy columns. Columns added since a file was written get their default."""
+    import pyarrow.compute as pc
+
+    columns = {}
+    for name, arrow_type in ARCHIVE_COLUMNS:
+        dtype, default = _NUMPY_DEFAULTS[arrow_type]
+        if name not in table.column_names:
+            columns[name] = np.full(table.num_rows, default, dtype=dtype)
+            continue
+        column = table.column(name)
+        if dtype is not object and default == default and column.null_count:
+            column = pc.fill_null(column, default)
+        columns[name] = column.to_numpy(zero_copy_only=False).astype(dtype, copy=False)
+    return columns
+
+
+class ArchiveWriter:
+    """Micro-batching Parquet sink with a per-hour timestamp index."""
+
+    def __init__(self, root, max_batch_rows=MAX_BATCH_ROWS, max_batch_seconds=MAX_BATCH_SECONDS,
+                 row_group_rows=ROW_GROUP_ROWS, compression="zstd"):
+        self.fs, self.base = open_filesystem(root)
+        self.max_batch_rows = max_batch_rows
+        self.max_batch_seconds = max_batch_seconds
+        self.row_group_rows = row_group_rows
+        self.compression = compression
+        self._buffer = []
+        self._buffer_since = None
+
+    def add(self, records):
+        """Buffers records. Returns the files written if this triggered a flush."""
+        if records:
+            if self._buffer_since is None:
+                self._buffer_since = time.time()
+            self._buffer.extend(records)
+        if self.due():
+            return self.flush()
+        return []
+
+    def due(self):
+        return bool(self._buffer) and (len(self._buffer) >= self.max_batch_rows
+                                       or time.time() - self._buffer_since >= self.max_batch_seconds)
+
+    def flush(self):
+        """Writes the buffer, one file per hour partition it spans."""
+        if not self._buffer:
+            return []
+        columns = records_to_columns(self._buffer)
+        self._buffer = []
+        self._buffer_since = None
+
+        # Rows are sorted by time, so each hour is one contiguous slice
+        times = columns[TIME_COLUMN]
+        hours = times - times % 3600
+        bounds = np.flatnonzero(np.diff(hours)) + 1
+        written = []
+        for start, stop in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(times)]])):
+            written.append(self._write_part(slice_columns(columns, start, stop)))
+        return written
+
+    def _write_part(self, columns):
+        times = columns[TIME_COLUMN]
+        partition = hour_partition(int(times[0]))
+        # Unique across processes and warm Lambda containers writing the same hour
+        relative = f"vehicles/{partition}/part-{int(times[0])}-{uuid.uuid4().hex[:12]}.parquet"
+        entry = write_file(self.fs, self.base, relative, columns, self.row_group_rows, self.compression)
+        entries = self._load_index(partition)
+        entries.append(entry)
+        self._save_index(partition, entries)
+        return relative
+
+    def _index_path(self, partition):
+        return f"{self.base}/index/{partition}.json"
+
+    def _load_index(self, partition):
+        # Read fresh on every flush (one small object): compaction may have rewritten it
+        return read_json(self.fs, self._index_path(partition)) or []
+
+    def _save_index(self, partition, entries):
+        write_json(self.fs, self._index_path(partition), entries)
+
+
+def write_file(filesystem, base, relative, columns, row_group_rows, compression="zstd"):
+    """Writes columns as one Parquet file. Returns its index entry."""
+    import pyarrow.parquet as pq
+
+    path = f"{base}/{relative}"
+    filesystem.create_dir(path.rsplit("/", 1)[0], recursive=True)
+    with filesystem.open_output_stream(path) as sink:
+        pq.write_table(columns_to_table(columns), sink, row_group_size=row_group_rows, compression=compression)
+    times = columns[TIME_COLUMN]
+    return {"file": relative, "min_ts": int(times.min()), "max_ts": int(times.max()), "rows": int(len(times)),
+            "row_groups": row_group_ranges(times, row_group_rows)}
+
+
+def write_json(filesystem, path, value):
+    filesystem.create_dir(path.rsplit("/", 1)[0], recursive=True)
+    with filesystem.open_output_stream(path) as sink:
+        sink.write(json.dumps(value).encode("utf-8"))
+
+
+def read_json(filesystem, path):
+    from pyarrow import fs
+
+    if filesystem.get_file_info(path).type == fs.FileType.NotFound:
+        return None
+    with filesystem.open_input_stream(path) as source:
+        return json.loads(source.read())
+
+
+class ArchiveReader:
+    """Seeks into the archive through the hourly indexes."""
+
+    def __init__(self, root):
+        self.fs, self.base = open_filesystem(root)
+        self._indexes = {}   # hour start -> (loaded at, entries)
+
+    def hour_entries(self, hour):
+        cached = self._indexes.get(hour)
+        # Finished hours never change; the current one is re-read now and then
+        if cached is None or (hour >= hour_start(int(time.time())) - 3600
+                              and time.time() - cached[0] > INDEX_REFRESH_SECONDS):
+            entries = read_json(self.fs, f"{self.base}/index/{hour_partition(hour)}.json") or []
+            cached = self._indexes[hour] = (time.time(), entries)
+        return cached[1]
+
+    def coverage(self):
+        """(first ts, last ts) in the archive, or None when it is empty."""
+        from pyarrow import fs
+
+        selector = fs.FileSelector(f"{self.base}/index", recursive=True, allow_not_found=True)
+        hours = sorted(info.path for info in self.fs.get_file_info(selector) if info.path.endswith(".json"))
+        if not hours:
+            return None
+        first = read_json(self.fs, hours[0]) or []
+        last = read_json(self.fs, hours[-1]) or []
+        if not first or not last:
+            return None
+        return min(e["min_ts"] for e in first), max(e["max_ts"] for e in last)
+
+    def latest_ts(self, now=None):
+        """Last archived timestamp, looking back from now through the recent hours."""
+        hour = hour_start(int(now or time.time()))
+        for back in range(48):
+            entries = self.hour_entries(hour - back * 3600)
+            if entries:
+                return max(e["max_ts"] for e in entries)
+        return None
+
+    def read(self, start_ts, end_ts):
+        """Numpy columns of every record with start_ts <= ts < end_ts, sorted by time."""
+        parts = []
+        for hour in range(hour_start(int(start_ts)), int(end_ts), 3600):
+            try:
+                parts.extend(self._read_hour(hour, start_ts, end_ts))
+            except FileNotFoundError:
+                # Compacted since its index was cached: read the new index once
+                self._indexes.pop(hour, None)
+                parts.extend(self._read_hour(hour, start_ts, end_ts))
+
+        columns = concat_columns(parts)
+        if len(parts) > 1 or np.any(np.diff(columns[TIME_COLUMN]) < 0):
+            order = np.argsort(columns[TIME_COLUMN], kind="stable")
+            columns = {name: values[order] for name, values in columns.items()}
+        return columns
+
+    def _read_hour(self, hour, start_ts, end_ts):
+        import pyarrow.parquet as pq
+
+        parts = []
+        for entry in self.hour_entries(hour):
+            if entry["max_ts"] < start_ts or entry["min_ts"] >= end_ts:
+                continue
+            # Compacted files are sorted by route, so every row group may span the hour
+            wanted = [i for i, (low, high, _) in enumerate(entry["row_groups"])
+                      if low < end_ts and high >= start_ts]
+            with self.fs.open_input_file(f"{self.base}/{entry['file']}") as source:
+                columns = table_to_columns(pq.ParquetFile(source).read_row_groups(wanted))
+            times = columns[TIME_COLUMN]
+            keep = (times >= start_ts) & (times < end_ts)
+            parts.append({name: values[keep] for name, values in columns.items()})
+        return parts
+
+
+class KinesisSource:
+    """
+    Reads the stream forward from an AT_TIMESTAMP iterator, buffered as
+    columns. Each read() makes at most one get_records call per shard, and
+    only every poll_seconds (doubling while a shard is throttled), so a
+    replay session stays well under the 5 reads/s per shard limit it shares
+    with the live consumer.
+    """
+
+    def __init__(self, client, stream_name, start_ts, poll_seconds=KINESIS_POLL_SECONDS):
+        from kinesis_consumer import KinesisConsumer
+
+        self.consumer = KinesisConsumer(client, stream_name, initial_position="AT_TIMESTAMP",
+                                        initial_timestamp=datetime.fromtimestamp(start_ts, timezone.utc),
+                                        limit=10000)
+        self.poll_seconds = poll_seconds
+        self._backoff = poll_seconds
+        self._next_poll = 0.0
+        self._caught_up = False
+        self._buffer = empty_columns()
+
+    def _poll(self):
+        now = time.time()
+        if now < self._next_poll:
+            return
+        throttled = self.consumer.stats["throttled"]
+        records = self.consumer.poll_vehicles(checkpoint=False)
+        if self.consumer.stats["throttled"] > throttled:
+            self._backoff = min(self._backoff * 2, KINESIS_MAX_BACKOFF_SECONDS)
+            self._caught_up = False
+        else:
+            self._backoff = self.poll_seconds
+            self._caught_up = self.consumer.max_lag_ms() == 0
+        self._next_poll = now + self._backoff
+        if records:
+            # Shards are read side by side, so one poll's records can be older than the last one's
+            buffer = concat_columns([self._buffer, records_to_columns(records)])
+            order = np.argsort(buffer[TIME_COLUMN], kind="stable")
+            self._buffer = {name: values[order] for name, values in buffer.items()}
+
+    def read(self, start_ts, end_ts):
+        """(buffered columns before end, end), where end <= end_ts is how far the stream was read."""
+        times = self._buffer[TIME_COLUMN]
+        if not len(times) or times[-1] < end_ts:
+            self._poll()
+            times = self._buffer[TIME_COLUMN]
+        if self._caught_up:
+            reached = end_ts
+        else:
+            reached = min(end_ts, max(start_ts, float(times[-1]) + 1 if len(times) else start_ts))
+        # Rows older than start_ts (a lagging shard) are late, not stale: they are still returned
+        stop = np.searchsorted(times, reached)
+        chunk = slice_columns(self._buffer, 0, stop)
+        self._buffer = slice_columns(self._buffer, stop, len(times))
+        return chunk, reached
+
+    def close(self):
+        self.consumer.close()
+
+
+class Playback:
+    """
+    Replays vehicle columns from start_ts at `speed` times real time.
+    advance() returns everything between the previous call and the current
+    playback time, from an in-memory chunk of the archive (or from Kinesis
+    once past the archive's end).
+    """
+
+    def __init__(self, start_ts, speed=1.0, archive=None, client=None, stream_name=None,
+                 chunk_seconds=CHUNK_SECONDS, retention_seconds=KINESIS_RETENTION_SECONDS):
+        self.archive = archive
+        self.client = client
+        self.stream_name = stream_name
+        self.chunk_seconds = chunk_seconds
+        self.retention_seconds = retention_seconds
+        self.cursor = float(start_ts)      # playback time already returned
+        self.speed = speed
+        self._anchor = (time.time(), self.cursor)
+        self._chunk = empty_columns()
+        self._chunk_end = self.cursor      # archive time loaded up to
+        self._kinesis = None
+        self.source = "archive" if archive is not None else "kinesis"
+
+    def set_speed(self, speed):
+        self._anchor = (time.time(), self.position())
+        self.speed = speed
+
+    def position(self, now=None):
+        """Current playback time (never ahead of real time)."""
+        now = now or time.time()
+        wall, start = self._anchor
+        return min(start + (now - wall) * self.speed, now)
+
+    def advance(self, now=None):
+        target = self.position(now)
+        if target <= self.cursor:
+            return empty_columns()
+        columns, self.cursor = self._read(self.cursor, target)
+        return columns
+
+    def _read(self, start_ts, end_ts):
+        """(columns for start_ts <= ts < end, end) where end <= end_ts is how far the data reached."""
+        if self.source == "archive":
+            latest = self.archive.latest_ts()
+            if latest is not None and start_ts <= latest:
+                # Not past the archived part: the rest comes from Kinesis next time
+                end_ts = min(end_ts, latest + 1)
+                # Load a whole chunk (at least one advance worth) and slice it
+                while self._chunk_end < end_ts:
+                    span = max(self.chunk_seconds, (end_ts - self._chunk_end) * 2)
+                    loaded = self.archive.read(self._chunk_end, self._chunk_end + span)
+                    times = self._chunk[TIME_COLUMN]
+                    keep = np.searchsorted(times, start_ts)
+                    self._chunk = concat_columns([slice_columns(self._chunk, keep, len(times)), loaded])
+                    self._chunk_end += span
+                times = self._chunk[TIME_COLUMN]
+                start, stop = np.searchsorted(times, [start_ts, end_ts])
+                return slice_columns(self._chunk, start, stop), end_ts
+            if self.client is None or start_ts < time.time() - self.retention_seconds:
+                return empty_columns(), end_ts
+            # Past the archived part: continue on the stream
+            self.source = "kinesis"
+            self._chunk = empty_columns()
+        if self._kinesis is None:
+            if self.client is None or start_ts < time.time() - self.retention_seconds:
+                return empty_columns(), end_ts
+            self._kinesis = KinesisSource(self.client, self.stream_name, start_ts)
+        return self._kinesis.read(start_ts, end_ts)
+
+    def close(self):
+        if self._kinesis is not None:
+            self._kinesis.close()
+
+
+def compact_hour(root_fs, base, hour, row_group_rows=COMPACT_ROW_GROUP_ROWS, compression="zstd"):
+    """
+    Merges one finished hour into a single file sorted by route_id, trip_id,
+    id and time, without duplicate (id, ts) rows. Every Parquet file of the
+    hour is merged, listed in its index or not: concurrent writers can lose
+    each other's index entries, and an interrupted run leaves files behind
+    whose rows are dropped again as duplicates. The new index is written
+    before the old files are deleted. Returns a summary.
+    """
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    from pyarrow import fs
+
+    partition = hour_partition(hour)
+    index_path = f"{base}/index/{partition}.json"
+    selector = fs.FileSelector(f"{base}/vehicles/{partition}", allow_not_found=True)
+    files = sorted(info.path for info in root_fs.get_file_info(selector) if info.path.endswith(".parquet"))
+    summary = {"partition": partition, "files_in": len(files), "rows_in": 0, "files_out": 0, "rows_out": 0}
+    if not files:
+        return summary
+    if len(files) == 1:
+        entries = read_json(root_fs, index_path) or []
+        if len(entries) == 1 and entries[0].get("compacted") and f"{base}/{entries[0]['file']}" == files[0]:
+            return summary
+
+    parts = []
+    for path in files:
+        with root_fs.open_input_file(path) as source:
+            parts.append(table_to_columns(pq.read_table(source)))
+    table = columns_to_table(concat_columns(parts))
+    summary["rows_in"] = table.num_rows
+    table = table.take(pc.sort_indices(table, sort_keys=[("route_id", "ascending"), ("trip_id", "ascending"),
+                                                         ("id", "ascending"), (TIME_COLUMN, "ascending")]))
+    columns = table_to_columns(table)
+    # Rows repeated by an at-least-once retry are identical and now adjacent
+    ids, times = columns["id"], columns[TIME_COLUMN]
+    keep = np.ones(len(times), dtype=bool)
+    keep[1:] = (ids[1:] != ids[:-1]) | (times[1:] != times[:-1])
+    columns = {name: values[keep] for name, values in columns.items()}
+
+    relative = f"vehicles/{partition}/compacted-{hour}-{uuid.uuid4().hex[:12]}.parquet"
+    entry = write_file(root_fs, base, relative, columns, row_group_rows, compression)
+    entry["compacted"] = True
+    write_json(root_fs, index_path, [entry])
+    for path in files:
+        root_fs.delete_file(path)
+    summary.update(files_out=1, rows_out=entry["rows"])
+    return summary
+
+
+def compact_archive(root, now=None, max_hours=48, compact_after_seconds=COMPACT_AFTER_SECONDS):
+    """
+    Compacts every finished hour of the last `max_hours` that still has
+    more than one file (an already compacted hour costs a listing and one
+    index read).
+    """
+    root_fs, base = open_filesystem(root)
+    newest = hour_start(int(now or time.time()) - compact_after_seconds) - 3600
+    results = []
+    for back in range(max_hours):
+        hour = newest - back * 3600
+        summary = compact_hour(root_fs, base, hour)
+        if summary["files_out"]:
+            print(f"🗜️ {summary['partition']}: {summary['files_in']} files / {summary['rows_in']} rows -> "
+                  f"1 file / {summary['rows_out']} rows")
+            results.append(summary)
+    return results
+
+
+def run_writer(client, stream_name, root, checkpoint_path, poll_interval=1.0):
+    """
+    Kinesis -> archive. Shard checkpoints are only saved after a flush, so a
+    restart re-reads what was still buffered (at-least-once; replay tolerates
+    the duplicate positions).
+    """
+    from kinesis_consumer import FileCheckpointStore, KinesisConsumer
+
+    consumer = KinesisConsumer(client, stream_name, checkpoint_store=FileCheckpointStore(checkpoint_path),
+                               initial_position="TRIM_HORIZON", limit=10000)
+    writer = ArchiveWriter(root)
+    while True:
+        records = consumer.poll_vehicles(checkpoint=False)
+        written = writer.add(records)
+        if written:
+            consumer.checkpoint()
+            print(f"📦 Archived {len(written)} file(s): {', '.join(written)}")
+        # Keep reading quickly while behind, then settle to the stream's pace
+        if not records or consumer.max_lag_ms() < 60000:
+            time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time-indexed vehicle archive")
+    sub = parser.add_subparsers(dest="command", required=True)
+    write = sub.add_parser("write", help="Archive a Kinesis stream")
+    write.add_argument("--stream", default=os.environ.get("KINESIS_STREAM_NAME", "uta_Gtfs_kinesis_stream"))
+    write.add_argument("--root", required=True, help="Local directory or s3://bucket/prefix")
+    write.add_argument("--checkpoint", default="/tmp/archive_checkpoints.json")
+    info = sub.add_parser("info", help="Show what the archive covers")
+    info.add_argument("--root", required=True)
+    compact = sub.add_parser("compact", help="Merge and sort finished hours")
+    compact.add_argument("--root", required=True)
+    compact.add_argument("--hours", type=int, default=48, help="How many finished hours to check")
+    args = parser.parse_args()
+
+    if args.command == "write":
+        import boto3
+
+        run_writer(boto3.client("kinesis"), args.stream, args.root, args.checkpoint)
+    elif args.command == "compact":
+        compacted = compact_archive(args.root, max_hours=args.hours)
+        print(f"✅ Compacted {len(compacted)} hour(s)")
+    else:
+        covered = ArchiveReader(args.root).coverage()
+        if covered is None:
+            print("Archive is empty.")
+        else:
+            first, last = (datetime.fromtimestamp(t, timezone.utc).isoformat() for t in covered)
+            print(f"🗄️ Archive covers {first} -> {last}")
@@ -0,0 +1,52 @@
+import base64
+import json
+import os
+
+from archive import ArchiveWriter, compact_archive
+from vehicle_codec import decode_record
+
+# Environment Variables (Set these in AWS Lambda Console)
+# ARCHIVE_ROOT = s3://your-bucket-name/archive (same root as `archive.py write`)
+# COMPACT_HOURS = 48 (finished hours checked per compaction; compacted ones cost one index read)
+# Needs pyarrow and numpy (the AWS SDK for pandas layer provides both).
+ARCHIVE_ROOT = os.environ.get('ARCHIVE_ROOT')
+
+
+def write_handler(event, context):
+    """
+    Firehose-style archive writer. Attach it to the vehicle stream as a
+    Kinesis event source with a batching window (e.g. 300 s, 10,000 records):
+    each invocation is one micro-batch and becomes one Parquet file per hour.
+    A failed write fails the batch, so Lambda retries it (at-least-once;
+    compaction removes the duplicates).
+    """
+    records = []
+    for record in event.get('Records', []):
+        records.extend(decode_record(base64.b64decode(record['kinesis']['data'])))
+
+    writer = ArchiveWriter(ARCHIVE_ROOT)
+    writer.add(records)
+    written = writer.flush()
+    print(f"📦 Archived {len(records)} vehicles into {len(written)} file(s)")
+    return {'statusCode': 200, 'body': json.dumps({'files': written})}
+
+
+def compact_handler(event, context):
+    """
+    Merges each finished hour of the archive into one Parquet file sorted by
+    route_id/trip_id. Invoked hourly by the uta_realtime_compaction DAG.
+    """
+    event = event or {}
+    root = event.get('archive_root') or ARCHIVE_ROOT
+    hours = int(event.get('hours') or os.environ.get('COMPACT_HOURS', '48'))
+
+    print(f"🗜️ Compacting {root} (last {hours} finished hours)...")
+    results = compact_archive(root, max_hours=hours)
+    print(f"✅ Compacted {len(results)} hour(s)")
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'compacted_hours': [r['partition'] for r in results],
+            'files_merged': sum(r['files_in'] for r in results),
+        })
+    }
@@ -0,0 +1,251 @@
+"""
+Long-running asyncio poller for several GTFS-RT feeds at once.
+
+The Lambda poller runs once a minute, so positions can be up to 60 s old
+and every run pays a cold start. This poller stays resident instead:
+
+- Every feed gets its own RealtimeFetcher (keep-alive session, conditional
+  GET, header.timestamp short-circuit) and its own polling task.
+- Each task learns the feed's real refresh interval from header.timestamp
+  (EWMA of the gaps between new snapshots) and schedules the next poll just
+  after the next refresh is expected, instead of on a fixed timer.
+- New snapshots go through a bounded asyncio.Queue to a single sink task.
+  When the sink falls behind, the queue fills up and the pollers wait
+  (backpressure) rather than piling up snapshots in memory.
+
+Run locally:
+    python async_poller.py --feeds uta_vehicle,mbta_vehicle --sink print
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from poll_gtfs_realtime import RealtimeFetcher, flatten_vehicle_positions
+
+# Feed endpoints. UTA/MBTA VehiclePositions match gtfs_realtime_decoder.py;
+# TripUpdates and Alerts are the sibling endpoints of the same agencies.
+FEEDS = {
+    "uta_vehicle": {"url": "https://apps.rideuta.com/tms/gtfs/Vehicle", "kind": "vehicle"},
+    "uta_trip_updates": {"url": os.environ.get("UTA_TRIP_UPDATES_URL", "https://apps.rideuta.com/tms/gtfs/TripUpdate"), "kind": "trip_updates"},
+    "uta_alerts": {"url": os.environ.get("UTA_ALERTS_URL", "https://apps.rideuta.com/tms/gtfs/Alert"), "kind": "alerts"},
+    "mbta_vehicle": {"url": "https://cdn.mbta.com/realtime/VehiclePositions.pb", "kind": "vehicle"},
+    "mbta_trip_updates": {"url": "https://cdn.mbta.com/realtime/TripUpdates.pb", "kind": "trip_updates"},
+    "mbta_alerts": {"url": "https://cdn.mbta.com/realtime/Alerts.pb", "kind": "alerts"},
+}
+
+# UTA rejects requests without a browser-like User-Agent
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+MIN_INTERVAL = 1.0        # never poll a feed more often than this (seconds)
+MAX_INTERVAL = 60.0       # never wait longer than this between polls
+INITIAL_INTERVAL = 15.0   # refresh interval guess before we have learned one
+POLL_LEAD = 0.5           # poll this long after the expected refresh
+RETRY_STEP = 1.0          # first re-poll delay when the refresh is late
+EWMA_ALPHA = 0.3          # weight of the newest interval sample
+QUEUE_SIZE = 8            # snapshots waiting for the sink before pollers block
+
+
+class CadenceEstimator:
+    """
+    Learns how often a feed publishes a new snapshot, from header.timestamp,
+    and says how long to wait before the next poll.
+    """
+
+    def __init__(self, initial_interval=INITIAL_INTERVAL):
+        self.interval = initial_interval
+        self.samples = 0
+        self.last_feed_timestamp = None
+        self.misses = 0
+
+    def observe_new(self, feed_timestamp):
+        """A new snapshot arrived. Returns the delay until the next poll."""
+        first_snapshot = self.last_feed_timestamp is None
+        if not first_snapshot and feed_timestamp > self.last_feed_timestamp:
+            sample = feed_timestamp - self.last_feed_timestamp
+            # The first real sample replaces the guess; later ones are smoothed
+            self.interval = sample if not self.samples else (1 - EWMA_ALPHA) * self.interval + EWMA_ALPHA * sample
+            self.samples += 1
+        self.last_feed_timestamp = feed_timestamp
+        self.misses = 0
+
+        # Nothing learned yet: probe from the minimum interval upwards
+        if not self.samples:
+            return MIN_INTERVAL
+
+        # Expected next refresh, measured on the feed's own clock
+        age = max(time.time() - feed_timestamp, 0)
+        delay = self.interval - age + POLL_LEAD
+        return min(max(delay, MIN_INTERVAL), MAX_INTERVAL)
+
+    def observe_unchanged(self):
+        """The refresh is late: re-poll soon, backing off if it stays late."""
+        self.misses += 1
+        delay = RETRY_STEP * (2 ** (self.misses - 1))
+        return min(max(delay, MIN_INTERVAL), self.interval, MAX_INTERVAL)
+
+
+class FeedPoller:
+    """Polls one feed forever and puts every new snapshot on the queue."""
+
+    def __init__(self, name, url, kind, queue):
+        self.name = name
+        self.kind = kind
+        self.queue = queue
+        self.fetcher = RealtimeFetcher(url, headers=HEADERS)
+        self.cadence = CadenceEstimator()
+        self.stats = {"polls": 0, "new": 0, "errors": 0, "queue_wait_s": 0.0}
+
+    async def run(self):
+        while True:
+            self.stats["polls"] += 1
+            try:
+                # requests is blocking, so each fetch runs on a worker thread
+                feed = await asyncio.to_thread(self.fetcher.fetch)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"[{self.name}] fetch failed: {e}")
+                await asyncio.sleep(self.cadence.observe_unchanged())
+                continue
+
+            if feed is None:
+                await asyncio.sleep(self.cadence.observe_unchanged())
+                continue
+
+            self.stats["new"] += 1
+            delay = self.cadence.observe_new(feed.header.timestamp)
+
+            # Backpressure: waits here while the sink is behind
+            wait_start = time.perf_counter()
+            await self.queue.put((self.name, self.kind, feed, time.time()))
+            self.stats["queue_wait_s"] += time.perf_counter() - wait_start
+
+            await asyncio.sleep(delay)
+
+    def summary(self):
+        return dict(
+            self.stats,
+            queue_wait_s=round(self.stats["queue_wait_s"], 3),
+            interval_s=round(self.cadence.interval, 1),
+            short_circuit_rate=round(self.fetcher.short_circuit_rate(), 2),
+        )
+
+
+def feed_age(feed, received_at):
+    """'feed age 12.3s' for the log lines, or a note when the feed has no header.timestamp."""
+    if not feed.header.timestamp:
+        return "no feed timestamp"
+    return f"feed age {received_at - feed.header.timestamp:.1f}s"
+
+
+def print_sink(name, kind, feed, received_at):
+    """Local sink: one line per snapshot with its freshness."""
+    print(f"[{name}] {kind}: {len(feed.entity)} entities, {feed_age(feed, received_at)}")
+
+
+def make_kinesis_sink(stream_name, schedule_index=None):
+    """
+    Sends vehicle snapshots to Kinesis through the same sender as poll_lambda.
+    With schedule_index (a compiled UTA schedule), UTA vehicles also get the
+    adherence columns.
+    """
+    import boto3
+    from kinematics import derive_kinematics
+    from kinesis_sender import KinesisBatchSender, partition_key_for
+    from vehicle_state_store import MemoryStateStore
+
+    sender = KinesisBatchSender(boto3.client("kinesis"), stream_name)
+    # Previous fixes per feed, for speed/bearing the feed does not report
+    kinematics_stores = {}
+    adherence = None
+    if schedule_index:
+        from adherence import load_engine
+        adherence = load_engine(schedule_index)
+
+    def kinesis_sink(name, kind, feed, received_at):
+        if kind != "vehicle":
+            print_sink(name, kind, feed, received_at)
+            return
+        entity_list = flatten_vehicle_positions(feed)
+        derive_kinematics(entity_list, kinematics_stores.setdefault(name, MemoryStateStore()))
+        if adherence is not None and name.startswith("uta"):
+            adherence.update(entity_list)
+        records = [
+            {"Data": json.dumps(entity).encode("utf-8"), "PartitionKey": partition_key_for(entity)}
+            for entity in entity_list
+        ]
+        result = sender.send(records)
+        print(f"[{name}] sent {result['records']} records, lost {result['lost_records']}, "
+              f"{feed_age(feed, received_at)}")
+
+    return kinesis_sink
+
+
+def make_file_sink(output_dir, output_format="ndjson"):
+    """
+    Flattens every feed kind into typed tables and appends them to rolling
+    files, under one subdirectory per feed (<output_dir>/<feed>/<table>/...)
+    so UTA and MBTA rows stay apart.
+    """
+    from gtfs_rt_flatten import flatten_feed, make_writer
+
+    writers = {}
+
+    def file_sink(name, kind, feed, received_at):
+        writer = writers.get(name)
+        if writer is None:
+            writer = writers[name] = make_writer(output_format, os.path.join(output_dir, name))
+        written = writer.write(flatten_feed(feed), feed.header.timestamp)
+        print(f"[{name}] wrote {written}, {feed_age(feed, received_at)}")
+
+    return file_sink
+
+
+async def sink_worker(queue, sink):
+    while True:
+        name, kind, feed, received_at = await queue.get()
+        try:
+            # Sinks do blocking I/O (Kinesis, files), keep them off the event loop
+            await asyncio.to_thread(sink, name, kind, feed, received_at)
+        except Exception as e:
+            print(f"[{name}] sink failed: {e}")
+        finally:
+            queue.task_done()
+
+
+async def report(pollers, every=60):
+    while True:
+        await asyncio.sleep(every)
+        print(json.dumps({p.name: p.summary() for p in pollers}))
+
+
+async def run_poller(feed_names, sink, queue_size=QUEUE_SIZE):
+    queue = asyncio.Queue(maxsize=queue_size)
+    pollers = [FeedPoller(name, FEEDS[name]["url"], FEEDS[name]["kind"], queue) for name in feed_names]
+    tasks = [asyncio.create_task(p.run()) for p in pollers]
+    tasks.append(asyncio.create_task(sink_worker(queue, sink)))
+    tasks.append(asyncio.create_task(report(pollers)))
+    await asyncio.gather(*tasks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resident multi-feed GTFS-RT poller")
+    parser.add_argument("--feeds", default="uta_vehicle,uta_trip_updates,uta_alerts",
+                        help=f"comma separated, from: {', '.join(FEEDS)}")
+    parser.add_argument("--sink", choices=["print", "kinesis", "files"], default="print")
+    parser.add_argument("--stream", default=os.environ.get("KINESIS_STREAM_NAME", "uta_Gtfs_kinesis_stream"))
+    parser.add_argument("--schedule-index", help="Compiled schedule index (path or s3://) for --sink kinesis")
+    parser.add_argument("--output-dir", default="/data/GTFS_realtime", help="for --sink files")
+    parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson", help="for --sink files")
+    args = parser.parse_args()
+
+    if args.sink == "kinesis":
+        chosen_sink = make_kinesis_sink(args.stream, args.schedule_index)
+    elif args.sink == "files":
+        chosen_sink = make_file_sink(args.output_dir, args.format)
+    else:
+        chosen_sink = print_sink
+    asyncio.run(run_poller(args.feeds.split(","), chosen_sink))
@@ -0,0 +1,134 @@
+"""
+Startup benchmark for the realtime poller Lambda (poll_lambda.py).
+
+Every sample is a fresh Python process, like a new Lambda container, that
+measures:
+
+    import_ms   importing poll_lambda (the init phase; with PREWARM=on it
+                also creates the Kinesis client and the feed session)
+    first_ms    the first lambda_handler call (the cold invocation)
+    warm_ms     median of the following calls (warm invocations)
+
+for both modes:
+
+    lazy        clients created on first use (PREWARM=off, the default outside Lambda)
+    prewarm     clients created at import (PREWARM=on, the default inside Lambda)
+
+The feed comes from bench_pipeline.FeedServer (a new snapshot on every
+request) and records go to local_kinesis.LocalKinesis. The boto3 client is
+still created for real, only its sender is pointed at the local stream.
+
+    python scripts/bench_cold_start.py
+    python scripts/bench_cold_start.py --vehicles 2000 --processes 10 --output cold_start.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPT = os.path.abspath(__file__)
+MODES = {"lazy": "off", "prewarm": "on"}
+
+
+def run_child(warm_calls):
+    """One container: import, first call, warm calls. Prints the timings as JSON."""
+    start = time.perf_counter()
+    import poll_lambda
+    import_s = time.perf_counter() - start
+
+    import kinesis_sender
+    from local_kinesis import LocalKinesis
+
+    stream = LocalKinesis(poll_lambda.CONFIG.stream_name, shard_count=2)
+
+    class LocalSender(kinesis_sender.KinesisBatchSender):
+        def __init__(self, client, stream_name, **kwargs):
+            super().__init__(stream, stream_name, **kwargs)
+
+    # Senders created later (lazy mode) still build their boto3 client, then send locally
+    poll_lambda.KinesisBatchSender = LocalSender
+    for sender in poll_lambda._senders.values():
+        sender.client = stream
+
+    timings = []
+    for _ in range(warm_calls + 1):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            response = poll_lambda.lambda_handler({}, None)
+            timings.append(time.perf_counter() - start)
+        if response["statusCode"] != 200 or response["body"] == "[]":
+            raise RuntimeError("poll did not send a new snapshot")
+    print(json.dumps({"import_s": import_s, "first_s": timings[0], "warm_s": timings[1:]}))
+
+
+def sample(mode, url, warm_calls):
+    env = dict(os.environ, PREWARM=MODES[mode], GTFS_RT_URL=url, METRICS_SINK="none",
+               VEHICLE_STATE_PATH=f"/tmp/bench_cold_start_state_{os.getpid()}.json",
+               KINEMATICS_STATE_PATH=f"/tmp/bench_cold_start_kinematics_{os.getpid()}.json")
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    for name in ("VEHICLE_STATE_PATH", "KINEMATICS_STATE_PATH"):
+        if os.path.exists(env[name]):
+            os.remove(env[name])
+    output = subprocess.run([sys.executable, SCRIPT, "--child", "--warm", str(warm_calls)], env=env,
+                            cwd=os.path.dirname(SCRIPT), capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="poll_lambda import, cold and warm invocation latency")
+    parser.add_argument("--vehicles", type=int, default=700)
+    parser.add_argument("--processes", type=int, default=5, help="Fresh processes per mode")
+    parser.add_argument("--warm", type=int, default=5, help="Warm invocations per process")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.warm)
+        return
+
+    from bench_pipeline import FeedServer, make_feed
+
+    server = FeedServer()
+    start_ts = int(time.time())
+    calls = args.warm + 1
+    results = []
+    try:
+        for mode in MODES:
+            samples = []
+            for _ in range(args.processes):
+                server.rotate(make_feed(args.vehicles, start_ts + step * 15, step=step).SerializeToString()
+                              for step in range(calls))
+                start_ts += calls * 15
+                samples.append(sample(mode, server.url, args.warm))
+            result = {
+                "mode": mode,
+                "vehicles": args.vehicles,
+                "processes": args.processes,
+                "import_ms": round(statistics.median(s["import_s"] for s in samples) * 1000, 1),
+                "first_ms": round(statistics.median(s["first_s"] for s in samples) * 1000, 1),
+                "warm_ms": round(statistics.median(t for s in samples for t in s["warm_s"]) * 1000, 1),
+            }
+            result["cold_total_ms"] = round(result["import_ms"] + result["first_ms"], 1)
+            results.append(result)
+    finally:
+        server.close()
+
+    print(f"{'mode':<10}{'import ms':>11}{'first ms':>10}{'warm ms':>9}{'import+first':>14}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['import_ms']:>11.1f}{r['first_ms']:>10.1f}{r['warm_ms']:>9.1f}"
+              f"{r['cold_total_ms']:>14.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
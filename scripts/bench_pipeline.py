@@ -0,0 +1,363 @@
+"""
+End-to-end benchmark of the realtime path on synthetic GTFS-RT feeds, from
+UTA's fleet size up to MBTA-sized feeds and beyond.
+
+    python scripts/bench_pipeline.py
+    python scripts/bench_pipeline.py --vehicles 700,5000,50000 --output results/today.json
+    python scripts/bench_pipeline.py --baseline results/yesterday.json
+
+make_feed() builds a FeedMessage with N vehicles spread over routes in the UTA
+service area. A local HTTP server (ETag/304 and gzip, like the real feed) and
+local_kinesis.LocalKinesis stand in for UTA and for Kinesis. Stages timed, per
+feed size (and per RECORD_FORMAT for the stream stages):
+
+    http_get             RealtimeFetcher's session downloading the payload
+    parse                FeedMessage.ParseFromString
+    flatten              flatten_vehicle_positions (fetch_realtime_data's loop)
+    fetch_realtime_data  the three above together, as the Lambda runs them
+    encode               poll_lambda.build_records (json.dumps or vehicle_codec)
+    send                 KinesisBatchSender batching into put_records
+    consume_decode       KinesisConsumer.poll_vehicles until every vehicle is read
+    dash_dataframe       pd.DataFrame(records), as scripts/gtfs.py builds it
+    store_apply          VehicleStore.apply + freeze + to_frame (docker_dashboard)
+
+Results (median/min/max ms and µs per vehicle) are written as JSON with the
+environment they ran in. --baseline compares against an earlier results file
+and exits with status 1 when a stage is slower than --tolerance allows.
+"""
+import argparse
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+from google.protobuf.internal import api_implementation
+from google.transit import gtfs_realtime_pb2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "docker_dashboard"))
+
+from kinesis_consumer import KinesisConsumer
+from kinesis_sender import KinesisBatchSender
+from local_kinesis import LocalKinesis
+from poll_gtfs_realtime import RealtimeFetcher, fetch_realtime_data, flatten_vehicle_positions
+from poll_lambda import build_records
+from vehicle_store import VehicleStore
+
+SOUTH, WEST, NORTH, EAST = 40.0, -112.2, 41.4, -111.6
+VEHICLES_PER_ROUTE = 12
+POLL_SECONDS = 15
+SPEED_REPORTED_SHARE = 0.7     # share of vehicles that report speed and bearing
+STREAM_NAME = "bench-stream"
+DEFAULT_SIZES = "700,2000,10000,50000"
+TOLERANCE = 0.25               # a stage this much slower than the baseline is a regression
+MIN_REGRESSION_MS = 1.0        # ...and at least this much slower (sub-ms stages are mostly noise)
+
+
+# --- Synthetic feed -----------------------------------------------------------
+
+def make_feed(vehicles, timestamp, seed=7, step=0):
+    """
+    FeedMessage with `vehicles` VehiclePosition entities. The same seed gives
+    the same fleet; `step` moves every vehicle along its heading, so feeds
+    built for consecutive polls look like consecutive snapshots.
+    """
+    rng = random.Random(seed)
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.incrementality = gtfs_realtime_pb2.FeedHeader.FULL_DATASET
+    feed.header.timestamp = timestamp
+    routes = max(1, vehicles // VEHICLES_PER_ROUTE)
+    for i in range(vehicles):
+        route = rng.randrange(routes)
+        lat = rng.uniform(SOUTH, NORTH)
+        lon = rng.uniform(WEST, EAST)
+        bearing = rng.uniform(0, 360)
+        speed = rng.uniform(0, 20)                  # m/s
+        reports_speed = rng.random() < SPEED_REPORTED_SHARE
+        moved = speed * POLL_SECONDS * step / 111320.0
+        entity = feed.entity.add()
+        entity.id = str(10000 + i)
+        vehicle = entity.vehicle
+        vehicle.trip.trip_id = f"{route}-{rng.randrange(200)}"
+        vehicle.trip.route_id = str(route)
+        vehicle.trip.direction_id = rng.randrange(2)
+        vehicle.vehicle.id = entity.id
+        vehicle.vehicle.label = entity.id
+        vehicle.position.latitude = lat + moved
+        vehicle.position.longitude = lon + moved
+        if reports_speed:
+            vehicle.position.speed = speed
+            vehicle.position.bearing = bearing
+        vehicle.current_stop_sequence = rng.randrange(1, 60)
+        vehicle.stop_id = str(rng.randrange(6000))
+        vehicle.timestamp = timestamp - rng.randrange(POLL_SECONDS * 2)
+    return feed
+
+
+# --- Local HTTP feed ----------------------------------------------------------
+
+class FeedServer:
+    """Serves one payload at a time over HTTP, with ETag/304 and gzip."""
+
+    def __init__(self):
+        self.payload = b""
+        self.gzipped = b""
+        self.etag = None
+        self.rotation = []      # payloads served one per request (see rotate())
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if server.rotation:
+                    server.payload, server.gzipped, server.etag = server.rotation.pop(0)
+                if self.headers.get("If-None-Match") == server.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+                body = server.gzipped if use_gzip else server.payload
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-protobuf")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", server.etag)
+                if use_gzip:
+                    self.send_header("Content-Encoding", "gzip")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/gtfs/Vehicle"
+        threading.Thread(target=self.httpd.serve_forever, name="bench-feed", daemon=True).start()
+
+    @staticmethod
+    def _prepare(payload):
+        return payload, gzip.compress(payload, 6), '"' + hashlib.md5(payload).hexdigest() + '"'
+
+    def publish(self, payload):
+        self.payload, self.gzipped, self.etag = self._prepare(payload)
+
+    def rotate(self, payloads):
+        """Serves the next of `payloads` on every request, so each poll sees a new snapshot."""
+        self.rotation = [self._prepare(payload) for payload in payloads]
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+# --- Stages -------------------------------------------------------------------
+
+def summarize(stage, vehicles, seconds, record_format=None, **extra):
+    result = {
+        "stage": stage,
+        "vehicles": vehicles,
+        "format": record_format,
+        "median_ms": round(statistics.median(seconds) * 1000, 3),
+        "min_ms": round(min(seconds) * 1000, 3),
+        "max_ms": round(max(seconds) * 1000, 3),
+        "us_per_vehicle": round(statistics.median(seconds) * 1e6 / vehicles, 3),
+        "runs": len(seconds),
+    }
+    result.update(extra)
+    return result
+
+
+def bench_feed_stages(server, vehicles, repeat, seed):
+    """HTTP, parse, flatten and the dashboard frames (independent of the record format)."""
+    start_ts = int(time.time())
+    feeds = [make_feed(vehicles, start_ts + step * POLL_SECONDS, seed, step) for step in range(repeat)]
+    payloads = [feed.SerializeToString() for feed in feeds]
+
+    timings = {name: [] for name in ("http_get", "parse", "flatten", "fetch_realtime_data",
+                                     "dash_dataframe", "store_apply")}
+    fetcher = RealtimeFetcher(url=server.url)
+    entity_list = []
+    for payload in payloads:
+        server.publish(payload)
+
+        start = time.perf_counter()
+        response = fetcher.session.get(server.url, timeout=fetcher.timeout)
+        body = response.content
+        timings["http_get"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(body)
+        timings["parse"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        flatten_vehicle_positions(feed)
+        timings["flatten"].append(time.perf_counter() - start)
+
+        # A new snapshot every time, so the fetcher never short-circuits
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            entity_list = fetch_realtime_data(fetcher)
+            timings["fetch_realtime_data"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        pd.DataFrame(entity_list)
+        timings["dash_dataframe"].append(time.perf_counter() - start)
+
+        store = VehicleStore()
+        start = time.perf_counter()
+        store.apply(entity_list)
+        frame = store.freeze()
+        frame.to_frame(frame.mask())
+        timings["store_apply"].append(time.perf_counter() - start)
+
+    results = [summarize(name, vehicles, seconds) for name, seconds in timings.items()]
+    results[0]["payload_bytes"] = len(payloads[-1])
+    results[0]["gzip_bytes"] = len(server.gzipped)
+    return results, entity_list
+
+
+def bench_stream_stages(entity_list, record_format, repeat, shards):
+    """Encode, send through KinesisBatchSender and read back with KinesisConsumer."""
+    vehicles = len(entity_list)
+    timings = {"encode": [], "send": [], "consume_decode": []}
+    records = []
+    put_calls = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        records = build_records(entity_list, record_format)
+        timings["encode"].append(time.perf_counter() - start)
+
+        stream = LocalKinesis(STREAM_NAME, shard_count=shards)
+        start = time.perf_counter()
+        response = KinesisBatchSender(stream, STREAM_NAME).send(records)
+        timings["send"].append(time.perf_counter() - start)
+        if response["FailedRecordCount"]:
+            raise RuntimeError(f"{response['FailedRecordCount']} records lost: {response['errors']}")
+        put_calls = response["put_calls"]
+
+        consumer = KinesisConsumer(stream, STREAM_NAME, initial_position="TRIM_HORIZON", limit=10000)
+        decoded = 0
+        start = time.perf_counter()
+        while decoded < vehicles:
+            batch = consumer.poll_vehicles()
+            if not batch and not consumer.max_lag_ms():
+                break
+            decoded += len(batch)
+        timings["consume_decode"].append(time.perf_counter() - start)
+        consumer.close()
+        if decoded != vehicles:
+            raise RuntimeError(f"read back {decoded} of {vehicles} vehicles ({record_format})")
+
+    record_bytes = sum(len(record["Data"]) for record in records)
+    return [
+        summarize("encode", vehicles, timings["encode"], record_format, records=len(records), bytes=record_bytes),
+        summarize("send", vehicles, timings["send"], record_format, put_calls=put_calls, shards=shards),
+        summarize("consume_decode", vehicles, timings["consume_decode"], record_format),
+    ]
+
+
+# --- Results ------------------------------------------------------------------
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "protobuf_backend": api_implementation.Type(),
+        "pandas": pd.__version__,
+        "git_commit": commit,
+    }
+
+
+def _key(result):
+    return result["stage"], result["vehicles"], result["format"]
+
+
+def compare(results, baseline_path, tolerance):
+    """Regressions against an earlier results file: [(result, baseline median ms)]."""
+    with open(baseline_path) as f:
+        baseline = {_key(result): result for result in json.load(f)["results"]}
+    regressions = []
+    print(f"\n{'stage':<20}{'vehicles':>9}{'format':>12}{'base ms':>10}{'now ms':>10}{'change':>9}")
+    for result in results:
+        before = baseline.get(_key(result))
+        if before is None or not before["median_ms"]:
+            continue
+        change = result["median_ms"] / before["median_ms"] - 1
+        slower = change > tolerance and result["median_ms"] - before["median_ms"] >= MIN_REGRESSION_MS
+        flag = " ❌" if slower else ""
+        print(f"{result['stage']:<20}{result['vehicles']:>9}{result['format'] or '-':>12}"
+              f"{before['median_ms']:>10.2f}{result['median_ms']:>10.2f}{change:>+8.0%}{flag}")
+        if slower:
+            regressions.append((result, before["median_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Realtime pipeline benchmark on synthetic feeds")
+    parser.add_argument("--vehicles", default=DEFAULT_SIZES, help="Comma-separated feed sizes")
+    parser.add_argument("--formats", default="json,aggregated", help="RECORD_FORMATs to send")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--shards", type=int, default=4, help="Shards of the local stream")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default="bench_pipeline_results.json")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.vehicles.split(",")]
+    formats = [name for name in args.formats.split(",") if name]
+    server = FeedServer()
+    results = []
+    try:
+        for vehicles in sizes:
+            print(f"🚌 {vehicles} vehicles...")
+            feed_results, entity_list = bench_feed_stages(server, vehicles, args.repeat, args.seed)
+            results.extend(feed_results)
+            for record_format in formats:
+                results.extend(bench_stream_stages(entity_list, record_format, args.repeat, args.shards))
+    finally:
+        server.close()
+
+    print(f"\n{'stage':<20}{'vehicles':>9}{'format':>12}{'median ms':>11}{'µs/vehicle':>12}")
+    for result in results:
+        print(f"{result['stage']:<20}{result['vehicles']:>9}{result['format'] or '-':>12}"
+              f"{result['median_ms']:>11.2f}{result['us_per_vehicle']:>12.2f}")
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": environment(),
+        "settings": {"repeat": args.repeat, "shards": args.shards, "seed": args.seed, "formats": formats},
+        "results": results,
+    }
+    directory = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Results written to {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} stage(s) more than {args.tolerance:.0%} slower than the baseline")
+            sys.exit(1)
+        print("✅ No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmarks spatial_index against brute-force scans on synthetic data spread
+over the UTA service area (or a real stops file with --stops).
+
+    python scripts/bench_spatial_index.py
+    python scripts/bench_spatial_index.py --stops gtfs.zip --vehicles 2000
+
+Measures, for the same queries:
+    nearest stop    k nearest stops per vehicle (grid rings vs numpy scan)
+and checks that both approaches return the same answers.
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from spatial_index import EARTH_RADIUS_M, StopIndex
+
+SOUTH, WEST, NORTH, EAST = 40.0, -112.2, 41.4, -111.6
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def brute_nearest(stop_ids, stop_lat, stop_lon, lat, lon, k):
+    phi1, phi2 = np.radians(lat), np.radians(stop_lat)
+    a = (np.sin((phi2 - phi1) / 2) ** 2
+         + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(stop_lon - lon) / 2) ** 2)
+    distance = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+    order = np.argpartition(distance, k)[:k] if len(distance) > k else np.arange(len(distance))
+    order = order[np.argsort(distance[order])]
+    return [stop_ids[i] for i in order]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grid index vs brute force")
+    parser.add_argument("--stops", help="GTFS zip, stops.txt or Parquet (default: synthetic)")
+    parser.add_argument("--stop-count", type=int, default=6000, help="Synthetic stops")
+    parser.add_argument("--vehicles", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.stops:
+        stops = StopIndex.load(args.stops)
+    else:
+        stops = StopIndex((f"s{i}", None, rng.uniform(SOUTH, NORTH), rng.uniform(WEST, EAST))
+                          for i in range(args.stop_count))
+    stop_ids = list(stops.grid.points)
+    stop_lat = np.array([stops.grid.points[s][0] for s in stop_ids])
+    stop_lon = np.array([stops.grid.points[s][1] for s in stop_ids])
+
+    vehicle_ids = [f"v{i}" for i in range(args.vehicles)]
+    v_lat = np.array([rng.uniform(SOUTH, NORTH) for _ in vehicle_ids])
+    v_lon = np.array([rng.uniform(WEST, EAST) for _ in vehicle_ids])
+
+    print(f"📍 {len(stops)} stops, {len(vehicle_ids)} vehicles, k={args.k}")
+    results = []
+
+    # 1. Nearest stops for every vehicle
+    grid_s, grid_nearest = timed(lambda: [[s["stop_id"] for s in stops.nearest(lat, lon, args.k)]
+                                          for lat, lon in zip(v_lat.tolist(), v_lon.tolist())], args.repeat)
+    brute_s, brute_nearest_ids = timed(lambda: [brute_nearest(stop_ids, stop_lat, stop_lon, lat, lon, args.k)
+                                                for lat, lon in zip(v_lat, v_lon)], args.repeat)
+    results.append(("nearest stop", grid_s, brute_s, grid_nearest == brute_nearest_ids))
+
+    print(f"{'query':<14}{'grid ms':>10}{'brute ms':>10}{'speedup':>9}  same")
+    for name, grid_s, brute_s, same in results:
+        print(f"{name:<14}{grid_s * 1000:>10.2f}{brute_s * 1000:>10.2f}{brute_s / grid_s:>8.1f}x  {'✅' if same else '❌'}")
+
+
+if __name__ == "__main__":
+    main()
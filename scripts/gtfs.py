@@ -1,48 +1,65 @@
+"""
+Dash app: live UTA vehicle map, charts of the vehicle columns, and
+bunching/gap events.
+
+Kinesis is only read by a StreamHub (docker_dashboard/stream_hub.py), one
+per server process: its background thread keeps a columnar VehicleStore of
+the whole fleet and publishes versioned, immutable snapshots. The callbacks
+only read those snapshots:
+
+- the interval tick checks for a new snapshot version; the map then gets a
+  dash.Patch that moves only the changed markers (live_map.LiveMap), and
+  the chart is redrawn from the snapshot.
+- changing a dropdown redraws the chart from the current snapshot, so it no
+  longer moves the shard iterator or drops records.
+"""
+import os
+import sys
+import threading
+
 import boto3
-import json
 import dash
-from dash import dcc, html
-from dash.dependencies import Output, Input
+from dash import dcc, html, no_update
+from dash.dependencies import Output, Input, State
 import plotly.express as px
-import pandas as pd
+
+from live_map import LiveMap
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'docker_dashboard'))
+from stream_hub import StreamHub
 
 # --- AWS Kinesis client setup ---
-kinesis_client = boto3.client("kinesis", region_name="us-east-1a")  # adjust region
-stream_name = "uta_Gtfs_kinesis_stream"
-shard_id = "shardId-000000000000"   # explicit shard
-
-# Global shard iterator
-shard_iterator = None
-
-def init_iterator():
-    """Initialize shard iterator from TRIM_HORIZON (earliest available)."""
-    global shard_iterator
-    shard_iterator = kinesis_client.get_shard_iterator(
-        StreamName=stream_name,
-        ShardId=shard_id,
-        ShardIteratorType="TRIM_HORIZON"
-    )["ShardIterator"]
-
-def get_records(limit=100):
-    """Fetch records from Kinesis stream and return as DataFrame."""
-    global shard_iterator
-    if shard_iterator is None:
-        init_iterator()
-
-    records_response = kinesis_client.get_records(ShardIterator=shard_iterator, Limit=limit)
-    shard_iterator = records_response["NextShardIterator"]  # advance iterator
-
-    records = [json.loads(r["Data"]) for r in records_response["Records"]]
-    return pd.DataFrame(records) if records else pd.DataFrame()
+kinesis_client = boto3.client("kinesis", region_name=os.environ.get("AWS_REGION", "us-east-1"))
+stream_name = os.environ.get("KINESIS_STREAM_NAME", "uta_Gtfs_kinesis_stream")
+
+# Bunching/gap events from headway.py (optional second stream)
+headway_stream_name = os.environ.get("HEADWAY_STREAM_NAME")
+
+HEADWAY_COLUMNS = ["event", "route_id", "direction_id", "vehicle_id", "leader_id",
+                   "headway_s", "scheduled_headway_s", "timestamp"]
+
+# Started on the first callback (not at import, so the debug reloader's
+# watcher process does not read the stream too)
+hub = None
+hub_lock = threading.Lock()
+live_map = LiveMap()
+
+def get_hub():
+    global hub
+    with hub_lock:
+        if hub is None:
+            hub = StreamHub(kinesis_client, stream_name, events_stream_name=headway_stream_name)
+    return hub
 
 # --- Known schema from Lambda ---
 KNOWN_COLUMNS = [
     "id", "trip_id", "route_id",
     "latitude", "longitude",
+    "speed_mph", "delay_seconds", "next_stop_id",
     "vehicle_timestamp", "source_timestamp"
 ]
 
-graph_types = ["Map", "Scatter", "Line", "Bar"]
+graph_types = ["Scatter", "Line", "Bar"]
 
 # --- Dash app setup ---
 app = dash.Dash(__name__)
@@ -50,6 +67,12 @@ app = dash.Dash(__name__)
 app.layout = html.Div([
     html.H1("UTA Vehicle Tracking Dashboard"),
 
+    dcc.Graph(id="vehicle-map", figure=live_map.figure()[0]),
+    # LiveMap generation/version this browser has, so ticks only send the changes
+    dcc.Store(id="map-state"),
+    # Snapshot version shown in the chart; the chart redraws when it changes
+    dcc.Store(id="snapshot-version"),
+
     html.Div([
         html.Label("Select X-axis column"),
         dcc.Dropdown(
@@ -69,43 +92,72 @@ app.layout = html.Div([
         dcc.Dropdown(
             id="graph-type",
             options=[{"label": g, "value": g} for g in graph_types],
-            value="Map"
+            value="Scatter"
         )
     ], style={"width": "30%", "display": "inline-block", "verticalAlign": "top"}),
 
     dcc.Interval(id="interval-component", interval=5000, n_intervals=0),
-    dcc.Graph(id="vehicle-graph")
+    dcc.Graph(id="vehicle-graph"),
+
+    html.H3("Bunching & Gaps"),
+    html.Div(id="headway-events")
 ])
 
+@app.callback(
+    [Output("vehicle-map", "figure"),
+     Output("map-state", "data"),
+     Output("snapshot-version", "data")],
+    [Input("interval-component", "n_intervals")],
+    [State("map-state", "data"),
+     State("snapshot-version", "data")]
+)
+def update_map(n, map_state, shown_version):
+    snapshot = get_hub().snapshot()
+    if snapshot.version == shown_version and map_state == live_map.state():
+        return no_update, no_update, no_update
+    live_map.sync(snapshot.vehicles, snapshot.version)
+    figure, map_state = live_map.update(map_state)
+    return (figure if figure is not None else no_update, map_state,
+            snapshot.version if snapshot.version != shown_version else no_update)
+
 @app.callback(
     Output("vehicle-graph", "figure"),
-    [Input("interval-component", "n_intervals"),
+    [Input("snapshot-version", "data"),
      Input("x-col", "value"),
      Input("y-col", "value"),
      Input("graph-type", "value")]
 )
-def update_graph(n, x_col, y_col, graph_type):
-    df = get_records()
-    if df.empty:
+def update_graph(version, x_col, y_col, graph_type):
+    # Dropdown changes redraw from the cached snapshot, without reading Kinesis
+    vehicles = get_hub().snapshot().vehicles
+    if not len(vehicles):
         return px.scatter(title="No data yet")
+    df = vehicles.to_frame(slice(None), names=KNOWN_COLUMNS)
 
-    if graph_type == "Map":
-        fig = px.scatter_mapbox(
-            df, lat="latitude", lon="longitude",
-            hover_name="id", hover_data=KNOWN_COLUMNS,
-            zoom=10, height=600
-        )
-        fig.update_layout(mapbox_style="open-street-map")
-    elif graph_type == "Scatter":
-        fig = px.scatter(df, x=x_col, y=y_col, hover_data=KNOWN_COLUMNS)
-    elif graph_type == "Line":
-        fig = px.line(df, x=x_col, y=y_col, hover_data=KNOWN_COLUMNS)
+    if graph_type == "Line":
+        fig = px.line(df.sort_values(x_col), x=x_col, y=y_col, hover_data=KNOWN_COLUMNS)
     elif graph_type == "Bar":
         fig = px.bar(df, x=x_col, y=y_col, hover_data=KNOWN_COLUMNS)
     else:
-        fig = px.scatter(df, x=x_col, y=y_col)
-
+        fig = px.scatter(df, x=x_col, y=y_col, hover_data=KNOWN_COLUMNS)
+    # Keep zoom and selections when the data (not the axes) changes
+    fig.update_layout(uirevision=f"{x_col}/{y_col}/{graph_type}")
     return fig
 
+@app.callback(
+    Output("headway-events", "children"),
+    [Input("interval-component", "n_intervals")]
+)
+def update_headway_events(n):
+    if not headway_stream_name:
+        return "Set HEADWAY_STREAM_NAME to show bunching and gap events."
+    events = get_hub().headway_events()
+    if not events:
+        return "No bunching or gaps yet."
+    return html.Table(
+        [html.Tr([html.Th(c) for c in HEADWAY_COLUMNS])] +
+        [html.Tr([html.Td(event.get(c)) for c in HEADWAY_COLUMNS]) for event in events]
+    )
+
 if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0', port=8050, ssl_context='adhoc')
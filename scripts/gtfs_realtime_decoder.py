@@ -19,6 +19,11 @@ else:
 OUTPUT_DIR = "/data/GTFS_realtime"
 OUTPUT_FILE = f"{OUTPUT_DIR}/realtime_dump.json"
 
+# OUTPUT_FORMAT=json overwrites realtime_dump.json with the whole feed (MessageToDict).
+# OUTPUT_FORMAT=ndjson|parquet flattens the feed into typed tables and appends
+# them under OUTPUT_DIR/<table>/date=YYYY-MM-DD/ (see gtfs_rt_flatten.py).
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'json')
+
 def fetch_and_decode():
     print(f"1. Fetching binary data from {URL}...")
     
@@ -42,6 +47,18 @@ def fetch_and_decode():
         print(f"Error parsing protobuf: {e}")
         sys.exit(1)
 
+    if OUTPUT_FORMAT in ('ndjson', 'parquet'):
+        from gtfs_rt_flatten import flatten_feed, make_writer
+
+        print(f"3. Flattening {len(feed.entity)} entities into typed tables...")
+        tables = flatten_feed(feed)
+
+        print(f"4. Appending {OUTPUT_FORMAT} files under {OUTPUT_DIR}/...")
+        written = make_writer(OUTPUT_FORMAT, OUTPUT_DIR).write(tables, feed.header.timestamp)
+        print(f"   Rows written: {written}")
+        print("Success.")
+        return
+
     print(f"3. Converting {len(feed.entity)} entities to JSON...")
     data_dict = MessageToDict(feed)
 
@@ -0,0 +1,264 @@
+"""
+Flattens a GTFS-RT FeedMessage straight into typed columns, in one pass over
+feed.entity, without MessageToDict.
+
+Tables produced (one row per):
+    vehicle_positions   VehiclePosition entity
+    trip_updates        TripUpdate entity
+    stop_time_updates   StopTimeUpdate inside a TripUpdate (child table,
+                        joined back on entity_id + feed_timestamp)
+    alerts              Alert entity (first active period, first translation)
+
+Optional protobuf fields that are not set come out as None, so "no speed
+reported" and "speed 0" stay different.
+
+Writers append to rolling files that DuckDB can query in place:
+    <output_dir>/<table>/date=YYYY-MM-DD/<part>.ndjson|.parquet
+
+    SELECT * FROM read_json_auto('/data/GTFS_realtime/vehicle_positions/*/*.ndjson');
+    SELECT * FROM read_parquet('/data/GTFS_realtime/stop_time_updates/*/*.parquet', hive_partitioning = true);
+"""
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+# Column name -> type (pyarrow alias). Also the column order on disk.
+SCHEMAS = {
+    "vehicle_positions": [
+        ("entity_id", "string"),
+        ("vehicle_id", "string"),
+        ("vehicle_label", "string"),
+        ("trip_id", "string"),
+        ("route_id", "string"),
+        ("direction_id", "int32"),
+        ("start_date", "string"),
+        ("start_time", "string"),
+        ("latitude", "float64"),
+        ("longitude", "float64"),
+        ("bearing", "float32"),
+        ("speed", "float32"),
+        ("current_stop_sequence", "int32"),
+        ("stop_id", "string"),
+        ("current_status", "int32"),
+        ("occupancy_status", "int32"),
+        ("vehicle_timestamp", "int64"),
+        ("feed_timestamp", "int64"),
+    ],
+    "trip_updates": [
+        ("entity_id", "string"),
+        ("trip_id", "string"),
+        ("route_id", "string"),
+        ("direction_id", "int32"),
+        ("start_date", "string"),
+        ("start_time", "string"),
+        ("schedule_relationship", "int32"),
+        ("vehicle_id", "string"),
+        ("delay", "int32"),
+        ("timestamp", "int64"),
+        ("feed_timestamp", "int64"),
+    ],
+    "stop_time_updates": [
+        ("entity_id", "string"),
+        ("trip_id", "string"),
+        ("stop_sequence", "int32"),
+        ("stop_id", "string"),
+        ("arrival_delay", "int32"),
+        ("arrival_time", "int64"),
+        ("departure_delay", "int32"),
+        ("departure_time", "int64"),
+        ("schedule_relationship", "int32"),
+        ("feed_timestamp", "int64"),
+    ],
+    "alerts": [
+        ("entity_id", "string"),
+        ("cause", "int32"),
+        ("effect", "int32"),
+        ("header_text", "string"),
+        ("description_text", "string"),
+        ("active_start", "int64"),
+        ("active_end", "int64"),
+        ("route_ids", "string"),
+        ("stop_ids", "string"),
+        ("feed_timestamp", "int64"),
+    ],
+}
+
+
+def _empty_tables():
+    return {table: {name: [] for name, _ in columns} for table, columns in SCHEMAS.items()}
+
+
+def _opt(message, field):
+    """Value of an optional proto2 field, or None when it is not set."""
+    return getattr(message, field) if message.HasField(field) else None
+
+
+def _text(translated):
+    return translated.translation[0].text if translated.translation else None
+
+
+def flatten_feed(feed):
+    """
+    Walks feed.entity once and returns {table: {column: [values]}}.
+    Tables with no rows are still present, with empty columns.
+    """
+    tables = _empty_tables()
+    vp = tables["vehicle_positions"]
+    tu = tables["trip_updates"]
+    stu = tables["stop_time_updates"]
+    al = tables["alerts"]
+    feed_timestamp = feed.header.timestamp
+
+    for entity in feed.entity:
+        if entity.HasField("vehicle"):
+            v = entity.vehicle
+            trip = v.trip
+            pos = v.position
+            vp["entity_id"].append(entity.id)
+            vp["vehicle_id"].append(v.vehicle.id or None)
+            vp["vehicle_label"].append(v.vehicle.label or None)
+            vp["trip_id"].append(trip.trip_id or None)
+            vp["route_id"].append(trip.route_id or None)
+            vp["direction_id"].append(_opt(trip, "direction_id"))
+            vp["start_date"].append(trip.start_date or None)
+            vp["start_time"].append(trip.start_time or None)
+            vp["latitude"].append(pos.latitude if v.HasField("position") else None)
+            vp["longitude"].append(pos.longitude if v.HasField("position") else None)
+            vp["bearing"].append(_opt(pos, "bearing"))
+            vp["speed"].append(_opt(pos, "speed"))
+            vp["current_stop_sequence"].append(_opt(v, "current_stop_sequence"))
+            vp["stop_id"].append(v.stop_id or None)
+            vp["current_status"].append(_opt(v, "current_status"))
+            vp["occupancy_status"].append(_opt(v, "occupancy_status"))
+            vp["vehicle_timestamp"].append(_opt(v, "timestamp"))
+            vp["feed_timestamp"].append(feed_timestamp)
+
+        if entity.HasField("trip_update"):
+            t = entity.trip_update
+            trip = t.trip
+            tu["entity_id"].append(entity.id)
+            tu["trip_id"].append(trip.trip_id or None)
+            tu["route_id"].append(trip.route_id or None)
+            tu["direction_id"].append(_opt(trip, "direction_id"))
+            tu["start_date"].append(trip.start_date or None)
+            tu["start_time"].append(trip.start_time or None)
+            tu["schedule_relationship"].append(_opt(trip, "schedule_relationship"))
+            tu["vehicle_id"].append(t.vehicle.id or None)
+            tu["delay"].append(_opt(t, "delay"))
+            tu["timestamp"].append(_opt(t, "timestamp"))
+            tu["feed_timestamp"].append(feed_timestamp)
+
+            for update in t.stop_time_update:
+                arrival = update.arrival if update.HasField("arrival") else None
+                departure = update.departure if update.HasField("departure") else None
+                stu["entity_id"].append(entity.id)
+                stu["trip_id"].append(trip.trip_id or None)
+                stu["stop_sequence"].append(_opt(update, "stop_sequence"))
+                stu["stop_id"].append(update.stop_id or None)
+                stu["arrival_delay"].append(_opt(arrival, "delay") if arrival else None)
+                stu["arrival_time"].append(_opt(arrival, "time") if arrival else None)
+                stu["departure_delay"].append(_opt(departure, "delay") if departure else None)
+                stu["departure_time"].append(_opt(departure, "time") if departure else None)
+                stu["schedule_relationship"].append(_opt(update, "schedule_relationship"))
+                stu["feed_timestamp"].append(feed_timestamp)
+
+        if entity.HasField("alert"):
+            a = entity.alert
+            period = a.active_period[0] if a.active_period else None
+            al["entity_id"].append(entity.id)
+            al["cause"].append(_opt(a, "cause"))
+            al["effect"].append(_opt(a, "effect"))
+            al["header_text"].append(_text(a.header_text))
+            al["description_text"].append(_text(a.description_text))
+            al["active_start"].append(_opt(period, "start") if period else None)
+            al["active_end"].append(_opt(period, "end") if period else None)
+            al["route_ids"].append(",".join(sorted({i.route_id for i in a.informed_entity if i.route_id})) or None)
+            al["stop_ids"].append(",".join(sorted({i.stop_id for i in a.informed_entity if i.stop_id})) or None)
+            al["feed_timestamp"].append(feed_timestamp)
+
+    return tables
+
+
+def row_count(columns):
+    return len(next(iter(columns.values()))) if columns else 0
+
+
+def _partition_dir(output_dir, table, feed_timestamp):
+    day = datetime.fromtimestamp(feed_timestamp or time.time(), timezone.utc).strftime("%Y-%m-%d")
+    path = os.path.join(output_dir, table, f"date={day}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class NdjsonWriter:
+    """
+    Appends rows to one NDJSON file per table per hour; the file rolls over
+    at the top of the hour or when it grows past max_bytes.
+    """
+
+    def __init__(self, output_dir, max_bytes=64 * 1024 * 1024):
+        self.output_dir = output_dir
+        self.max_bytes = max_bytes
+
+    def _current_file(self, table, feed_timestamp):
+        directory = _partition_dir(self.output_dir, table, feed_timestamp)
+        hour = datetime.fromtimestamp(feed_timestamp or time.time(), timezone.utc).strftime("%H")
+        part = 0
+        while True:
+            path = os.path.join(directory, f"hour={hour}-{part:03d}.ndjson")
+            if not os.path.exists(path) or os.path.getsize(path) < self.max_bytes:
+                return path
+            part += 1
+
+    def write(self, tables, feed_timestamp):
+        written = {}
+        for table, columns in tables.items():
+            rows = row_count(columns)
+            if not rows:
+                continue
+            names = list(columns)
+            path = self._current_file(table, feed_timestamp)
+            with open(path, "a") as f:
+                for values in zip(*(columns[name] for name in names)):
+                    f.write(json.dumps(dict(zip(names, values)), separators=(",", ":")))
+                    f.write("\n")
+            written[table] = rows
+        return written
+
+
+class ParquetWriter:
+    """
+    Writes one small Parquet part file per table per snapshot (needs
+    pyarrow). The random suffix keeps two snapshots with the same
+    feed_timestamp (or none at all) from overwriting each other.
+    """
+
+    def __init__(self, output_dir, compression="zstd"):
+        import pyarrow  # noqa: F401  (fail early if it is missing)
+        self.output_dir = output_dir
+        self.compression = compression
+
+    def write(self, tables, feed_timestamp):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        written = {}
+        for table, columns in tables.items():
+            rows = row_count(columns)
+            if not rows:
+                continue
+            schema = pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in SCHEMAS[table]])
+            arrow_table = pa.Table.from_pydict(columns, schema=schema)
+            directory = _partition_dir(self.output_dir, table, feed_timestamp)
+            path = os.path.join(directory, f"part-{feed_timestamp}-{uuid.uuid4().hex[:12]}.parquet")
+            pq.write_table(arrow_table, path, compression=self.compression)
+            written[table] = rows
+        return written
+
+
+def make_writer(output_format, output_dir):
+    if output_format == "parquet":
+        return ParquetWriter(output_dir)
+    return NdjsonWriter(output_dir)
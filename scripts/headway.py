@@ -0,0 +1,303 @@
+"""
+Streaming headways and bunching per route and direction.
+
+Runs after adherence.py, which gives every matched vehicle its distance
+along the trip's shape (shape_dist_m), direction_id and delay_seconds.
+For each (route_id, direction_id) the tracker keeps the vehicles sorted by
+distance, so the vehicle directly ahead of a bus is its leader:
+
+1. Each vehicle keeps a short history of (distance, timestamp) fixes
+   (HISTORY_FIXES, a deque), which bounds memory per vehicle and so per route.
+   A small step back (projection jitter at a stop) is held at the furthest
+   distance; only a new trip or a jump back of more than REGRESSION_M
+   clears the history.
+2. Actual headway of a follower = now - the time its leader passed the
+   follower's current distance, interpolated from the leader's history.
+3. Scheduled headway = actual - follower delay + leader delay, i.e. the gap
+   the two trips would have if both were running exactly on schedule.
+4. A follower is 'bunching' below BUNCH_RATIO x scheduled (or under
+   MIN_HEADWAY_S) and a 'gap' above GAP_RATIO x scheduled. Events are only
+   emitted when that state changes ('bunching', 'gap', 'cleared').
+
+Updates are O(changed vehicles): a vehicle whose fix did not change is
+skipped, and a moved vehicle only re-evaluates itself and the followers
+behind its old and new positions. Vehicles not seen for STALE_SECONDS are
+expired from the front of an insertion-ordered dict, without a fleet scan.
+"""
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+
+HISTORY_FIXES = 40       # fixes kept per vehicle (~10 min at a 15 s poll)
+STALE_SECONDS = 300      # vehicles not reported for this long are dropped
+TERMINAL_M = 300.0       # vehicles this close to the start of the shape are laying over
+BUNCH_RATIO = 0.25       # headway below 25% of scheduled: bunching
+GAP_RATIO = 2.0          # headway above twice the scheduled one: gap
+MIN_HEADWAY_S = 60       # closer than this is bunching even without a schedule
+CLEAR_MARGIN = 1.2       # hysteresis: a state clears only this far back inside the band
+REGRESSION_M = 100.0     # a trip moving back further than this restarts its history
+
+
+class VehicleTrack:
+    __slots__ = ("vehicle_id", "group", "trip_id", "dist", "ts", "delay", "history",
+                 "state", "leader_id", "headway", "scheduled")
+
+    def __init__(self, vehicle_id):
+        self.vehicle_id = vehicle_id
+        self.group = None       # (route_id, direction_id) while placed on a route
+        self.trip_id = None
+        self.dist = None
+        self.ts = None
+        self.delay = None
+        self.history = deque(maxlen=HISTORY_FIXES)
+        self.state = "ok"
+        self.leader_id = None
+        self.headway = None
+        self.scheduled = None
+
+    def passed_at(self, dist):
+        """Time this vehicle passed `dist`, from its history (None if unknown)."""
+        history = self.history
+        if not history or history[-1][0] < dist:
+            return None
+        if history[0][0] > dist:
+            # Passed before the oldest fix kept: extrapolate at its average speed
+            (d0, t0), (d1, t1) = history[0], history[-1]
+            if len(history) < 2 or d1 <= d0 or t1 <= t0:
+                return None
+            return t0 - (d0 - dist) * (t1 - t0) / (d1 - d0)
+        for i in range(len(history) - 1, 0, -1):
+            d0, t0 = history[i - 1]
+            if d0 <= dist:
+                d1, t1 = history[i]
+                if d1 <= d0:
+                    return t1
+                return t0 + (dist - d0) * (t1 - t0) / (d1 - d0)
+        return history[0][1]
+
+
+class RouteGroup:
+    """Vehicles of one route and direction, sorted by distance along the shape."""
+
+    __slots__ = ("order", "bunching", "gaps", "headway_sum", "headway_count")
+
+    def __init__(self):
+        self.order = []          # sorted [(dist, vehicle_id)]
+        self.bunching = 0
+        self.gaps = 0
+        self.headway_sum = 0.0
+        self.headway_count = 0
+
+    def neighbours(self, dist, vehicle_id):
+        """(follower id, leader id) around a (dist, vehicle_id) entry."""
+        i = bisect_left(self.order, (dist, vehicle_id))
+        follower = self.order[i - 1][1] if i > 0 else None
+        j = i + 1 if i < len(self.order) and self.order[i] == (dist, vehicle_id) else i
+        leader = self.order[j][1] if j < len(self.order) else None
+        return follower, leader
+
+
+class HeadwayTracker:
+
+    def __init__(self, bunch_ratio=BUNCH_RATIO, gap_ratio=GAP_RATIO, min_headway_s=MIN_HEADWAY_S,
+                 stale_seconds=STALE_SECONDS, terminal_m=TERMINAL_M):
+        self.bunch_ratio = bunch_ratio
+        self.gap_ratio = gap_ratio
+        self.min_headway_s = min_headway_s
+        self.stale_seconds = stale_seconds
+        self.terminal_m = terminal_m
+        self.groups = {}                 # (route_id, direction_id) -> RouteGroup
+        self.vehicles = OrderedDict()    # vehicle id -> VehicleTrack, least recently seen first
+
+    def update(self, entity_list):
+        """
+        Applies one poll (full or delta, tombstones included). Returns
+        (events, summary); events are dicts ready to publish.
+        """
+        events = []
+        dirty = set()        # followers whose headway must be re-evaluated
+        touched = set()      # groups that changed
+        newest = 0
+        changed = 0
+        for entity in entity_list:
+            vehicle_id = entity.get("id")
+            if vehicle_id is None:
+                continue
+            if entity.get("deleted"):
+                self._remove(vehicle_id, dirty, touched, events)
+                continue
+            timestamp = entity.get("vehicle_timestamp") or entity.get("source_timestamp") or 0
+            newest = max(newest, timestamp)
+            track = self.vehicles.get(vehicle_id)
+            if track is not None and track.ts == timestamp and track.dist == entity.get("shape_dist_m"):
+                continue
+            changed += 1
+            self._move(vehicle_id, entity, timestamp, dirty, touched, events)
+
+        # Expire vehicles that stopped reporting (oldest first, stop at the first fresh one)
+        while self.vehicles and newest:
+            vehicle_id, track = next(iter(self.vehicles.items()))
+            if track.ts is not None and track.ts >= newest - self.stale_seconds:
+                break
+            self._remove(vehicle_id, dirty, touched, events)
+
+        for vehicle_id in dirty:
+            track = self.vehicles.get(vehicle_id)
+            if track is not None and track.group is not None:
+                self._evaluate(track, events)
+
+        summary = {"vehicles": len(self.vehicles), "changed": changed, "routes": len(self.groups),
+                   "events": len(events)}
+        return events + [self.route_record(group) for group in touched if group in self.groups], summary
+
+    # --- Incremental maintenance -----------------------------------------
+
+    def _move(self, vehicle_id, entity, timestamp, dirty, touched, events):
+        track = self.vehicles.pop(vehicle_id, None) or VehicleTrack(vehicle_id)
+        self.vehicles[vehicle_id] = track    # most recently seen goes to the end
+
+        dist = entity.get("shape_dist_m")
+        route_id = entity.get("route_id")
+        group_key = (route_id, entity.get("direction_id"))
+        # Off the schedule, laying over at the first terminal, or past the last stop
+        placed = (dist is not None and route_id is not None and dist >= self.terminal_m
+                  and entity.get("next_stop_id") is not None)
+
+        if track.group is not None:
+            # Staying on the same route keeps its state; leaving it clears it
+            self._unplace(track, dirty, touched, events, leaving=not placed or track.group != group_key)
+        if track.trip_id != entity.get("trip_id") or (track.dist is not None and dist is not None
+                                                      and dist < track.dist - REGRESSION_M):
+            track.history.clear()     # new trip, or a reset along the shape
+        elif track.dist is not None and dist is not None and dist < track.dist:
+            dist = track.dist         # projection jitter at a stop: hold the furthest position
+        track.trip_id = entity.get("trip_id")
+        track.dist = dist
+        track.ts = timestamp
+        track.delay = entity.get("delay_seconds")
+        if not placed:
+            return
+
+        track.history.append((dist, timestamp))
+        group = self.groups.get(group_key)
+        if group is None:
+            group = self.groups[group_key] = RouteGroup()
+        insort(group.order, (dist, vehicle_id))
+        track.group = group_key
+        touched.add(group_key)
+        follower, _ = group.neighbours(dist, vehicle_id)
+        dirty.add(vehicle_id)
+        if follower is not None:
+            dirty.add(follower)
+
+    def _unplace(self, track, dirty, touched, events, leaving=True):
+        """Takes a vehicle out of its group's order; its old follower gets a new leader."""
+        group = self.groups[track.group]
+        entry = (track.dist, track.vehicle_id)
+        follower, _ = group.neighbours(*entry)
+        i = bisect_left(group.order, entry)
+        if i < len(group.order) and group.order[i] == entry:
+            del group.order[i]
+        if follower is not None:
+            dirty.add(follower)
+        touched.add(track.group)
+        if not leaving:
+            return
+        if track.state != "ok":
+            events.append(self._event("cleared", track))
+        self._set_headway(track, group, None, None)
+        self._set_state(track, group, "ok")
+        if not group.order:
+            del self.groups[track.group]
+        track.group = None
+
+    def _remove(self, vehicle_id, dirty, touched, events):
+        track = self.vehicles.pop(vehicle_id, None)
+        if track is not None and track.group is not None:
+            self._unplace(track, dirty, touched, events)
+
+    def _evaluate(self, track, events):
+        group = self.groups[track.group]
+        _, leader_id = group.neighbours(track.dist, track.vehicle_id)
+        leader = self.vehicles.get(leader_id) if leader_id is not None else None
+        passed = leader.passed_at(track.dist) if leader is not None else None
+        if passed is None:
+            self._set_headway(track, group, None, None)
+            state = "ok"
+        else:
+            headway = max(0.0, track.ts - passed)
+            scheduled = None
+            if track.delay is not None and leader.delay is not None:
+                scheduled = headway - track.delay + leader.delay
+                scheduled = scheduled if scheduled > 0 else None
+            self._set_headway(track, group, headway, scheduled)
+            state = self._classify(track.state, headway, scheduled)
+        track.leader_id = leader_id
+        if state != track.state:
+            self._set_state(track, group, state)
+            events.append(self._event(state if state != "ok" else "cleared", track))
+
+    def _classify(self, current, headway, scheduled):
+        # Leaving a state needs CLEAR_MARGIN more room than entering it (no flapping)
+        margin = CLEAR_MARGIN if current != "ok" else 1.0
+        bunch_limit = self.min_headway_s
+        if scheduled:
+            bunch_limit = max(bunch_limit, self.bunch_ratio * scheduled)
+        if headway < bunch_limit * (margin if current == "bunching" else 1.0):
+            return "bunching"
+        if scheduled and headway > self.gap_ratio * scheduled / (margin if current == "gap" else 1.0):
+            return "gap"
+        return "ok"
+
+    @staticmethod
+    def _set_headway(track, group, headway, scheduled):
+        if track.headway is not None:
+            group.headway_sum -= track.headway
+            group.headway_count -= 1
+        if headway is not None:
+            group.headway_sum += headway
+            group.headway_count += 1
+        track.headway, track.scheduled = headway, scheduled
+
+    @staticmethod
+    def _set_state(track, group, state):
+        if track.state == "bunching":
+            group.bunching -= 1
+        elif track.state == "gap":
+            group.gaps -= 1
+        if state == "bunching":
+            group.bunching += 1
+        elif state == "gap":
+            group.gaps += 1
+        track.state = state
+
+    # --- Output ------------------------------------------------------------
+
+    def _event(self, kind, track):
+        route_id, direction_id = track.group
+        return {
+            "event": kind,
+            "route_id": route_id,
+            "direction_id": direction_id,
+            "vehicle_id": track.vehicle_id,
+            "leader_id": track.leader_id,
+            "headway_s": round(track.headway) if track.headway is not None else None,
+            "scheduled_headway_s": round(track.scheduled) if track.scheduled is not None else None,
+            "shape_dist_m": track.dist,
+            "timestamp": track.ts,
+        }
+
+    def route_record(self, group_key):
+        """Current counters of one route and direction (kept incrementally, no scan)."""
+        group = self.groups[group_key]
+        return {
+            "event": "route",
+            "route_id": group_key[0],
+            "direction_id": group_key[1],
+            "vehicles": len(group.order),
+            "bunching": group.bunching,
+            "gaps": group.gaps,
+            "mean_headway_s": round(group.headway_sum / group.headway_count) if group.headway_count else None,
+        }
+
+    def route_stats(self):
+        return [self.route_record(group_key) for group_key in self.groups]
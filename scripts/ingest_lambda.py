@@ -1,57 +1,635 @@
+import csv
+import hashlib
+import importlib.util
+import io
 import json
 import os
+import resource
+import shutil
+import tempfile
+import time
+import urllib.error
 import urllib.request
 import zipfile
+import zlib
 import boto3
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 # Environment Variables (Set these in AWS Lambda Console)
 # GTFS_FEED_URL = https://gtfsfeed.rideuta.com/GTFS.zip
 # BUCKET_NAME = your-bucket-name
+# INGEST_MODE = stream (default) | extract
+# UPLOAD_WORKERS = 4 (number of files uploaded at the same time in stream mode)
+# PARQUET_OUTPUT = true (write typed Parquet copies of the core tables, needs pyarrow;
+#                  the Airflow DAG sends {"parquet": false} and converts each table in its own invocation;
+#                  false, or no pyarrow, also turns those per-table conversions into no-ops)
+# INCREMENTAL = true (skip unchanged archives/tables; pass {"force": true} to re-ingest everything)
 
 s3_client = boto3.client('s3')
 
-def lambda_handler(event, context):
-    print(f"🚀 Starting GTFS Ingestion...")
-    
-    # 1. Setup Paths (Lambda only allows writing to /tmp)
-    gtfs_url = os.environ.get('GTFS_FEED_URL')
-    bucket_name = os.environ.get('BUCKET_NAME')
-    
+# Multipart settings for the streaming uploads. Each zip member is read in
+# 8 MB parts, so a single file never needs more than a few parts in memory.
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+STREAM_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_CHUNK_SIZE,
+    multipart_chunksize=MULTIPART_CHUNK_SIZE,
+    max_concurrency=4,
+    use_threads=True,
+)
+
+
+# Typed Parquet output. Column names and types mirror the uta_gtfs_clean views
+# in sql/athena_transformation.sql so the Parquet tables can replace the
+# CAST-on-every-query views. Types are the pyarrow names: string, float64, int32.
+PARQUET_TABLES = {
+    'stops': [
+        ('stop_id', 'string'),
+        ('stop_name', 'string'),
+        ('stop_lat', 'float64'),
+        ('stop_lon', 'float64'),
+        ('parent_station', 'string'),
+    ],
+    'routes': [
+        ('route_id', 'string'),
+        ('route_short_name', 'string'),
+        ('route_long_name', 'string'),
+        ('route_type', 'int32'),
+    ],
+    'trips': [
+        ('route_id', 'string'),
+        ('service_id', 'string'),
+        ('trip_id', 'string'),
+        ('trip_headsign', 'string'),
+        ('direction_id', 'int32'),
+        ('shape_id', 'string'),
+    ],
+    'stop_times': [
+        ('trip_id', 'string'),
+        ('arrival_time', 'string'),
+        ('departure_time', 'string'),
+        ('stop_id', 'string'),
+        ('stop_sequence', 'int32'),
+    ],
+}
+PARQUET_PREFIX = "parquet"
+PARQUET_COMPRESSION = 'zstd'
+CSV_BLOCK_SIZE = 16 * 1024 * 1024   # bytes of CSV parsed per chunk
+STOP_TIMES_BUCKETS = 8              # stop_times is split into N files by hash(trip_id)
+
+# Columns a table must have to pass validation (required by the GTFS spec
+# and used by the clean views)
+REQUIRED_COLUMNS = {
+    'stops': ['stop_id', 'stop_lat', 'stop_lon'],
+    'routes': ['route_id', 'route_type'],
+    'trips': ['route_id', 'service_id', 'trip_id'],
+    'stop_times': ['trip_id', 'stop_id', 'stop_sequence'],
+}
+
+# Change detection. The state object remembers the last ETag/Last-Modified and
+# the sha256 + partition of every table; each run also writes a manifest saying
+# which partition holds the current copy of each table. Both live outside raw/
+# so the Glue crawler never picks them up as tables.
+MANIFEST_PREFIX = "manifests"
+STATE_KEY = f"{MANIFEST_PREFIX}/_state.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process so far (ru_maxrss is KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def tmp_used_mb():
+    """How much of Lambda's /tmp is currently in use."""
+    return shutil.disk_usage('/tmp').used / (1024 * 1024)
+
+
+def load_state(bucket_name):
+    """Reads the change-detection state from S3 (empty on the very first run)."""
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=STATE_KEY)
+    except s3_client.exceptions.NoSuchKey:
+        return {'tables': {}}
+    return json.loads(response['Body'].read())
+
+
+def save_state(bucket_name, state):
+    s3_client.put_object(Bucket=bucket_name, Key=STATE_KEY, Body=json.dumps(state, indent=2).encode('utf-8'))
+
+
+def download_archive(gtfs_url, state):
+    """
+    Downloads GTFS.zip straight into memory, sending the ETag/Last-Modified we
+    saw last time. Returns (archive, etag, last_modified), or (None, ...) when
+    UTA answers 304 Not Modified. The compressed archive is small compared to
+    the extracted text files, and keeping it in a BytesIO gives zipfile the
+    seekable handle it needs without touching /tmp.
+    """
+    request = urllib.request.Request(gtfs_url)
+    if state.get('etag'):
+        request.add_header('If-None-Match', state['etag'])
+    if state.get('last_modified'):
+        request.add_header('If-Modified-Since', state['last_modified'])
+
+    try:
+        with urllib.request.urlopen(request) as response:
+            return io.BytesIO(response.read()), response.headers.get('ETag'), response.headers.get('Last-Modified')
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, state.get('etag'), state.get('last_modified')
+        raise
+
+
+def hash_members(zip_ref):
+    """sha256 of every .txt member, streamed so no file is held in memory whole."""
+    hashes = {}
+    for member in zip_ref.infolist():
+        if not member.filename.endswith(".txt"):
+            continue
+        digest = hashlib.sha256()
+        with zip_ref.open(member) as member_stream:
+            for chunk in iter(lambda: member_stream.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        table_name = os.path.basename(member.filename).replace('.txt', '')
+        hashes[table_name] = digest.hexdigest()
+    return hashes
+
+
+def stream_member_to_s3(zip_ref, member, bucket_name, s3_key):
+    """
+    Streams one zip member into S3 as a multipart upload and reports how
+    long it took and what it cost in memory and disk.
+    """
+    start = time.perf_counter()
+    with zip_ref.open(member) as member_stream:
+        s3_client.upload_fileobj(member_stream, bucket_name, s3_key, Config=STREAM_TRANSFER_CONFIG)
+
+    return {
+        'file': member.filename,
+        's3_key': s3_key,
+        'size_mb': round(member.file_size / (1024 * 1024), 2),
+        'seconds': round(time.perf_counter() - start, 3),
+        'peak_memory_mb': round(peak_memory_mb(), 1),
+        'tmp_used_mb': round(tmp_used_mb(), 1),
+    }
+
+
+def table_of(filename):
+    return os.path.basename(filename).replace('.txt', '')
+
+
+def ingest_streaming(archive, bucket_name, s3_prefix, max_workers, tables):
+    """
+    Streaming ingest: no urlretrieve, no extractall. Every .txt member in
+    `tables` is read as a stream and pushed to S3 by a bounded pool of upload
+    threads.
+    """
+    stats = []
+    with zipfile.ZipFile(archive, 'r') as zip_ref:
+        members = [m for m in zip_ref.infolist() if m.filename.endswith(".txt") and table_of(m.filename) in tables]
+        # Biggest files first so stop_times/shapes are not left for the end
+        members.sort(key=lambda m: m.file_size, reverse=True)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {}
+            for member in members:
+                filename = os.path.basename(member.filename)
+                folder_name = filename.replace('.txt', '')
+                s3_key = f"{s3_prefix}/{folder_name}/{filename}"
+                print(f"☁️ Streaming {filename} -> s3://{bucket_name}/{s3_key}")
+                futures[pool.submit(stream_member_to_s3, zip_ref, member, bucket_name, s3_key)] = member
+
+            for future in as_completed(futures):
+                result = future.result()
+                print(f"   ✅ {result['file']}: {result['size_mb']} MB in {result['seconds']}s "
+                      f"(peak mem {result['peak_memory_mb']} MB, /tmp used {result['tmp_used_mb']} MB)")
+                stats.append(result)
+
+    return stats
+
+
+def ingest_extract(archive, bucket_name, s3_prefix, tables):
+    """
+    Original ingest: write the archive to /tmp, extract everything, upload one
+    by one. Kept as a fallback (INGEST_MODE=extract).
+    """
     download_path = '/tmp/GTFS.zip'
     extract_path = '/tmp/extracted'
-    
-    # 2. Download
-    print(f"⬇️ Downloading from {gtfs_url}...")
-    try:
-        urllib.request.urlretrieve(gtfs_url, download_path)
-    except Exception as e:
-        print(f"❌ Download failed: {str(e)}")
-        raise e
 
-    # 3. Unzip
+    with open(download_path, 'wb') as f:
+        f.write(archive.getbuffer())
+
     print("📦 Extracting...")
     with zipfile.ZipFile(download_path, 'r') as zip_ref:
         zip_ref.extractall(extract_path)
-    
-    # 4. Upload to S3 (Raw Zone)
-    # We partition by Date so we can track history: raw/YYYY-MM-DD/file.txt
-    today = datetime.now().strftime("%Y-%m-%d")
-    s3_prefix = f"raw/{today}"
-    
-    uploaded_count = 0
-    
+
+    stats = []
     for filename in os.listdir(extract_path):
-        if filename.endswith(".txt"):
+        if filename.endswith(".txt") and table_of(filename) in tables:
             local_file = os.path.join(extract_path, filename)
             folder_name = filename.replace('.txt', '') # e.g., 'stops'
             s3_key = f"{s3_prefix}/{folder_name}/{filename}"
-            
+
             print(f"☁️ Uploading {filename} -> s3://{bucket_name}/{s3_key}")
+            start = time.perf_counter()
             s3_client.upload_file(local_file, bucket_name, s3_key)
-            uploaded_count += 1
+            stats.append({
+                'file': filename,
+                's3_key': s3_key,
+                'size_mb': round(os.path.getsize(local_file) / (1024 * 1024), 2),
+                'seconds': round(time.perf_counter() - start, 3),
+                'peak_memory_mb': round(peak_memory_mb(), 1),
+                'tmp_used_mb': round(tmp_used_mb(), 1),
+            })
+
+    return stats
+
+
+def parquet_schema(table_name):
+    import pyarrow as pa
+    return pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in PARQUET_TABLES[table_name]])
+
+
+def read_csv_chunks(csv_stream, table_name):
+    """
+    Parses a GTFS .txt stream in CSV_BLOCK_SIZE chunks, casting each column to
+    the clean-view type as it goes. Yields typed RecordBatches.
+    """
+    import pyarrow.compute as pc
+    from pyarrow import csv
+
+    schema = parquet_schema(table_name)
+    reader = csv.open_csv(
+        csv_stream,
+        read_options=csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+        convert_options=csv.ConvertOptions(
+            column_types=schema,
+            include_columns=schema.names,
+            include_missing_columns=True,
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        if table_name == 'stops':
+            # Same coordinate filter as the uta_gtfs_clean.stops view
+            valid = pc.and_(
+                pc.and_(pc.greater_equal(batch['stop_lat'], -90), pc.less_equal(batch['stop_lat'], 90)),
+                pc.and_(pc.greater_equal(batch['stop_lon'], -180), pc.less_equal(batch['stop_lon'], 180)),
+            )
+            batch = batch.filter(valid)
+        yield batch
+
+
+def trip_buckets(trip_ids, buckets):
+    """
+    Maps each trip_id to a bucket number. Only the distinct ids in the chunk are
+    hashed (crc32, so the bucket is stable across runs), then spread back out.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    encoded = pc.dictionary_encode(trip_ids)
+    bucket_of_value = pa.array(
+        [zlib.crc32(v.encode('utf-8')) % buckets if v is not None else 0
+         for v in encoded.dictionary.to_pylist()],
+        pa.int32(),
+    )
+    return pc.take(bucket_of_value, encoded.indices)
+
+
+def upload_parquet(table, bucket_name, s3_key):
+    """Writes an Arrow table as compressed Parquet into memory and uploads it."""
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=PARQUET_COMPRESSION, row_group_size=128 * 1024)
+    size = buffer.tell()
+    buffer.seek(0)
+    s3_client.upload_fileobj(buffer, bucket_name, s3_key, Config=STREAM_TRANSFER_CONFIG)
+    return size
+
+
+def convert_table_to_parquet(csv_stream, table_name, bucket_name, today):
+    """
+    Converts one core GTFS table to typed Parquet under
+    parquet/<table>/dt=YYYY-MM-DD/. stop_times is bucketed by trip_id and
+    each bucket file is sorted by (trip_id, stop_sequence), so Athena can
+    skip row groups on trip_id lookups. The buckets are spilled to /tmp as
+    they fill (zstd Arrow IPC), so only one bucket is ever sorted in memory,
+    not the whole table.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    start = time.perf_counter()
+    schema = parquet_schema(table_name)
+    prefix = f"{PARQUET_PREFIX}/{table_name}/dt={today}"
+    rows = 0
+    written = 0
+
+    if table_name == 'stop_times':
+        spill_dir = tempfile.mkdtemp(prefix='stop_times-', dir='/tmp')
+        try:
+            paths = [os.path.join(spill_dir, f"bucket-{b:02d}.arrow") for b in range(STOP_TIMES_BUCKETS)]
+            options = pa.ipc.IpcWriteOptions(compression='zstd')
+            spills = [pa.ipc.new_stream(path, schema, options=options) for path in paths]
+            for batch in read_csv_chunks(csv_stream, table_name):
+                rows += batch.num_rows
+                buckets = trip_buckets(batch['trip_id'], STOP_TIMES_BUCKETS)
+                for b in range(STOP_TIMES_BUCKETS):
+                    part = batch.filter(pc.equal(buckets, b))
+                    if part.num_rows:
+                        spills[b].write_batch(part)
+            for spill in spills:
+                spill.close()
+
+            for b, path in enumerate(paths):
+                with pa.memory_map(path) as source:
+                    table = pa.ipc.open_stream(source).read_all()
+                table = table.sort_by([('trip_id', 'ascending'), ('stop_sequence', 'ascending')])
+                written += upload_parquet(table, bucket_name, f"{prefix}/bucket-{b:02d}.parquet")
+                os.remove(path)  # free /tmp as soon as the bucket is uploaded
+        finally:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+    else:
+        buffer = io.BytesIO()
+        with pq.ParquetWriter(buffer, schema, compression=PARQUET_COMPRESSION) as writer:
+            for batch in read_csv_chunks(csv_stream, table_name):
+                rows += batch.num_rows
+                writer.write_batch(batch)
+        written = buffer.tell()
+        buffer.seek(0)
+        s3_client.upload_fileobj(buffer, bucket_name, f"{prefix}/{table_name}.parquet", Config=STREAM_TRANSFER_CONFIG)
+
+    return {
+        'table': table_name,
+        's3_prefix': prefix,
+        'rows': rows,
+        'parquet_mb': round(written / (1024 * 1024), 2),
+        'seconds': round(time.perf_counter() - start, 3),
+        'peak_memory_mb': round(peak_memory_mb(), 1),
+    }
+
+
+def parquet_available():
+    """
+    Whether this function writes Parquet at all: PARQUET_OUTPUT is on and
+    pyarrow is installed (reported to the DAG, which then skips convert_table).
+    """
+    if os.environ.get('PARQUET_OUTPUT', 'true').lower() != 'true':
+        return False
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def convert_archive_to_parquet(archive, bucket_name, today, tables):
+    """
+    Conversion stage: writes the core tables (PARQUET_TABLES) that are in
+    `tables` as typed Parquet.
+    """
+    try:
+        import pyarrow  # noqa: F401  (only needed for this stage)
+    except ImportError:
+        print("⚠️ pyarrow is not installed (add the AWS SDK for pandas layer), skipping Parquet output.")
+        return []
+
+    stats = []
+    with zipfile.ZipFile(archive, 'r') as zip_ref:
+        names = {os.path.basename(n): n for n in zip_ref.namelist()}
+        for table_name in PARQUET_TABLES:
+            if table_name not in tables:
+                continue
+            member_name = names.get(f"{table_name}.txt")
+            if member_name is None:
+                print(f"⚠️ {table_name}.txt not found in archive, skipping.")
+                continue
+            print(f"🧱 Converting {table_name} -> s3://{bucket_name}/{PARQUET_PREFIX}/{table_name}/dt={today}/")
+            with zip_ref.open(member_name) as csv_stream:
+                result = convert_table_to_parquet(csv_stream, table_name, bucket_name, today)
+            print(f"   ✅ {table_name}: {result['rows']} rows, {result['parquet_mb']} MB Parquet "
+                  f"in {result['seconds']}s (peak mem {result['peak_memory_mb']} MB)")
+            stats.append(result)
+    return stats
+
+
+def raw_key(partition, table_name):
+    return f"{partition}/{table_name}/{table_name}.txt"
+
+
+def convert_partition_table(bucket_name, partition, table_name):
+    """
+    Converts one table of a raw partition (raw/YYYY-MM-DD) to Parquet,
+    reading the CSV straight from S3. The DAG runs one of these per changed
+    core table, in parallel, instead of one Lambda converting them in turn.
+    With PARQUET_OUTPUT=false, or without pyarrow, it is skipped with a
+    warning like the in-ingest stage, so the rest of the DAG still runs.
+    """
+    if table_name not in PARQUET_TABLES:
+        raise ValueError(f"{table_name} has no Parquet schema (expected one of {', '.join(PARQUET_TABLES)})")
+    if not parquet_available():
+        print(f"⚠️ Parquet output is off or pyarrow is not installed, skipping {table_name}.")
+        return {'table': table_name, 'skipped': True}
+    today = partition.split('/')[-1]
+    key = raw_key(partition, table_name)
+    print(f"🧱 Converting s3://{bucket_name}/{key} -> s3://{bucket_name}/{PARQUET_PREFIX}/{table_name}/dt={today}/")
+    csv_stream = s3_client.get_object(Bucket=bucket_name, Key=key)['Body']
+    result = convert_table_to_parquet(csv_stream, table_name, bucket_name, today)
+    print(f"   ✅ {table_name}: {result['rows']} rows, {result['parquet_mb']} MB Parquet "
+          f"in {result['seconds']}s (peak mem {result['peak_memory_mb']} MB)")
+    return result
+
+
+def parquet_row_count(bucket_name, prefix):
+    """Rows in every Parquet file under the prefix, read from the file footers only."""
+    import pyarrow.parquet as pq
+    from pyarrow import fs
+
+    s3 = fs.S3FileSystem(region=s3_client.meta.region_name)
+    rows = 0
+    files = 0
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=f"{prefix}/"):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.parquet'):
+                rows += pq.read_metadata(f"{bucket_name}/{obj['Key']}", filesystem=s3).num_rows
+                files += 1
+    return rows if files else None
+
+
+def validate_partition_table(bucket_name, partition, table_name):
+    """
+    Checks one table of a raw partition: a header with the required columns,
+    at least one row, and for the core tables a Parquet copy with the same
+    number of rows (stops may have fewer, invalid coordinates are dropped;
+    not checked with PARQUET_OUTPUT=false or without pyarrow).
+    Raises ValueError listing every problem, which fails the DAG task.
+    """
+    start = time.perf_counter()
+    key = raw_key(partition, table_name)
+    csv_stream = s3_client.get_object(Bucket=bucket_name, Key=key)['Body']
+    reader = csv.reader(io.TextIOWrapper(csv_stream, encoding='utf-8-sig', newline=''))
+    header = [column.strip() for column in next(reader, [])]
+    rows = sum(1 for row in reader if row)
+
+    problems = []
+    missing = [c for c in REQUIRED_COLUMNS.get(table_name, []) if c not in header]
+    if not header:
+        problems.append("no header")
+    elif missing:
+        problems.append(f"missing columns {', '.join(missing)}")
+    if not rows:
+        problems.append("no rows")
+
+    parquet_rows = None
+    if table_name in PARQUET_TABLES and os.environ.get('PARQUET_OUTPUT', 'true').lower() == 'true':
+        try:
+            prefix = f"{PARQUET_PREFIX}/{table_name}/dt={partition.split('/')[-1]}"
+            parquet_rows = parquet_row_count(bucket_name, prefix)
+        except ImportError:
+            print("⚠️ pyarrow is not installed, skipping the Parquet row count.")
+        else:
+            if parquet_rows is None:
+                problems.append(f"no Parquet files under {prefix}/")
+            elif parquet_rows > rows or (parquet_rows < rows and table_name != 'stops'):
+                problems.append(f"Parquet has {parquet_rows} rows, CSV has {rows}")
+
+    if problems:
+        raise ValueError(f"{table_name} ({key}): " + "; ".join(problems))
+    print(f"✅ {table_name}: {len(header)} columns, {rows} rows"
+          + (f", {parquet_rows} Parquet rows" if parquet_rows is not None else ""))
+    return {
+        'table': table_name,
+        'columns': len(header),
+        'rows': rows,
+        'parquet_rows': parquet_rows,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def write_manifest(bucket_name, today, tables):
+    """
+    Writes manifests/YYYY-MM-DD.json: for every table, its hash and the raw
+    partition that holds the current copy. Unchanged tables point back at an
+    older partition instead of being uploaded again.
+    """
+    manifest = {'date': today, 'tables': tables}
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=f"{MANIFEST_PREFIX}/{today}.json",
+        Body=json.dumps(manifest, indent=2).encode('utf-8'),
+    )
+
+
+def table_handler(event, bucket_name):
+    """
+    Per-table actions the DAG maps over after an ingest:
+    {"action": "convert" | "validate", "table": "stops", "partition": "raw/YYYY-MM-DD"}
+    """
+    action = event['action']
+    if action == 'convert':
+        result = convert_partition_table(bucket_name, event['partition'], event['table'])
+    elif action == 'validate':
+        result = validate_partition_table(bucket_name, event['partition'], event['table'])
+    else:
+        raise ValueError(f"Unknown action {action!r} (expected ingest, convert or validate)")
+    return {'statusCode': 200, 'body': json.dumps(result)}
+
+
+def lambda_handler(event, context):
+    event = event or {}
+    bucket_name = os.environ.get('BUCKET_NAME')
+    if event.get('action', 'ingest') != 'ingest':
+        return table_handler(event, bucket_name)
+    print(f"🚀 Starting GTFS Ingestion...")
+
+    # 1. Setup
+    gtfs_url = os.environ.get('GTFS_FEED_URL')
+    ingest_mode = os.environ.get('INGEST_MODE', 'stream')
+    max_workers = int(os.environ.get('UPLOAD_WORKERS', '4'))
+    parquet_output = os.environ.get('PARQUET_OUTPUT', 'true').lower() == 'true' and event.get('parquet', True)
+    incremental = os.environ.get('INCREMENTAL', 'true').lower() == 'true' and not event.get('force')
+
+    # We partition by Date so we can track history: raw/YYYY-MM-DD/table/file.txt
+    today = datetime.now().strftime("%Y-%m-%d")
+    s3_prefix = f"raw/{today}"
+    start = time.perf_counter()
+
+    # 2. Conditional download (ETag / Last-Modified)
+    state = load_state(bucket_name) if incremental else {'tables': {}}
+    print(f"⬇️ Downloading from {gtfs_url} into memory...")
+    try:
+        archive, etag, last_modified = download_archive(gtfs_url, state)
+    except Exception as e:
+        print(f"❌ Download failed: {str(e)}")
+        raise e
+
+    if archive is None:
+        print("💤 Archive not modified since the last run (HTTP 304). Nothing to do.")
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': "Not modified",
+                'changed': False,
+                'changed_tables': [],
+                'partition': s3_prefix,
+                'parquet_output': parquet_available(),
+                'seconds': round(time.perf_counter() - start, 3),
+            })
+        }
+
+    # 3. Hash every table and keep only the ones that differ from last time
+    with zipfile.ZipFile(archive, 'r') as zip_ref:
+        hashes = hash_members(zip_ref)
+    previous = state.get('tables', {})
+    changed_tables = sorted(t for t, h in hashes.items() if previous.get(t, {}).get('sha256') != h)
+    print(f"🔎 {len(changed_tables)}/{len(hashes)} tables changed: {', '.join(changed_tables) or '-'}")
+
+    # 4. Upload changed tables to S3 (Raw Zone)
+    try:
+        if ingest_mode == 'extract':
+            stats = ingest_extract(archive, bucket_name, s3_prefix, set(changed_tables))
+        else:
+            stats = ingest_streaming(archive, bucket_name, s3_prefix, max_workers, set(changed_tables))
+    except Exception as e:
+        print(f"❌ Ingestion failed: {str(e)}")
+        raise e
+
+    # 5. Convert the changed core tables to typed Parquet (Clean Zone)
+    parquet_stats = []
+    if parquet_output:
+        parquet_stats = convert_archive_to_parquet(archive, bucket_name, today, set(changed_tables))
+
+    # 6. Record where the current copy of every table lives
+    tables = {}
+    for table_name, digest in hashes.items():
+        if table_name in changed_tables:
+            tables[table_name] = {'sha256': digest, 'partition': s3_prefix, 'changed': True}
+        else:
+            tables[table_name] = dict(previous[table_name], changed=False)
+    write_manifest(bucket_name, today, tables)
+    save_state(bucket_name, {
+        'etag': etag,
+        'last_modified': last_modified,
+        'date': today,
+        'tables': {t: {'sha256': v['sha256'], 'partition': v['partition']} for t, v in tables.items()},
+    })
+    elapsed = round(time.perf_counter() - start, 3)
+
+    print(f"⏱️ {len(stats)} files in {elapsed}s ({ingest_mode} mode), "
+          f"peak mem {peak_memory_mb():.1f} MB, /tmp used {tmp_used_mb():.1f} MB")
 
     return {
         'statusCode': 200,
-        'body': json.dumps(f"Success: Uploaded {uploaded_count} files to {s3_prefix}")
-    }
\ No newline at end of file
+        'body': json.dumps({
+            'message': f"Success: Uploaded {len(stats)} files to {s3_prefix}",
+            'changed': bool(changed_tables),
+            'changed_tables': changed_tables,
+            'partition': s3_prefix,
+            'mode': ingest_mode,
+            'seconds': elapsed,
+            'files': stats,
+            'parquet': parquet_stats,
+            'parquet_output': parquet_available(),
+        })
+    }
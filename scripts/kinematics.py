@@ -0,0 +1,133 @@
+"""
+Speed and heading for every vehicle in a poll, computed on the whole batch
+at once.
+
+- When the feed reports position.speed / position.bearing (already in
+  the record as speed_mph / bearing), those are kept.
+- Otherwise they are derived from the vehicle's previous fix (kept in a
+  state store, same stores as vehicle_state_store): haversine distance and
+  initial bearing, vectorized with numpy over all vehicles.
+- GPS jumps (an implied speed above MAX_PLAUSIBLE_MPH) are rejected: the
+  vehicle keeps its last speed/bearing and its last good fix. After
+  MAX_REJECTS jumps in a row the new position is accepted as the real one
+  (the vehicle was moved, or the old fix was the bad one).
+- A vehicle whose GPS timestamp did not change keeps its last values.
+
+Fills "speed_mph" and "bearing" (degrees from north) on each record; they
+stay None when there is not enough history yet.
+"""
+import numpy as np
+
+MPS_TO_MPH = 2.2369363
+EARTH_RADIUS_M = 6371008.8
+MAX_PLAUSIBLE_MPH = 90.0   # faster than any bus or train on the network
+MAX_REJECTS = 3
+MIN_MOVE_M = 5.0           # below this the bearing is GPS noise; keep the old one
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres between arrays of points (degrees)."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def initial_bearing(lat1, lon1, lat2, lon2):
+    """Initial bearing in degrees [0, 360) from point 1 to point 2."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    d_lon = lon2 - lon1
+    x = np.sin(d_lon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(d_lon)
+    return (np.degrees(np.arctan2(x, y)) + 360.0) % 360.0
+
+
+def _to_list(values):
+    """Float array -> list of Python floats, NaN -> None."""
+    return [None if v != v else v for v in values.tolist()]
+
+
+def apply_kinematics(entity_list, previous):
+    """
+    Sets speed_mph and bearing on every entity in place (feed values are kept).
+
+    previous maps vehicle id -> [lat, lon, vehicle_timestamp, speed_mph,
+    bearing, rejects] from the last poll. Returns (current, summary), where
+    current is the same mapping for this poll.
+    """
+    n = len(entity_list)
+    summary = {"vehicles": n, "reported": 0, "derived": 0, "rejected": 0, "no_history": 0}
+    if not n:
+        return {}, summary
+
+    # One pass over the records builds every input column (None -> NaN)
+    fields = np.array([
+        (e.get("latitude"), e.get("longitude"), e.get("vehicle_timestamp") or e.get("source_timestamp"),
+         e.get("speed_mph"), e.get("bearing"))
+        for e in entity_list
+    ], dtype=np.float64)
+    lat, lon, ts, feed_speed, feed_bearing = fields.T
+
+    empty = [np.nan, np.nan, np.nan, np.nan, np.nan, 0]
+    prior = np.array([previous.get(e.get("id")) or empty for e in entity_list], dtype=np.float64)
+    p_lat, p_lon, p_ts, p_speed, p_bearing, p_rejects = prior.T
+
+    has_prior = ~np.isnan(p_lat) & ~np.isnan(lat)
+    dt = ts - p_ts
+    advanced = has_prior & (dt > 0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        distance = haversine_m(p_lat, p_lon, lat, lon)
+        derived_speed = distance / dt * MPS_TO_MPH
+        derived_bearing = initial_bearing(p_lat, p_lon, lat, lon)
+
+    jump = advanced & (derived_speed > MAX_PLAUSIBLE_MPH)
+    give_up = jump & (p_rejects + 1 >= MAX_REJECTS)
+    rejected = jump & ~give_up
+    good = advanced & ~jump
+
+    # Derived values only where the step is plausible; otherwise carry the last ones
+    speed = np.where(good, derived_speed, p_speed)
+    bearing = np.where(good & (distance >= MIN_MOVE_M), derived_bearing, p_bearing)
+
+    # The feed's own values win when present
+    has_feed_speed = ~np.isnan(feed_speed)
+    speed = np.where(has_feed_speed, feed_speed, speed)
+    bearing = np.where(~np.isnan(feed_bearing), feed_bearing, bearing)
+
+    # Rejected fixes keep the last good position as the reference
+    new_lat = np.where(rejected, p_lat, lat)
+    new_lon = np.where(rejected, p_lon, lon)
+    new_ts = np.where(rejected, p_ts, ts)
+    rejects = np.where(rejected, p_rejects + 1, 0)
+
+    # Back to Python values in one pass per column (indexing numpy scalars is slow)
+    speed = _to_list(np.round(speed, 1))
+    bearing = _to_list(np.round(bearing, 1))
+    new_lat = _to_list(new_lat)
+    new_lon = _to_list(new_lon)
+    new_ts = [None if t is None else int(t) for t in _to_list(new_ts)]
+    rejects = rejects.astype(np.int64).tolist()
+
+    current = {}
+    for i, entity in enumerate(entity_list):
+        entity["speed_mph"] = speed[i]
+        entity["bearing"] = bearing[i]
+        current[entity.get("id")] = [new_lat[i], new_lon[i], new_ts[i], speed[i], bearing[i], rejects[i]]
+
+    summary["reported"] = int(has_feed_speed.sum())
+    summary["derived"] = int((good & ~has_feed_speed).sum())
+    summary["rejected"] = int(rejected.sum())
+    summary["no_history"] = int((~has_prior).sum())
+    return current, summary
+
+
+def derive_kinematics(entity_list, store):
+    """
+    apply_kinematics with the previous fixes loaded from / saved to `store`
+    (FileStateStore or MemoryStateStore). Returns the summary.
+    """
+    state = store.load()
+    current, summary = apply_kinematics(entity_list, state.get("vehicles", {}))
+    store.save({"polls": state.get("polls", 0) + 1, "vehicles": current})
+    return summary
@@ -0,0 +1,239 @@
+"""
+Multi-shard Kinesis consumer shared by both dashboards.
+
+- Finds every shard with list_shards and follows resharding: a child shard
+  is only read once its parent(s) have been read to the end, so records
+  stay in order per partition key across splits and merges. A child starts
+  at TRIM_HORIZON only when this consumer actually followed a parent; a
+  parent that was already closed before our start position (a fresh LATEST
+  or AT_TIMESTAMP consumer on a resharded stream) does not make its
+  children replay their history.
+- Reads all ready shards in parallel (one get_records call per shard per poll).
+  A throttled shard keeps its iterator and is read again on the next poll.
+- Drops records whose sequence number is not newer than the last one seen on
+  that shard (replays after an iterator reset, duplicate deliveries).
+- Saves the last sequence number per shard to a pluggable checkpoint store,
+  so an expired iterator (or a restart) resumes AFTER_SEQUENCE_NUMBER instead
+  of jumping to LATEST.
+- Reports per-shard lag (MillisBehindLatest).
+
+Works with boto3.client('kinesis') or local_kinesis.LocalKinesis.
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from vehicle_codec import decode_record
+
+FINISHED = "SHARD_END"
+
+
+class MemoryCheckpointStore:
+    """Checkpoints kept in a dict (lost when the process exits)."""
+
+    def __init__(self):
+        self._checkpoints = {}
+        self._lock = threading.Lock()
+
+    def get(self, shard_id):
+        return self._checkpoints.get(shard_id)
+
+    def put(self, shard_id, sequence_number):
+        with self._lock:
+            self._checkpoints[shard_id] = sequence_number
+
+    def all(self):
+        return dict(self._checkpoints)
+
+
+class FileCheckpointStore(MemoryCheckpointStore):
+    """Checkpoints kept in a small JSON file, rewritten on every put."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as f:
+                self._checkpoints = json.load(f)
+
+    def put(self, shard_id, sequence_number):
+        with self._lock:
+            self._checkpoints[shard_id] = sequence_number
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._checkpoints, f)
+            os.replace(tmp_path, self.path)
+
+
+class KinesisConsumer:
+
+    def __init__(self, client, stream_name, checkpoint_store=None, initial_position="LATEST",
+                 initial_timestamp=None, limit=1000, max_workers=8):
+        """
+        initial_position is where shards without a checkpoint start:
+        'LATEST', 'TRIM_HORIZON' or 'AT_TIMESTAMP' (with initial_timestamp).
+        """
+        self.client = client
+        self.stream_name = stream_name
+        self.checkpoints = checkpoint_store or MemoryCheckpointStore()
+        self.initial_position = initial_position
+        self.initial_timestamp = initial_timestamp
+        self.limit = limit
+        self.max_workers = max_workers
+
+        self.shards = {}          # shard_id -> shard description
+        self.iterators = {}       # shard_id -> current shard iterator
+        self.last_sequence = {}   # shard_id -> last sequence number returned (int)
+        self.lag_ms = {}          # shard_id -> MillisBehindLatest
+        self.read_shards = set()      # shards this consumer has opened an iterator on
+        self.followed_shards = set()  # ...and that returned records or were still open
+        self.stats = {"records": 0, "duplicates": 0, "iterator_resets": 0, "throttled": 0}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.refresh_shards()
+
+    # --- Shard discovery -----------------------------------------------
+
+    def refresh_shards(self):
+        shards = {}
+        response = self.client.list_shards(StreamName=self.stream_name)
+        while True:
+            for shard in response["Shards"]:
+                shards[shard["ShardId"]] = shard
+            token = response.get("NextToken")
+            if not token:
+                break
+            response = self.client.list_shards(NextToken=token)
+        self.shards = shards
+
+    def _is_finished(self, shard_id):
+        return self.checkpoints.get(shard_id) == FINISHED
+
+    def _parents(self, shard):
+        return [p for p in (shard.get("ParentShardId"), shard.get("AdjacentParentShardId")) if p]
+
+    def _followed(self, shard_id):
+        """
+        Whether we read this (parent) shard up to its end, rather than
+        starting past it. A shard finished before this process started was
+        followed by an earlier run sharing the checkpoint store.
+        """
+        if shard_id in self.read_shards:
+            return shard_id in self.followed_shards
+        return self._is_finished(shard_id)
+
+    def ready_shards(self):
+        """
+        Shards we should read now: not finished, and every parent that is
+        still in the stream has been read to its end.
+        """
+        ready = []
+        for shard_id, shard in self.shards.items():
+            if self._is_finished(shard_id):
+                continue
+            if all(self._is_finished(p) or p not in self.shards for p in self._parents(shard)):
+                ready.append(shard_id)
+        return sorted(ready)
+
+    # --- Iterators -----------------------------------------------------
+
+    def _new_iterator(self, shard_id):
+        checkpoint = self.checkpoints.get(shard_id)
+        kwargs = {"StreamName": self.stream_name, "ShardId": shard_id}
+        self.read_shards.add(shard_id)
+        if checkpoint:
+            self.followed_shards.add(shard_id)
+            kwargs.update(ShardIteratorType="AFTER_SEQUENCE_NUMBER", StartingSequenceNumber=checkpoint)
+        elif any(self._followed(p) for p in self._parents(self.shards[shard_id])):
+            # A child of a shard we have been reading: start at its beginning
+            kwargs["ShardIteratorType"] = "TRIM_HORIZON"
+        elif self.initial_position == "AT_TIMESTAMP":
+            kwargs.update(ShardIteratorType="AT_TIMESTAMP", Timestamp=self.initial_timestamp)
+        else:
+            kwargs["ShardIteratorType"] = self.initial_position
+        return self.client.get_shard_iterator(**kwargs)["ShardIterator"]
+
+    def _read_shard(self, shard_id):
+        """One get_records call on one shard. Returns (shard_id, records, finished)."""
+        if shard_id not in self.iterators:
+            self.iterators[shard_id] = self._new_iterator(shard_id)
+        try:
+            response = self.client.get_records(ShardIterator=self.iterators[shard_id], Limit=self.limit)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == "ProvisionedThroughputExceededException":
+                # Over the shard's 5 reads/s: keep the iterator, the other shards' records still count
+                self.stats["throttled"] += 1
+                return shard_id, [], False
+            if code != "ExpiredIteratorException":
+                raise
+            # Resume right after the last checkpoint instead of losing our place
+            self.stats["iterator_resets"] += 1
+            self.iterators[shard_id] = self._new_iterator(shard_id)
+            response = self.client.get_records(ShardIterator=self.iterators[shard_id], Limit=self.limit)
+
+        self.lag_ms[shard_id] = response.get("MillisBehindLatest", 0)
+        next_iterator = response.get("NextShardIterator")
+        if response["Records"] or next_iterator:
+            self.followed_shards.add(shard_id)
+        if next_iterator:
+            self.iterators[shard_id] = next_iterator
+        else:
+            self.iterators.pop(shard_id, None)
+        return shard_id, response["Records"], next_iterator is None
+
+    # --- Public API ----------------------------------------------------
+
+    def poll(self, checkpoint=True):
+        """
+        Reads every ready shard once, in parallel. Returns the new records
+        (duplicates removed), each tagged with its 'ShardId'.
+        """
+        results = list(self._pool.map(self._read_shard, self.ready_shards()))
+
+        records = []
+        resharded = False
+        for shard_id, shard_records, finished in results:
+            last = self.last_sequence.get(shard_id)
+            if last is None and self.checkpoints.get(shard_id) not in (None, FINISHED):
+                last = int(self.checkpoints.get(shard_id))
+            for record in shard_records:
+                sequence = int(record["SequenceNumber"])
+                if last is not None and sequence <= last:
+                    self.stats["duplicates"] += 1
+                    continue
+                last = sequence
+                record["ShardId"] = shard_id
+                records.append(record)
+            if last is not None:
+                self.last_sequence[shard_id] = last
+                if checkpoint:
+                    self.checkpoints.put(shard_id, str(last))
+            if finished:
+                # Parent fully read: its children become ready
+                self.checkpoints.put(shard_id, FINISHED)
+                self.lag_ms.pop(shard_id, None)
+                resharded = True
+
+        if resharded:
+            self.refresh_shards()
+        self.stats["records"] += len(records)
+        return records
+
+    def checkpoint(self):
+        """Saves the latest sequence number of every shard (when poll(checkpoint=False))."""
+        for shard_id, sequence in self.last_sequence.items():
+            if not self._is_finished(shard_id):
+                self.checkpoints.put(shard_id, str(sequence))
+
+    def poll_vehicles(self, checkpoint=True):
+        """poll() followed by vehicle_codec decoding: a flat list of vehicle dicts."""
+        return [vehicle for record in self.poll(checkpoint) for vehicle in decode_record(record["Data"])]
+
+    def max_lag_ms(self):
+        return max(self.lag_ms.values(), default=0)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,160 @@
+"""
+Batch sender for Kinesis put_records.
+
+- Splits records into requests that respect the 500 record / 5 MB limits
+  (records over the 1 MB per-record limit are counted as lost, never sent).
+- Sends the requests in parallel on a bounded thread pool.
+- Retries only the entries that failed (throttling, internal errors), and
+  whole requests that hit a timeout or connection error, with full-jitter
+  exponential backoff, up to max_attempts. Any other error loses only its
+  own batch, the other batches are still sent.
+- Reports throughput, retries and final losses.
+
+Works with boto3.client('kinesis') or local_kinesis.LocalKinesis.
+"""
+import itertools
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError, ConnectionError, HTTPClientError
+
+MAX_RECORDS_PER_REQUEST = 500
+MAX_BYTES_PER_REQUEST = 5 * 1024 * 1024
+MAX_BYTES_PER_RECORD = 1024 * 1024
+
+# Request-level errors that are worth retrying; anything else (stream not
+# found, access denied, validation) fails the whole batch straight away.
+RETRYABLE_ERRORS = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "InternalFailure",
+    "ServiceUnavailable",
+    "KMSThrottlingException",
+}
+
+# Client-side failures worth retrying: connect/read timeouts, dropped or
+# refused connections. Other BotoCoreErrors (credentials, bad parameters)
+# fail the batch straight away.
+RETRYABLE_CLIENT_ERRORS = (ConnectionError, HTTPClientError)
+
+# Records without a vehicle id get one of these keys in turn, so they are
+# spread over every shard instead of piling onto one 'default_key' shard.
+_fallback_keys = itertools.cycle([f"no-id-{n:02d}" for n in range(64)])
+
+
+def partition_key_for(entity):
+    """
+    Vehicle id as the partition key: Kinesis md5-hashes it, which spreads
+    vehicles evenly over the shards and keeps each vehicle's records in order.
+    """
+    vehicle_id = entity.get("id")
+    return str(vehicle_id) if vehicle_id else next(_fallback_keys)
+
+
+def _record_size(record):
+    return len(record["Data"]) + len(record["PartitionKey"].encode("utf-8"))
+
+
+def split_into_batches(records):
+    """Groups records into put_records requests within the count and size limits."""
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for record in records:
+        size = _record_size(record)
+        if batch and (len(batch) >= MAX_RECORDS_PER_REQUEST or batch_bytes + size > MAX_BYTES_PER_REQUEST):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append(record)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class KinesisBatchSender:
+
+    def __init__(self, client, stream_name, max_workers=4, max_attempts=5,
+                 base_delay=0.05, max_delay=2.0, sleep=time.sleep):
+        self.client = client
+        self.stream_name = stream_name
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+
+    def _backoff(self, attempt):
+        """Full jitter: a random delay between 0 and the exponential cap."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _send_batch(self, batch):
+        """Sends one batch, retrying only the failed entries. Returns per-batch stats."""
+        pending = batch
+        put_calls = 0
+        retried = 0
+        error = None
+
+        for attempt in range(self.max_attempts):
+            if attempt:
+                retried += len(pending)
+                self.sleep(self._backoff(attempt))
+            put_calls += 1
+            try:
+                response = self.client.put_records(Records=pending, StreamName=self.stream_name)
+            except ClientError as e:
+                code = e.response["Error"]["Code"]
+                error = f"{code}: {e.response['Error'].get('Message', '')}"
+                if code in RETRYABLE_ERRORS:
+                    continue
+                break
+            except BotoCoreError as e:
+                # Raised by the client itself (no response), e.g. a read timeout
+                error = f"{type(e).__name__}: {e}"
+                if isinstance(e, RETRYABLE_CLIENT_ERRORS):
+                    continue
+                break
+
+            if not response.get("FailedRecordCount"):
+                pending = []
+                break
+            # Keep only the entries that failed; their results line up with the request
+            pending = [record for record, result in zip(pending, response["Records"]) if "ErrorCode" in result]
+            error = next(r["ErrorCode"] for r in response["Records"] if "ErrorCode" in r)
+
+        return {"put_calls": put_calls, "retried": retried, "lost": len(pending),
+                "error": error if pending else None}
+
+    def send(self, records):
+        """
+        Sends a list of {'Data': bytes, 'PartitionKey': str} records and
+        returns a summary with throughput, retries and final losses.
+        """
+        start = time.perf_counter()
+        oversized = [r for r in records if _record_size(r) > MAX_BYTES_PER_RECORD]
+        sendable = [r for r in records if _record_size(r) <= MAX_BYTES_PER_RECORD]
+        batches = split_into_batches(sendable)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(self._send_batch, batches))
+
+        seconds = time.perf_counter() - start
+        lost = len(oversized) + sum(r["lost"] for r in results)
+        errors = sorted({r["error"] for r in results if r["error"]})
+        if oversized:
+            errors.append(f"{len(oversized)} records over the 1 MB limit")
+
+        return {
+            "FailedRecordCount": lost,
+            "records": len(records),
+            "bytes": sum(_record_size(r) for r in records),
+            "batches": len(batches),
+            "put_calls": sum(r["put_calls"] for r in results),
+            "retried_records": sum(r["retried"] for r in results),
+            "lost_records": lost,
+            "errors": errors,
+            "seconds": round(seconds, 3),
+            "records_per_second": round(len(records) / seconds, 1) if seconds else None,
+        }
@@ -0,0 +1,188 @@
+"""
+Incremental map updates for the Dash app (gtfs.py).
+
+Returning a new Plotly figure on every interval tick sends every marker,
+the trace styling and the mapbox layout to each browser every 5 s, and
+the map is redrawn from scratch. LiveMap keeps the markers on the server
+as fixed slots (one per vehicle) instead:
+
+- sync(frame) compares a VehicleFrame with the slots, field by field
+  (lat, lon, colour, hover text). A new vehicle takes a free slot (or
+  appends one) and a removed vehicle blanks its slot (lat/lon None).
+  Every sync that changes something is a new version.
+- figure() is the full figure, sent once per browser tab.
+- update(state) brings a browser from the version in its dcc.Store to the
+  current one with a dash.Patch: only the changed fields of the changed
+  slots are assigned and new slots are appended. A field that changed in
+  more than FULL_COLUMN_SHARE of the slots is assigned as a whole column,
+  which is smaller than one operation per marker.
+
+Browsers more than HISTORY versions behind, or from before the slots were
+compacted (re-packed once more than half are free), get the full figure.
+"""
+import threading
+import uuid
+from collections import deque
+
+import numpy as np
+import plotly.graph_objects as go
+from dash import Patch
+
+HISTORY = 120              # versions kept for patches (10 min of 5 s ticks)
+FULL_COLUMN_SHARE = 0.15   # one Assign per marker costs ~6x a column entry
+COMPACT_MIN_SLOTS = 64     # never compact smaller maps
+DEFAULT_CENTER = {"lat": 40.65, "lon": -111.9}   # Salt Lake valley
+
+
+def _hover_text(vehicle_id, route_id, speed, delay):
+    text = f"<b>{vehicle_id}</b><br>route {route_id or '-'}<br>{speed:.0f} mph"
+    if not np.isnan(delay):
+        text += f"<br>delay {delay:.0f} s"
+    return text
+
+
+def _markers(frame):
+    """vehicle id -> (lat, lon, colour, hover text) for the vehicles with a position."""
+    columns = frame.columns
+    keep = ~(np.isnan(columns['latitude']) | np.isnan(columns['longitude']))
+    latitude = np.round(columns['latitude'][keep], 6).tolist()
+    longitude = np.round(columns['longitude'][keep], 6).tolist()
+    colors = frame.colors(keep).tolist()
+    texts = [_hover_text(*row) for row in zip(columns['id'][keep].tolist(), columns['route_id'][keep].tolist(),
+                                              columns['speed_mph'][keep].tolist(),
+                                              columns['delay_seconds'][keep].tolist())]
+    return {vehicle_id: marker for vehicle_id, marker
+            in zip(columns['id'][keep].tolist(), zip(latitude, longitude, colors, texts))}
+
+
+class LiveMap:
+    """Server-side marker slots of the live map, shared by every browser."""
+
+    def __init__(self, height=600):
+        self.height = height
+        self.lock = threading.RLock()
+        self._reset({})
+        self.source_version = None
+
+    def _reset(self, markers):
+        self.generation = uuid.uuid4().hex
+        self.version = 0
+        self.slots = {}       # vehicle id -> slot
+        self.free = []        # blank slots, reused by new vehicles
+        self.markers = []     # slot -> (lat, lon, colour, text) or None
+        for vehicle_id, marker in markers.items():
+            self.slots[vehicle_id] = len(self.markers)
+            self.markers.append(marker)
+        # (version, changed slots per field, slot count after it)
+        self.history = deque([(0, (frozenset(),) * 4, len(self.markers))], maxlen=HISTORY)
+
+    # --- Server side -----------------------------------------------------
+
+    def sync(self, frame, source_version=None):
+        """Applies a new VehicleFrame. Returns True when the markers changed."""
+        with self.lock:
+            if source_version is not None and source_version == self.source_version:
+                return False
+            self.source_version = source_version
+            markers = _markers(frame)
+
+            changed = [set(), set(), set(), set()]    # per field: lat, lon, colour, text
+            for vehicle_id in [v for v in self.slots if v not in markers]:
+                slot = self.slots.pop(vehicle_id)
+                self.markers[slot] = None
+                self.free.append(slot)
+                for slots in changed:
+                    slots.add(slot)
+            for vehicle_id, marker in markers.items():
+                slot = self.slots.get(vehicle_id)
+                if slot is None:
+                    if self.free:
+                        slot = self.free.pop()
+                    else:
+                        slot = len(self.markers)
+                        self.markers.append(None)
+                    self.slots[vehicle_id] = slot
+                    for slots in changed:
+                        slots.add(slot)
+                else:
+                    previous = self.markers[slot]
+                    if previous == marker:
+                        continue
+                    for slots, old, new in zip(changed, previous, marker):
+                        if old != new:
+                            slots.add(slot)
+                self.markers[slot] = marker
+
+            if not any(changed):
+                return False
+            if len(self.markers) > COMPACT_MIN_SLOTS and len(self.free) > len(self.markers) // 2:
+                # Every browser gets the full (smaller) figure on its next tick
+                self._reset(markers)
+                return True
+            self.version += 1
+            self.history.append((self.version, tuple(frozenset(slots) for slots in changed), len(self.markers)))
+            return True
+
+    def _columns(self):
+        markers = [m if m is not None else (None, None, None, None) for m in self.markers]
+        return [list(column) for column in zip(*markers)] if markers else [[], [], [], []]
+
+    # --- Browser side ----------------------------------------------------
+
+    def state(self):
+        return {"generation": self.generation, "version": self.version}
+
+    def figure(self):
+        """The full figure (all slots, blank ones included)."""
+        with self.lock:
+            latitude, longitude, colors, texts = self._columns()
+            present = [lat for lat in latitude if lat is not None]
+            center = DEFAULT_CENTER
+            if present:
+                center = {"lat": float(np.mean(present)),
+                          "lon": float(np.mean([lon for lon in longitude if lon is not None]))}
+            fig = go.Figure(go.Scattermap(
+                lat=latitude, lon=longitude, text=texts, mode="markers",
+                marker={"size": 9, "color": colors},
+                hovertemplate="%{text}<extra></extra>",
+            ))
+            fig.update_layout(
+                map_style="open-street-map", map_zoom=10, map_center=center,
+                height=self.height, margin={"l": 0, "r": 0, "t": 0, "b": 0},
+                # Keeps the user's zoom and pan when the figure is sent again
+                uirevision="live-map",
+            )
+            return fig, self.state()
+
+    def update(self, state):
+        """
+        (figure or Patch or None, new state) for a browser at `state`.
+        None means the browser is up to date.
+        """
+        with self.lock:
+            known = state.get("version") if state and state.get("generation") == self.generation else None
+            if known is None or known < self.history[0][0] or known > self.version:
+                return self.figure()
+            if known == self.version:
+                return None, self.state()
+            changed = [set(), set(), set(), set()]
+            known_length = None
+            for version, slots, length in self.history:
+                if version == known:
+                    known_length = length
+                elif version > known:
+                    for field, field_slots in zip(changed, slots):
+                        field.update(field_slots)
+            patch = Patch()
+            trace = patch["data"][0]
+            targets = ((trace, "lat"), (trace, "lon"), (trace["marker"], "color"), (trace, "text"))
+            columns = self._columns()
+            for (parent, key), column, slots in zip(targets, columns, changed):
+                if len(slots) > FULL_COLUMN_SHARE * len(column):
+                    parent[key] = column
+                    continue
+                for slot in sorted(slot for slot in slots if slot < known_length):
+                    parent[key][slot] = column[slot]
+                if len(column) > known_length:
+                    parent[key].extend(column[known_length:])
+            return patch, self.state()
@@ -0,0 +1,548 @@
+"""
+Local DuckDB analytics: the uta_gtfs_clean views as materialized tables.
+
+The Athena views in sql/athena_transformation.sql CAST every column of the raw
+CSV on every query, and the DuckDB images only open an empty shell. This
+module keeps one persistent DuckDB file with the same schemas, so the
+production queries run offline at interactive speed:
+
+    uta_gtfs_raw.<table>        views over the GTFS .txt files (all VARCHAR,
+                                like the Athena raw tables)
+    uta_gtfs_views.<table>      the Athena clean views, verbatim, over uta_gtfs_raw
+    uta_gtfs_clean.<table>      the same SELECTs materialized as typed tables,
+                                sorted by their lookup keys (CLEAN_TABLES)
+    uta_gtfs_realtime.<table>   gtfs_realtime_decoder.py output: the flattened
+                                ndjson/parquet tables and realtime_dump.json
+    uta_gtfs_clean.vehicle_positions / route_hourly_performance
+                                the archive (archive.py), as in
+                                sql/athena_realtime_tables.sql
+
+1. refresh: loads whatever changed since the last run. Every source file is
+   recorded in _loaded_files with its size and mtime. A changed GTFS file
+   rebuilds its table. A new realtime file is appended; one that grew (the
+   ndjson writer appends to the hour's file) or was rewritten is reloaded,
+   and one that disappeared (compaction merged it) has its rows deleted.
+   Realtime rows carry their source_file for that.
+2. load: same as refresh but rebuilds everything from scratch.
+3. bench: runs BENCH_QUERIES against uta_gtfs_views (CSV parsed per query)
+   and uta_gtfs_clean (materialized), and prints both timings.
+
+    python scripts/local_analytics.py refresh --gtfs /data/GTFS --realtime /data/GTFS_realtime
+    python scripts/local_analytics.py bench
+    duckdb /data/uta_analytics.duckdb
+
+--gtfs is an extracted GTFS directory, a raw/YYYY-MM-DD/ partition synced from
+S3 (one folder per table) or the GTFS ZIP. --archive is a local copy of the
+archive root (aws s3 sync s3://[BUCKET]/archive/vehicles ./archive/vehicles).
+"""
+import argparse
+import glob
+import os
+import statistics
+import time
+import zipfile
+
+import duckdb
+
+from gtfs_rt_flatten import SCHEMAS
+
+DB_PATH = os.environ.get('ANALYTICS_DB', '/data/uta_analytics.duckdb')
+GTFS_DIR = os.environ.get('GTFS_DIR', '/data/GTFS')
+REALTIME_DIR = os.environ.get('REALTIME_DIR', '/data/GTFS_realtime')
+ARCHIVE_ROOT = os.environ.get('ARCHIVE_ROOT')
+DISPLAY_TIMEZONE = 'America/Denver'
+# Skip files modified this recently (they may still be being written); set it
+# when a decoder or archive writer runs alongside refresh
+SETTLE_SECONDS = int(os.environ.get('SETTLE_SECONDS', '0'))
+BENCH_REPEAT = 5
+
+# Raw columns per GTFS table (missing optional columns come out as NULL), and
+# the clean SELECT over them: the same casts and filters as the Athena views.
+RAW_COLUMNS = {
+    'stops': ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'parent_station'],
+    'routes': ['route_id', 'route_short_name', 'route_long_name', 'route_type'],
+    'trips': ['route_id', 'service_id', 'trip_id', 'trip_headsign', 'direction_id', 'shape_id'],
+    'stop_times': ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'],
+}
+CLEAN_TABLES = {
+    'stops': ("""
+        SELECT
+          CAST(stop_id AS VARCHAR) AS stop_id,
+          stop_name,
+          CAST(stop_lat AS DOUBLE) AS stop_lat,
+          CAST(stop_lon AS DOUBLE) AS stop_lon,
+          parent_station
+        FROM uta_gtfs_raw.stops
+        WHERE
+          CAST(stop_lat AS DOUBLE) BETWEEN -90 AND 90
+          AND CAST(stop_lon AS DOUBLE) BETWEEN -180 AND 180""", 'stop_id'),
+    'routes': ("""
+        SELECT
+          CAST(route_id AS VARCHAR) AS route_id,
+          route_short_name,
+          route_long_name,
+          CAST(route_type AS INTEGER) AS route_type
+        FROM uta_gtfs_raw.routes""", 'route_id'),
+    'trips': ("""
+        SELECT
+          CAST(route_id AS VARCHAR) AS route_id,
+          CAST(service_id AS VARCHAR) AS service_id,
+          CAST(trip_id AS VARCHAR) AS trip_id,
+          trip_headsign,
+          CAST(direction_id AS INTEGER) AS direction_id,
+          shape_id
+        FROM uta_gtfs_raw.trips""", 'route_id, trip_id'),
+    'stop_times': ("""
+        SELECT
+          CAST(trip_id AS VARCHAR) AS trip_id,
+          arrival_time,
+          departure_time,
+          CAST(stop_id AS VARCHAR) AS stop_id,
+          CAST(stop_sequence AS INTEGER) AS stop_sequence
+        FROM uta_gtfs_raw.stop_times""", 'trip_id, stop_sequence'),
+}
+
+# Archive vehicles -> uta_gtfs_clean.vehicle_positions (sql/athena_realtime_tables.sql)
+VEHICLE_POSITIONS_SELECT = f"""
+    SELECT
+      id AS vehicle_id,
+      trip_id,
+      route_id,
+      latitude,
+      longitude,
+      speed_mph,
+      bearing,
+      delay_seconds,
+      shape_dist_m,
+      last_stop_id,
+      next_stop_id,
+      schedule_status,
+      epoch_ms(ts * 1000) AS observed_at,
+      epoch_ms(NULLIF(vehicle_timestamp, 0) * 1000) AS vehicle_time,
+      CAST(timezone('{DISPLAY_TIMEZONE}', to_timestamp(ts)) AS DATE) AS service_date,
+      dt,
+      hour,
+      filename AS source_file
+    FROM {{source}}
+    WHERE
+      NOT COALESCE(deleted, false)
+      AND latitude BETWEEN -90 AND 90
+      AND longitude BETWEEN -180 AND 180"""
+VEHICLE_POSITIONS_SORT = 'route_id, trip_id, vehicle_id, observed_at'
+ROUTE_HOURLY_PERFORMANCE = """
+    SELECT
+      route_id,
+      dt,
+      hour,
+      COUNT(DISTINCT vehicle_id) AS vehicles,
+      COUNT(*) AS positions,
+      AVG(speed_mph) AS avg_speed_mph,
+      approx_quantile(delay_seconds, 0.5) AS median_delay_seconds,
+      AVG(CASE WHEN schedule_status = 'on_time' THEN 1.0
+               WHEN schedule_status IN ('early', 'late') THEN 0.0 END) AS on_time_share
+    FROM {schema}.vehicle_positions
+    GROUP BY route_id, dt, hour"""
+
+# Flattened realtime tables (gtfs_rt_flatten.SCHEMAS) and their sort keys
+_DUCKDB_TYPES = {'string': 'VARCHAR', 'float64': 'DOUBLE', 'float32': 'REAL', 'int32': 'INTEGER',
+                 'int64': 'BIGINT', 'bool': 'BOOLEAN'}
+REALTIME_SORT = {
+    'vehicle_positions': 'route_id, trip_id, feed_timestamp',
+    'trip_updates': 'route_id, trip_id, feed_timestamp',
+    'stop_time_updates': 'trip_id, stop_sequence, feed_timestamp',
+    'alerts': 'feed_timestamp, entity_id',
+}
+# MessageToDict writes enums by name; the flattened tables keep the numbers
+_ENUMS = {
+    'current_status': ['INCOMING_AT', 'STOPPED_AT', 'IN_TRANSIT_TO'],
+    'occupancy_status': ['EMPTY', 'MANY_SEATS_AVAILABLE', 'FEW_SEATS_AVAILABLE', 'STANDING_ROOM_ONLY',
+                         'CRUSHED_STANDING_ROOM_ONLY', 'FULL', 'NOT_ACCEPTING_PASSENGERS'],
+}
+# realtime_dump.json entity paths for the vehicle_positions columns
+_DUMP_PATHS = {
+    'entity_id': '$.id',
+    'vehicle_id': '$.vehicle.vehicle.id',
+    'vehicle_label': '$.vehicle.vehicle.label',
+    'trip_id': '$.vehicle.trip.tripId',
+    'route_id': '$.vehicle.trip.routeId',
+    'direction_id': '$.vehicle.trip.directionId',
+    'start_date': '$.vehicle.trip.startDate',
+    'start_time': '$.vehicle.trip.startTime',
+    'latitude': '$.vehicle.position.latitude',
+    'longitude': '$.vehicle.position.longitude',
+    'bearing': '$.vehicle.position.bearing',
+    'speed': '$.vehicle.position.speed',
+    'current_stop_sequence': '$.vehicle.currentStopSequence',
+    'stop_id': '$.vehicle.stopId',
+    'current_status': '$.vehicle.currentStatus',
+    'occupancy_status': '$.vehicle.occupancyStatus',
+    'vehicle_timestamp': '$.vehicle.timestamp',
+}
+
+# Production queries, run against {schema} = uta_gtfs_views and uta_gtfs_clean
+BENCH_QUERIES = [
+    ('stops_in_bbox', 'static', """
+        SELECT COUNT(*) FROM {schema}.stops
+        WHERE stop_lat BETWEEN 40.70 AND 40.80 AND stop_lon BETWEEN -111.95 AND -111.85"""),
+    ('stops_per_trip', 'static', """
+        SELECT trip_id, COUNT(*) AS stops FROM {schema}.stop_times GROUP BY trip_id"""),
+    ('trip_timetable', 'static', """
+        SELECT stop_sequence, stop_id, arrival_time, departure_time FROM {schema}.stop_times
+        WHERE trip_id = (SELECT MIN(trip_id) FROM {schema}.trips) ORDER BY stop_sequence"""),
+    ('stops_served_per_route', 'static', """
+        SELECT r.route_id, r.route_short_name, COUNT(DISTINCT st.stop_id) AS stops
+        FROM {schema}.routes r
+        JOIN {schema}.trips t ON t.route_id = r.route_id
+        JOIN {schema}.stop_times st ON st.trip_id = t.trip_id
+        GROUP BY r.route_id, r.route_short_name"""),
+    ('first_departure_per_route', 'static', """
+        SELECT t.route_id, t.direction_id, MIN(st.departure_time) AS first_departure
+        FROM {schema}.trips t JOIN {schema}.stop_times st ON st.trip_id = t.trip_id
+        WHERE st.stop_sequence = 1
+        GROUP BY t.route_id, t.direction_id"""),
+    ('route_hourly_performance', 'archive', """
+        SELECT dt, hour, vehicles, avg_speed_mph, median_delay_seconds, on_time_share
+        FROM ({performance})
+        WHERE route_id = (SELECT MIN(route_id) FROM {schema}.vehicle_positions)
+        ORDER BY dt, hour"""),
+    ('latest_position_per_vehicle', 'archive', """
+        SELECT vehicle_id, arg_max(latitude, observed_at), arg_max(longitude, observed_at), MAX(observed_at)
+        FROM {schema}.vehicle_positions GROUP BY vehicle_id"""),
+]
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _file_list(paths):
+    return '[' + ', '.join(_quote(path) for path in paths) + ']'
+
+
+def connect(db_path=DB_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    con = duckdb.connect(db_path)
+    for schema in ('uta_gtfs_raw', 'uta_gtfs_views', 'uta_gtfs_clean', 'uta_gtfs_realtime'):
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS _loaded_files (
+          table_name VARCHAR, path VARCHAR, size BIGINT, mtime DOUBLE, loaded_at TIMESTAMP,
+          PRIMARY KEY (table_name, path))""")
+    return con
+
+
+def _stat(path):
+    info = os.stat(path)
+    return info.st_size, info.st_mtime
+
+
+def _known_files(con, table_name):
+    rows = con.execute("SELECT path, size, mtime FROM _loaded_files WHERE table_name = ?", [table_name]).fetchall()
+    return {path: (size, mtime) for path, size, mtime in rows}
+
+
+def _record_files(con, table_name, removed, added):
+    if removed:
+        con.execute("DELETE FROM _loaded_files WHERE table_name = ? AND list_contains(?, path)",
+                    [table_name, removed])
+    for path, (size, mtime) in added.items():
+        con.execute("INSERT INTO _loaded_files VALUES (?, ?, ?, ?, now())", [table_name, path, size, mtime])
+
+
+# --- Static GTFS --------------------------------------------------------------
+
+def resolve_gtfs(source, db_path=DB_PATH):
+    """{table: .txt path} for a GTFS directory, raw/ partition or ZIP."""
+    if source.endswith('.zip'):
+        # DuckDB cannot read inside a ZIP; keep the extracted tables next to the
+        # database, since the uta_gtfs_raw views read them on every query
+        directory = os.path.splitext(os.path.abspath(db_path))[0] + '_gtfs'
+        os.makedirs(directory, exist_ok=True)
+        with zipfile.ZipFile(source) as zip_ref:
+            for member in zip_ref.infolist():
+                table = os.path.basename(member.filename).replace('.txt', '')
+                if table in RAW_COLUMNS:
+                    target = os.path.join(directory, f"{table}.txt")
+                    if not os.path.exists(target) or os.path.getsize(target) != member.file_size:
+                        with zip_ref.open(member) as src, open(target, 'wb') as dst:
+                            dst.write(src.read())
+        source = directory
+
+    paths = {}
+    for table in RAW_COLUMNS:
+        for candidate in (os.path.join(source, f"{table}.txt"), os.path.join(source, table, f"{table}.txt")):
+            if os.path.exists(candidate):
+                paths[table] = os.path.abspath(candidate)
+                break
+    return paths
+
+
+def _raw_view_sql(con, table, path):
+    csv = f"read_csv({_quote(path)}, header = true, all_varchar = true)"
+    present = {row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {csv}").fetchall()}
+    columns = [name if name in present else f"CAST(NULL AS VARCHAR) AS {name}" for name in RAW_COLUMNS[table]]
+    return f"CREATE OR REPLACE VIEW uta_gtfs_raw.{table} AS SELECT {', '.join(columns)} FROM {csv}"
+
+
+def load_static(con, source, db_path=DB_PATH, force=False):
+    """Rebuilds the uta_gtfs_clean table of every GTFS file that changed."""
+    paths = resolve_gtfs(source, db_path)
+    if not paths:
+        print(f"⚠️ No GTFS tables found in {source}, skipping the schedule.")
+        return []
+
+    rebuilt = []
+    for table, path in paths.items():
+        key = f"gtfs:{table}"
+        current = {path: _stat(path)}
+        known = _known_files(con, key)
+        if not force and known == current:
+            continue
+        select, order_by = CLEAN_TABLES[table]
+        start = time.perf_counter()
+        con.execute("BEGIN TRANSACTION")
+        try:
+            con.execute(_raw_view_sql(con, table, path))
+            con.execute(f"CREATE OR REPLACE VIEW uta_gtfs_views.{table} AS {select}")
+            con.execute(f"CREATE OR REPLACE TABLE uta_gtfs_clean.{table} AS {select} ORDER BY {order_by}")
+            _record_files(con, key, list(known), current)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        rows = con.execute(f"SELECT COUNT(*) FROM uta_gtfs_clean.{table}").fetchone()[0]
+        print(f"   ✅ uta_gtfs_clean.{table}: {rows} rows in {time.perf_counter() - start:.2f}s")
+        rebuilt.append(table)
+    return rebuilt
+
+
+# --- Realtime files ------------------------------------------------------------
+
+def _settled(paths):
+    cutoff = time.time() - SETTLE_SECONDS
+    return {path: stat for path, stat in ((p, _stat(p)) for p in paths) if stat[1] <= cutoff}
+
+
+def sync_files(con, table_name, target, paths, insert_select, order_by):
+    """
+    Brings `target` in line with the files on disk: rows of files that changed
+    or disappeared are deleted, new and changed files are inserted (sorted).
+    insert_select(paths) returns the SELECT that reads those files.
+    """
+    current = _settled(paths)
+    known = _known_files(con, table_name)
+    stale = [path for path in known if known[path] != current.get(path)]
+    fresh = {path: stat for path, stat in current.items() if known.get(path) != stat}
+    if not stale and not fresh:
+        return 0, 0
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        if stale:
+            con.execute(f"DELETE FROM {target} WHERE list_contains(?, source_file)", [stale])
+        if fresh:
+            con.execute(f"INSERT INTO {target} {insert_select(sorted(fresh))} ORDER BY {order_by}")
+        _record_files(con, table_name, stale, fresh)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    return len(fresh), len([path for path in stale if path not in current])
+
+
+def _realtime_columns(table):
+    return [(name, _DUCKDB_TYPES[type_name]) for name, type_name in SCHEMAS[table]]
+
+
+def _flattened_select(table, paths):
+    columns = _realtime_columns(table)
+    select = ', '.join(f"CAST({name} AS {sql_type}) AS {name}" for name, sql_type in columns)
+    json_paths = [path for path in paths if path.endswith('.ndjson')]
+    parquet_paths = [path for path in paths if path.endswith('.parquet')]
+    parts = []
+    if json_paths:
+        spec = '{' + ', '.join(f"{_quote(name)}: {_quote(sql_type)}" for name, sql_type in columns) + '}'
+        parts.append(f"SELECT {select}, filename AS source_file FROM read_json({_file_list(json_paths)}, "
+                     f"format = 'newline_delimited', columns = {spec}, filename = true, ignore_errors = true)")
+    if parquet_paths:
+        parts.append(f"SELECT {select}, filename AS source_file FROM read_parquet({_file_list(parquet_paths)}, "
+                     f"union_by_name = true, filename = true)")
+    return 'SELECT * FROM (' + ' UNION ALL '.join(parts) + ')'
+
+
+def _dump_value(name, sql_type):
+    extracted = f"json_extract_string(e, {_quote(_DUMP_PATHS[name])})"
+    if name in _ENUMS:
+        names = ', '.join(_quote(value) for value in _ENUMS[name])
+        return f"COALESCE(TRY_CAST({extracted} AS INTEGER), list_position([{names}], {extracted}) - 1)"
+    if sql_type == 'VARCHAR':
+        return extracted
+    return f"TRY_CAST({extracted} AS {sql_type})"
+
+
+def _dump_select(paths):
+    """Vehicle entities of realtime_dump.json (MessageToDict) as vehicle_positions rows."""
+    values = []
+    for name, sql_type in _realtime_columns('vehicle_positions'):
+        if name == 'feed_timestamp':
+            values.append("TRY_CAST(json_extract_string(header, '$.timestamp') AS BIGINT) AS feed_timestamp")
+        else:
+            values.append(f"{_dump_value(name, sql_type)} AS {name}")
+    return (f"SELECT {', '.join(values)}, filename AS source_file FROM ("
+            f"SELECT header, unnest(entity) AS e, filename FROM read_json({_file_list(paths)}, "
+            f"columns = {{'header': 'JSON', 'entity': 'JSON[]'}}, filename = true)) "
+            f"WHERE json_exists(e, '$.vehicle')")
+
+
+def refresh_realtime(con, realtime_dir):
+    """Appends new decoder output to uta_gtfs_realtime (returns files loaded)."""
+    loaded = 0
+    for table in SCHEMAS:
+        columns = ', '.join(f"{name} {sql_type}" for name, sql_type in _realtime_columns(table))
+        con.execute(f"CREATE TABLE IF NOT EXISTS uta_gtfs_realtime.{table} ({columns}, source_file VARCHAR)")
+        paths = [os.path.abspath(path) for pattern in ('*.ndjson', '*.parquet')
+                 for path in glob.glob(os.path.join(realtime_dir, table, 'date=*', pattern))]
+        added, removed = sync_files(con, f"realtime:{table}", f"uta_gtfs_realtime.{table}", paths,
+                                    lambda fresh, table=table: _flattened_select(table, fresh), REALTIME_SORT[table])
+        if added or removed:
+            print(f"   ✅ uta_gtfs_realtime.{table}: {added} file(s) loaded, {removed} removed")
+        loaded += added
+
+    dump = os.path.join(realtime_dir, 'realtime_dump.json')
+    paths = [os.path.abspath(dump)] if os.path.exists(dump) else []
+    # The dump is overwritten on every run, so a changed dump replaces its rows
+    added, _ = sync_files(con, 'realtime:dump', 'uta_gtfs_realtime.vehicle_positions', paths, _dump_select,
+                          REALTIME_SORT['vehicle_positions'])
+    if added:
+        print("   ✅ uta_gtfs_realtime.vehicle_positions: realtime_dump.json loaded")
+    return loaded + added
+
+
+def _archive_source(paths):
+    return f"read_parquet({_file_list(paths)}, hive_partitioning = true, hive_types_autocast = false, filename = true)"
+
+
+def refresh_archive(con, archive_root):
+    """Appends new archive hours to uta_gtfs_clean.vehicle_positions."""
+    pattern = os.path.join(os.path.abspath(archive_root), 'vehicles', 'dt=*', 'hour=*', '*.parquet')
+    paths = glob.glob(pattern)
+    exists = con.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = 'uta_gtfs_clean' "
+                         "AND table_name = 'vehicle_positions'").fetchone()[0]
+    if not exists:
+        if not paths:
+            return 0
+        # Typed from the first file; filled in by sync_files below
+        sample = VEHICLE_POSITIONS_SELECT.format(source=_archive_source(paths[:1]))
+        con.execute(f"CREATE TABLE uta_gtfs_clean.vehicle_positions AS {sample} LIMIT 0")
+        con.execute(f"CREATE OR REPLACE VIEW uta_gtfs_clean.route_hourly_performance AS "
+                    f"{ROUTE_HOURLY_PERFORMANCE.format(schema='uta_gtfs_clean')}")
+    if paths:
+        source = f"read_parquet({_quote(pattern)}, hive_partitioning = true, hive_types_autocast = false, filename = true)"
+        con.execute(f"CREATE OR REPLACE VIEW uta_gtfs_raw.vehicle_history AS SELECT * FROM {source}")
+        con.execute(f"CREATE OR REPLACE VIEW uta_gtfs_views.vehicle_positions AS "
+                    f"{VEHICLE_POSITIONS_SELECT.format(source='uta_gtfs_raw.vehicle_history')}")
+
+    added, removed = sync_files(con, 'archive:vehicles', 'uta_gtfs_clean.vehicle_positions', paths,
+                                lambda fresh: VEHICLE_POSITIONS_SELECT.format(source=_archive_source(fresh)),
+                                VEHICLE_POSITIONS_SORT)
+    if added or removed:
+        print(f"   ✅ uta_gtfs_clean.vehicle_positions: {added} file(s) loaded, {removed} removed")
+    return added
+
+
+def resort(con):
+    """Rewrites the appended tables in full sort order (appends are only sorted per batch)."""
+    tables = [(f"uta_gtfs_realtime.{table}", order_by) for table, order_by in REALTIME_SORT.items()]
+    tables.append(('uta_gtfs_clean.vehicle_positions', VEHICLE_POSITIONS_SORT))
+    existing = {f"{schema}.{name}" for schema, name in con.execute(
+        "SELECT table_schema, table_name FROM information_schema.tables WHERE table_type = 'BASE TABLE'").fetchall()}
+    for table, order_by in tables:
+        if table in existing:
+            con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM {table} ORDER BY {order_by}")
+            print(f"   🔃 {table} re-sorted")
+
+
+def refresh(con, gtfs=None, realtime_dir=None, archive_root=None, force=False, db_path=DB_PATH):
+    start = time.perf_counter()
+    if gtfs:
+        print(f"1. Schedule from {gtfs}...")
+        load_static(con, gtfs, db_path, force=force)
+    if realtime_dir and os.path.isdir(realtime_dir):
+        print(f"2. Realtime files from {realtime_dir}...")
+        refresh_realtime(con, realtime_dir)
+    if archive_root and os.path.isdir(archive_root):
+        print(f"3. Archive from {archive_root}...")
+        refresh_archive(con, archive_root)
+    con.execute("CHECKPOINT")
+    print(f"✅ Refreshed in {time.perf_counter() - start:.2f}s")
+
+
+# --- Benchmark -------------------------------------------------------------------
+
+def _time_query(con, sql, repeat):
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = len(con.execute(sql).fetchall())
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), rows
+
+
+def bench(con, repeat=BENCH_REPEAT):
+    """Median time of each production query over the CSV views and the materialized tables."""
+    views = {name for (name,) in con.execute(
+        "SELECT table_name FROM information_schema.tables WHERE table_schema = 'uta_gtfs_views'").fetchall()}
+    needs = {'static': {'stops', 'trips', 'stop_times', 'routes'}, 'archive': {'vehicle_positions'}}
+    results = []
+    print(f"{'query':<28} {'views (ms)':>11} {'tables (ms)':>12} {'speedup':>8}")
+    for name, kind, template in BENCH_QUERIES:
+        if not needs[kind] <= views:
+            continue
+        timings = []
+        counts = []
+        for schema in ('uta_gtfs_views', 'uta_gtfs_clean'):
+            performance = ROUTE_HOURLY_PERFORMANCE.format(schema=schema)
+            seconds, rows = _time_query(con, template.format(schema=schema, performance=performance), repeat)
+            timings.append(seconds)
+            counts.append(rows)
+        mismatch = '' if counts[0] == counts[1] else f"  ⚠️ rows {counts[0]} vs {counts[1]}"
+        print(f"{name:<28} {timings[0] * 1000:>11.1f} {timings[1] * 1000:>12.1f} "
+              f"{timings[0] / max(timings[1], 1e-9):>7.1f}x{mismatch}")
+        results.append({'query': name, 'views_ms': timings[0] * 1000, 'tables_ms': timings[1] * 1000,
+                        'rows': counts[1]})
+    if not results:
+        print("⚠️ Nothing to benchmark yet: run refresh with --gtfs or --archive first.")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local DuckDB copy of the uta_gtfs_clean tables")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command, help_text in (("refresh", "Load what changed since the last run"),
+                               ("load", "Rebuild everything from scratch")):
+        action = sub.add_parser(command, help=help_text)
+        action.add_argument("--gtfs", default=GTFS_DIR, help="GTFS directory, raw/<date>/ partition or ZIP")
+        action.add_argument("--realtime", default=REALTIME_DIR, help="gtfs_realtime_decoder.py output directory")
+        action.add_argument("--archive", default=ARCHIVE_ROOT, help="Local archive root (archive.py)")
+        action.add_argument("--resort", action="store_true", help="Re-sort the appended tables afterwards")
+    timing = sub.add_parser("bench", help="Time the production queries: CSV views vs materialized tables")
+    timing.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+    args = parser.parse_args()
+
+    connection = connect(args.db)
+    if args.command == "bench":
+        bench(connection, args.repeat)
+    else:
+        if args.command == "load":
+            connection.execute("DELETE FROM _loaded_files WHERE table_name NOT LIKE 'gtfs:%'")
+            for realtime_table in SCHEMAS:
+                connection.execute(f"DROP TABLE IF EXISTS uta_gtfs_realtime.{realtime_table}")
+            connection.execute("DROP VIEW IF EXISTS uta_gtfs_clean.route_hourly_performance")
+            connection.execute("DROP TABLE IF EXISTS uta_gtfs_clean.vehicle_positions")
+        gtfs_source = args.gtfs if args.gtfs and os.path.exists(args.gtfs) else None
+        refresh(connection, gtfs_source, args.realtime, args.archive, force=args.command == "load", db_path=args.db)
+        if args.resort:
+            resort(connection)
+    connection.close()
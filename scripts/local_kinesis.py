@@ -0,0 +1,221 @@
+"""
+In-memory stand-in for the parts of the Kinesis API this project uses.
+
+It is a drop-in replacement for boto3.client('kinesis') in local runs and
+benchmarks: put_records, list_shards, describe_stream, get_shard_iterator
+and get_records behave like the real service, including the 500 record /
+5 MB request limits, per-record throttling (throttle_rate) and
+MillisBehindLatest.
+"""
+import hashlib
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+MAX_RECORDS_PER_REQUEST = 500
+MAX_BYTES_PER_REQUEST = 5 * 1024 * 1024
+MAX_BYTES_PER_RECORD = 1024 * 1024
+MAX_HASH_KEY = 2 ** 128 - 1
+
+
+def _client_error(code, message, operation):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class _Shard:
+    def __init__(self, shard_id, start_hash, end_hash, parent_shard_id=None, adjacent_parent_shard_id=None):
+        self.shard_id = shard_id
+        self.start_hash = start_hash
+        self.end_hash = end_hash
+        self.parent_shard_id = parent_shard_id
+        self.adjacent_parent_shard_id = adjacent_parent_shard_id
+        self.records = []          # list of (sequence_number, arrival_time, partition_key, data)
+        self.closed = False
+
+    def describe(self):
+        shard = {
+            "ShardId": self.shard_id,
+            "HashKeyRange": {
+                "StartingHashKey": str(self.start_hash),
+                "EndingHashKey": str(self.end_hash),
+            },
+            "SequenceNumberRange": {
+                "StartingSequenceNumber": self.records[0][0] if self.records else "0",
+            },
+        }
+        if self.closed:
+            shard["SequenceNumberRange"]["EndingSequenceNumber"] = self.records[-1][0] if self.records else "0"
+        if self.parent_shard_id:
+            shard["ParentShardId"] = self.parent_shard_id
+        if self.adjacent_parent_shard_id:
+            shard["AdjacentParentShardId"] = self.adjacent_parent_shard_id
+        return shard
+
+
+class LocalKinesis:
+    """A single in-memory stream with `shard_count` evenly sized shards."""
+
+    def __init__(self, stream_name="local-stream", shard_count=1, throttle_rate=0.0, seed=None):
+        self.stream_name = stream_name
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self.put_calls = 0
+        self.shards = []
+        width = (MAX_HASH_KEY + 1) // shard_count
+        for i in range(shard_count):
+            end = MAX_HASH_KEY if i == shard_count - 1 else (i + 1) * width - 1
+            self.shards.append(_Shard(f"shardId-{i:012d}", i * width, end))
+
+    # --- Producer side -------------------------------------------------
+
+    def _open_shard_for(self, partition_key, explicit_hash_key=None):
+        if explicit_hash_key is not None:
+            hash_key = int(explicit_hash_key)
+        else:
+            hash_key = int(hashlib.md5(partition_key.encode("utf-8")).hexdigest(), 16)
+        for shard in self.shards:
+            if not shard.closed and shard.start_hash <= hash_key <= shard.end_hash:
+                return shard
+        raise _client_error("InternalFailure", "No open shard for hash key", "PutRecords")
+
+    def put_records(self, Records, StreamName):
+        if StreamName != self.stream_name:
+            raise _client_error("ResourceNotFoundException", f"Stream {StreamName} not found", "PutRecords")
+        if len(Records) > MAX_RECORDS_PER_REQUEST:
+            raise _client_error("ValidationException", "Too many records in request", "PutRecords")
+        total = sum(len(r["Data"]) + len(r["PartitionKey"].encode("utf-8")) for r in Records)
+        if total > MAX_BYTES_PER_REQUEST:
+            raise _client_error("ValidationException", "Request payload exceeds 5 MB", "PutRecords")
+
+        results = []
+        failed = 0
+        with self._lock:
+            self.put_calls += 1
+            now = datetime.now(timezone.utc)
+            for record in Records:
+                if len(record["Data"]) + len(record["PartitionKey"].encode("utf-8")) > MAX_BYTES_PER_RECORD:
+                    raise _client_error("ValidationException", "Record exceeds 1 MB", "PutRecords")
+                if self.throttle_rate and self._random.random() < self.throttle_rate:
+                    failed += 1
+                    results.append({
+                        "ErrorCode": "ProvisionedThroughputExceededException",
+                        "ErrorMessage": "Rate exceeded for shard",
+                    })
+                    continue
+                shard = self._open_shard_for(record["PartitionKey"], record.get("ExplicitHashKey"))
+                self._sequence += 1
+                sequence_number = f"{self._sequence:056d}"
+                shard.records.append((sequence_number, now, record["PartitionKey"], bytes(record["Data"])))
+                results.append({"SequenceNumber": sequence_number, "ShardId": shard.shard_id})
+
+        return {"FailedRecordCount": failed, "Records": results}
+
+    # --- Resharding ----------------------------------------------------
+
+    def split_shard(self, shard_id):
+        """Closes shard_id and opens two children that split its hash range."""
+        with self._lock:
+            parent = self._shard(shard_id)
+            parent.closed = True
+            middle = (parent.start_hash + parent.end_hash) // 2
+            next_index = len(self.shards)
+            self.shards.append(_Shard(f"shardId-{next_index:012d}", parent.start_hash, middle, parent.shard_id))
+            self.shards.append(_Shard(f"shardId-{next_index + 1:012d}", middle + 1, parent.end_hash, parent.shard_id))
+
+    def merge_shards(self, shard_id, adjacent_shard_id):
+        """Closes two adjacent shards and opens one child covering both ranges."""
+        with self._lock:
+            first, second = self._shard(shard_id), self._shard(adjacent_shard_id)
+            first.closed = second.closed = True
+            child = _Shard(
+                f"shardId-{len(self.shards):012d}",
+                min(first.start_hash, second.start_hash),
+                max(first.end_hash, second.end_hash),
+                first.shard_id,
+                second.shard_id,
+            )
+            self.shards.append(child)
+
+    # --- Consumer side -------------------------------------------------
+
+    def _shard(self, shard_id):
+        for shard in self.shards:
+            if shard.shard_id == shard_id:
+                return shard
+        raise _client_error("ResourceNotFoundException", f"Shard {shard_id} not found", "GetShardIterator")
+
+    def list_shards(self, StreamName=None, NextToken=None, **kwargs):
+        return {"Shards": [shard.describe() for shard in self.shards]}
+
+    def describe_stream(self, StreamName):
+        return {
+            "StreamDescription": {
+                "StreamName": self.stream_name,
+                "StreamStatus": "ACTIVE",
+                "Shards": [shard.describe() for shard in self.shards],
+                "HasMoreShards": False,
+            }
+        }
+
+    def get_shard_iterator(self, StreamName, ShardId, ShardIteratorType,
+                           StartingSequenceNumber=None, Timestamp=None):
+        shard = self._shard(ShardId)
+        if ShardIteratorType == "TRIM_HORIZON":
+            position = 0
+        elif ShardIteratorType == "LATEST":
+            position = len(shard.records)
+        elif ShardIteratorType in ("AT_SEQUENCE_NUMBER", "AFTER_SEQUENCE_NUMBER"):
+            position = next(
+                (i for i, r in enumerate(shard.records) if r[0] >= StartingSequenceNumber),
+                len(shard.records),
+            )
+            if (ShardIteratorType == "AFTER_SEQUENCE_NUMBER" and position < len(shard.records)
+                    and shard.records[position][0] == StartingSequenceNumber):
+                position += 1
+        elif ShardIteratorType == "AT_TIMESTAMP":
+            if isinstance(Timestamp, (int, float)):
+                Timestamp = datetime.fromtimestamp(Timestamp, timezone.utc)
+            position = next((i for i, r in enumerate(shard.records) if r[1] >= Timestamp), len(shard.records))
+        else:
+            raise _client_error("InvalidArgumentException", f"Bad iterator type {ShardIteratorType}", "GetShardIterator")
+        return {"ShardIterator": f"{ShardId}|{position}"}
+
+    def get_records(self, ShardIterator, Limit=10000):
+        shard_id, position = ShardIterator.rsplit("|", 1)
+        shard = self._shard(shard_id)
+        position = int(position)
+        with self._lock:
+            chunk = shard.records[position:position + Limit]
+            next_position = position + len(chunk)
+            at_end = next_position >= len(shard.records)
+            closed = shard.closed
+
+        records = [
+            {
+                "SequenceNumber": sequence_number,
+                "ApproximateArrivalTimestamp": arrival,
+                "Data": data,
+                "PartitionKey": partition_key,
+            }
+            for sequence_number, arrival, partition_key, data in chunk
+        ]
+        millis_behind = 0
+        if not at_end:
+            millis_behind = int((time.time() - shard.records[next_position][1].timestamp()) * 1000)
+
+        response = {"Records": records, "MillisBehindLatest": max(millis_behind, 0)}
+        # A closed shard that has been read to the end has no next iterator
+        if not (closed and at_end):
+            response["NextShardIterator"] = f"{shard_id}|{next_position}"
+        else:
+            response["ChildShards"] = [
+                {"ShardId": s.shard_id, "ParentShards": [p for p in (s.parent_shard_id, s.adjacent_parent_shard_id) if p]}
+                for s in self.shards
+                if shard_id in (s.parent_shard_id, s.adjacent_parent_shard_id)
+            ]
+        return response
@@ -2,43 +2,193 @@
 # - requests: fetches data from the UTA API over HTTP
 # - gtfs_realtime_pb2: decodes the Protobuf binary data into readable fields
 # - json: formats the output nicely
+# - metrics: per-stage timers and counters (see metrics.py)
+import os
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 from google.transit import gtfs_realtime_pb2
 import json
 
-# URL for UTA's real-time Vehicle Positions (binary Protobuf feed)
-GTFS_RT_URL = "https://apps.rideuta.com/tms/gtfs/Vehicle"
+from metrics import Metrics, NullSink
+
+# URL for UTA's real-time Vehicle Positions (binary Protobuf feed);
+# GTFS_RT_URL overrides it (e.g. a local feed in benchmarks)
+GTFS_RT_URL = os.environ.get("GTFS_RT_URL", "https://apps.rideuta.com/tms/gtfs/Vehicle")
+
+# Seconds to wait for the feed (connect, read) before giving up
+REQUEST_TIMEOUT = (3.05, 10)
+
+# GTFS-RT reports position.speed in metres per second
+MPS_TO_MPH = 2.2369363
+
+
+def _read_varint(buf, pos):
+    """Reads one protobuf varint from buf at pos. Returns (value, new_pos)."""
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
 
 
-def fetch_realtime_data():
+def peek_header_timestamp(payload):
     """
-    Fetches the real-time GTFS data from UTA,
-    decodes the Protobuf message, and extracts useful fields
-    into a clean JSON-ready structure.
+    Reads only header.timestamp from a serialized FeedMessage, without
+    parsing the (much larger) list of entities. Returns None if the header
+    can't be found.
     """
+    pos = 0
+    try:
+        while pos < len(payload):
+            key, pos = _read_varint(payload, pos)
+            field_number, wire_type = key >> 3, key & 0x7
+            if wire_type == 0:
+                _, pos = _read_varint(payload, pos)
+            elif wire_type == 1:
+                pos += 8
+            elif wire_type == 5:
+                pos += 4
+            elif wire_type == 2:
+                length, pos = _read_varint(payload, pos)
+                if field_number == 1:
+                    # FeedMessage.header (field 1) is a FeedHeader message
+                    header = gtfs_realtime_pb2.FeedHeader()
+                    header.ParseFromString(payload[pos:pos + length])
+                    return header.timestamp
+                pos += length
+            else:
+                return None
+    except Exception:
+        return None
+    return None
 
-    # Create an empty FeedMessage object (the standard GTFS RT container)
-    feed = gtfs_realtime_pb2.FeedMessage()
 
-    # Send HTTP GET request to the UTA feed
-    response = requests.get(GTFS_RT_URL)
+class RealtimeFetcher:
+    """
+    Fetches one GTFS-RT feed over a persistent keep-alive session.
 
-    # If the response wasn't successful (status != 200), stop and report it
-    if response.status_code != 200:
-        raise Exception(f"Request failed with status {response.status_code}")
+    Each poll sends If-None-Match / If-Modified-Since from the previous
+    response and accepts gzip. A poll is short-circuited (returns None,
+    nothing is parsed) when the server answers 304, or when the feed's
+    header.timestamp is the same as in the last parsed snapshot. A missing
+    timestamp (0) means "unknown" and is always parsed, and a timestamp that
+    goes backwards (publisher reset) is parsed as a new snapshot.
+    """
 
-    # Decode the binary Protobuf data into the FeedMessage object
-    feed.ParseFromString(response.content)
+    def __init__(self, url=GTFS_RT_URL, timeout=REQUEST_TIMEOUT, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+        if headers:
+            self.session.headers.update(headers)
 
-    # Print the feed timestamp so we know how "fresh" the data is
-    print("Feed timestamp:", feed.header.timestamp)
+        self.etag = None
+        self.last_modified = None
+        self.last_timestamp = None
+        self.stats = {"polls": 0, "not_modified": 0, "same_timestamp": 0, "parsed": 0}
+
+    def fetch(self, metrics=None):
+        """
+        Returns a parsed FeedMessage, or None when the feed hasn't changed.
+        Times the download ('fetch') and the decoding ('parse') into metrics.
+        """
+        metrics = metrics or Metrics(sink=NullSink())
+        self.stats["polls"] += 1
+
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        with metrics.timer("fetch"):
+            response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+            payload = response.content
+
+        # 304: the server itself says nothing changed
+        if response.status_code == 304:
+            self.stats["not_modified"] += 1
+            self._count_duplicate(metrics)
+            return None
+
+        # If the response wasn't successful (status != 200), stop and report it
+        if response.status_code != 200:
+            raise Exception(f"Request failed with status {response.status_code}")
+
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        metrics.count("payload_bytes", len(payload), "Bytes")
+
+        # Same snapshot as last time: check the header before parsing everything
+        timestamp = peek_header_timestamp(payload)
+        if timestamp and timestamp == self.last_timestamp:
+            self.stats["same_timestamp"] += 1
+            self._count_duplicate(metrics)
+            return None
+
+        # Decode the binary Protobuf data into the FeedMessage object
+        with metrics.timer("parse"):
+            feed = gtfs_realtime_pb2.FeedMessage()
+            feed.ParseFromString(payload)
+        self.last_timestamp = feed.header.timestamp
+        self.stats["parsed"] += 1
+        # A feed without header.timestamp (0) has no age to report
+        if feed.header.timestamp:
+            metrics.gauge("staleness_s", round(time.time() - feed.header.timestamp, 1), "Seconds")
+        return feed
+
+    def _count_duplicate(self, metrics):
+        """An unchanged poll: the feed is as old as the last snapshot we parsed."""
+        metrics.count("duplicate_polls")
+        if self.last_timestamp:
+            metrics.gauge("staleness_s", round(time.time() - self.last_timestamp, 1), "Seconds")
 
+    def short_circuit_rate(self):
+        """Share of polls that ended before parsing."""
+        if not self.stats["polls"]:
+            return 0.0
+        return (self.stats["not_modified"] + self.stats["same_timestamp"]) / self.stats["polls"]
+
+
+# One fetcher per process, so warm Lambda invocations reuse the connection
+# and remember the last snapshot they saw.
+_fetcher = None
+
+
+def get_fetcher():
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = RealtimeFetcher()
+    return _fetcher
+
+
+def flatten_vehicle_positions(feed):
+    """
+    Extracts useful vehicle fields from a FeedMessage into a clean
+    JSON-ready list of dictionaries.
+    """
     # This list will store the cleaned-up vehicle records we extract
     entity_list = []
 
     # Loop through each entity (vehicle update) in the feed
     for entity in feed.entity:
 
+        # Speed/bearing are optional in GTFS-RT: None when the feed leaves them out
+        position = entity.vehicle.position
+        speed = position.speed if position.HasField("speed") else None
+
         # Extract useful vehicle info into a Python dictionary
         entity_list.append({
             "id": entity.id,                                    # Unique entity ID
@@ -46,11 +196,43 @@ def fetch_realtime_data():
             "route_id": entity.vehicle.trip.route_id,           # Route number (e.g., Bus 470)
             "latitude": entity.vehicle.position.latitude,        # GPS latitude
             "longitude": entity.vehicle.position.longitude,      # GPS longitude
+            "speed_mph": None if speed is None else round(speed * MPS_TO_MPH, 1),   # Reported speed (feed gives m/s)
+            "bearing": position.bearing if position.HasField("bearing") else None,  # Degrees from north
             "vehicle_timestamp": entity.vehicle.timestamp,       # Time the GPS reading was taken
             "source_timestamp": feed.header.timestamp            # ✅ Timestamp of entire feed
         })
 
+    return entity_list
+
+
+def fetch_realtime_data(fetcher=None, metrics=None):
+    """
+    Fetches the real-time GTFS data from UTA,
+    decodes the Protobuf message, and extracts useful fields
+    into a clean JSON-ready structure.
+
+    Returns None when the feed is unchanged since the last poll (HTTP 304
+    or same header.timestamp), so nothing is sent twice. An empty list means
+    the feed really has no vehicles (e.g. overnight).
+    Stage timings and counts go to `metrics` when one is given.
+    """
+    fetcher = fetcher or get_fetcher()
+    metrics = metrics or Metrics(sink=NullSink())
+    feed = fetcher.fetch(metrics)
+
+    if feed is None:
+        print(f"Feed unchanged, skipped parsing "
+              f"(short-circuit rate {fetcher.short_circuit_rate():.0%}, stats {fetcher.stats})")
+        return None
+
+    # Print the feed timestamp so we know how "fresh" the data is
+    print("Feed timestamp:", feed.header.timestamp)
+
     # Return the cleaned JSON-ready list (no Protobuf objects)
+    with metrics.timer("flatten"):
+        entity_list = flatten_vehicle_positions(feed)
+    metrics.count("entities", len(entity_list))
+    metrics.count("duplicate_entities", len(entity_list) - len({entity["id"] for entity in entity_list}))
     return entity_list
 
 
@@ -58,4 +240,4 @@ def fetch_realtime_data():
 if __name__ == "__main__":
     data = fetch_realtime_data()
     # Pretty-print JSON output so it's easy to read
-    print(json.dumps(data, indent=2))
\ No newline at end of file
+    print(json.dumps(data, indent=2))
@@ -1,12 +1,92 @@
 import json
-import boto3
-import csv
-import io 
-from botocore.exceptions import ClientError
-from poll_gtfs_realtime import fetch_realtime_data 
+import os
+import random
+from dataclasses import dataclass
 
-# Define the Kinesis stream name
-KINESIS_STREAM_NAME = "uta_Gtfs_kinesis_stream"
+from kinesis_sender import KinesisBatchSender, partition_key_for
+from metrics import Metrics, NullSink
+from poll_gtfs_realtime import fetch_realtime_data, get_fetcher
+from vehicle_state_store import FileStateStore, compute_deltas
+
+# boto3 (~0.3 s to import), csv/io (debug table), vehicle_codec (aggregated
+# records), numpy (kinematics), the schedule index and the headway tracker
+# are imported where they are first used. In Lambda, the clients are created
+# during init instead (see prewarm()).
+
+
+@dataclass(frozen=True)
+class PollerConfig:
+    """Environment settings, read and checked once per container instead of on every poll."""
+
+    # Kinesis stream the vehicles are sent to
+    stream_name: str = "uta_Gtfs_kinesis_stream"
+
+    # EMIT_MODE=full sends every vehicle on every poll (original behaviour).
+    # EMIT_MODE=delta only sends new/moved vehicles plus tombstones for vehicles
+    # that disappeared, with a full snapshot every SNAPSHOT_EVERY_N_POLLS polls.
+    emit_mode: str = "full"
+    snapshot_every_n_polls: int = 10
+    vehicle_state_path: str = "/tmp/vehicle_state.json"
+
+    # RECORD_FORMAT=json sends one JSON record per vehicle (original behaviour).
+    # RECORD_FORMAT=aggregated packs the whole poll into a few compact columnar
+    # records (see vehicle_codec.py); consumers must decode with vehicle_codec.
+    record_format: str = "json"
+
+    # KINEMATICS=on fills speed_mph/bearing for vehicles the feed reports without
+    # them, from each vehicle's previous fix (see kinematics.py, needs numpy;
+    # skipped with a warning when numpy is missing).
+    kinematics: bool = True
+    kinematics_state_path: str = "/tmp/vehicle_kinematics.json"
+
+    # ADHERENCE_INDEX=s3://bucket/indexes/<date>/schedule.idx (or a local path)
+    # adds delay_seconds, last/next stop and schedule_status from the compiled
+    # schedule (see adherence.py). Unset: no adherence columns.
+    adherence_index: str = None
+
+    # HEADWAY_STREAM_NAME=<stream> tracks headways per route and direction and
+    # publishes bunching/gap events and per-route counters to that stream (see
+    # headway.py). Needs ADHERENCE_INDEX for the distance along each route.
+    headway_stream_name: str = None
+
+    # Every invocation logs one structured metrics line (stage timers, entity,
+    # byte, failure and duplicate counts, feed staleness; see metrics.py).
+    # METRICS_SINK=none turns it off. The full vehicle table is a debug option:
+    # DEBUG_TABLE_SAMPLE_RATE=0.05 prints it on ~5% of invocations, 1 on all.
+    debug_table_sample_rate: float = 0.0
+
+    # True inside Lambda: clients are created during init, not on the first poll
+    prewarm: bool = False
+
+    @classmethod
+    def from_env(cls, environ=None):
+        env = os.environ if environ is None else environ
+        config = cls(
+            stream_name=env.get("KINESIS_STREAM_NAME", cls.stream_name),
+            emit_mode=env.get("EMIT_MODE", cls.emit_mode),
+            snapshot_every_n_polls=int(env.get("SNAPSHOT_EVERY_N_POLLS", cls.snapshot_every_n_polls)),
+            vehicle_state_path=env.get("VEHICLE_STATE_PATH", cls.vehicle_state_path),
+            record_format=env.get("RECORD_FORMAT", cls.record_format),
+            kinematics=env.get("KINEMATICS", "on") == "on",
+            kinematics_state_path=env.get("KINEMATICS_STATE_PATH", cls.kinematics_state_path),
+            adherence_index=env.get("ADHERENCE_INDEX") or None,
+            headway_stream_name=env.get("HEADWAY_STREAM_NAME") or None,
+            debug_table_sample_rate=float(env.get("DEBUG_TABLE_SAMPLE_RATE", cls.debug_table_sample_rate)),
+            prewarm=env.get("PREWARM", "on" if env.get("AWS_LAMBDA_FUNCTION_NAME") else "off") == "on",
+        )
+        # A typo fails the init phase once, instead of every poll behaving oddly
+        if config.emit_mode not in ("full", "delta"):
+            raise ValueError(f"EMIT_MODE must be 'full' or 'delta', not {config.emit_mode!r}")
+        if config.record_format not in ("json", "aggregated"):
+            raise ValueError(f"RECORD_FORMAT must be 'json' or 'aggregated', not {config.record_format!r}")
+        if not 0 <= config.debug_table_sample_rate <= 1:
+            raise ValueError("DEBUG_TABLE_SAMPLE_RATE must be between 0 and 1")
+        return config
+
+
+CONFIG = PollerConfig.from_env()
+state_store = FileStateStore(CONFIG.vehicle_state_path)
+kinematics_store = FileStateStore(CONFIG.kinematics_state_path)
 
 def format_list_to_table_string(entity_list):
     """
@@ -15,12 +95,14 @@ def format_list_to_table_string(entity_list):
     """
     if not entity_list:
         return "No data retrieved."
+    import csv
+    import io
 
     # Define the headers (your column names)
-    fieldnames = ['id', 'trip_id', 'route_id', 'latitude', 'longitude', 'vehicle_timestamp', 'source_timestamp']
+    fieldnames = ['id', 'trip_id', 'route_id', 'latitude', 'longitude', 'speed_mph', 'bearing', 'delay_seconds', 'next_stop_id', 'vehicle_timestamp', 'source_timestamp']
     output = io.StringIO()
     # Use tab-delimited format for neat printing in logs
-    writer = csv.DictWriter(output, fieldnames=fieldnames, delimiter='t', extrasaction='ignore') 
+    writer = csv.DictWriter(output, fieldnames=fieldnames, delimiter='\t', extrasaction='ignore') 
     
     writer.writeheader()
     writer.writerows(entity_list)
@@ -28,76 +110,240 @@ def format_list_to_table_string(entity_list):
     return output.getvalue()
 
 
-def send_to_kinesis(stream_name, data_list):
-    """
-    Sends the list of structured data dictionaries to the Kinesis stream 
-    using the highly efficient put_records (batch) method.
-    """
-    # 1. Initialize Kinesis client defensively
+# One sender (and one boto3 client) per stream and Lambda container, reused across invocations
+_senders = {}
+_adherence_engine = None
+_headway_tracker = None
+
+# Kinesis client settings: keep the connection alive between polls (a minute
+# apart) and fail fast, KinesisBatchSender does its own retries
+CLIENT_CONFIG = dict(connect_timeout=2, read_timeout=5, tcp_keepalive=True,
+                     retries={"mode": "standard", "max_attempts": 2})
+
+
+def get_sender(stream_name):
+    if stream_name not in _senders:
+        import boto3
+        from botocore.config import Config
+
+        client = boto3.client('kinesis', config=Config(**CLIENT_CONFIG))
+        _senders[stream_name] = KinesisBatchSender(client, stream_name)
+    return _senders[stream_name]
+
+
+def get_adherence_engine():
+    """Opens the schedule index once per container; trip plans stay cached between polls."""
+    global _adherence_engine
+    if _adherence_engine is None:
+        from adherence import load_engine
+        _adherence_engine = load_engine(CONFIG.adherence_index)
+    return _adherence_engine
+
+
+def get_headway_tracker():
+    """Route orderings and vehicle histories live in the container between polls."""
+    global _headway_tracker
+    if _headway_tracker is None:
+        from headway import HeadwayTracker
+        _headway_tracker = HeadwayTracker()
+    return _headway_tracker
+
+
+def publish_headway_events(entity_list):
+    """Feeds the poll to the headway tracker and sends its events, keyed by route."""
+    events, summary = get_headway_tracker().update(entity_list)
+    print(f"--- Headways --- {summary}")
+    if not events:
+        return
+    records = [{'Data': json.dumps(event).encode('utf-8'),
+                'PartitionKey': str(event.get('route_id'))} for event in events]
     try:
-        kinesis_client = boto3.client('kinesis')
+        response = get_sender(CONFIG.headway_stream_name).send(records)
+        if response.get('FailedRecordCount', 0) > 0:
+            print(f"⚠️ WARNING: {response['FailedRecordCount']} headway events lost after retries.")
     except Exception as e:
-        print(f"FATAL: Failed to initialize Kinesis client: {e}")
-        return {"Error": "Client initialization failed"}
-    
-    
+        print(f"General Error during headway event send: {e}")
+
+
+def build_records(data_list, record_format=None):
+    """Encodes vehicle dicts as put_records entries in RECORD_FORMAT."""
+    if (record_format or CONFIG.record_format) == "aggregated":
+        from vehicle_codec import encode_records
+        return encode_records(data_list, partition_key_prefix=f"agg-{data_list[0].get('source_timestamp', 0)}")
     records = []
-    # 2. Prepare all records in the batch format (up to 500 records per call)
     for entity in data_list:
         # Data must be a JSON string converted to bytes
         data_bytes = json.dumps(entity).encode('utf-8')
-        
-        # Use 'id' as Partition Key for consistent sharding
-        partition_key = entity.get('id', 'default_key')
-        
+
         records.append({
             'Data': data_bytes,
-            'PartitionKey': partition_key
+            'PartitionKey': partition_key_for(entity)
         })
+    return records
 
-    # 3. Send the entire batch
+
+def send_to_kinesis(stream_name, data_list, metrics=None):
+    """
+    Sends the list of structured data dictionaries to the Kinesis stream.
+    KinesisBatchSender splits them into put_records calls within the
+    500 record / 5 MB limits, sends them in parallel and retries only the
+    records Kinesis rejected. Encoding is timed as 'serialize', sending as 'send'.
+    """
+    metrics = metrics or Metrics(sink=NullSink())
+
+    # 1. Initialize Kinesis sender defensively
     try:
-        response = kinesis_client.put_records(
-            Records=records,
-            StreamName=stream_name
-        )
+        sender = get_sender(stream_name)
+    except Exception as e:
+        print(f"FATAL: Failed to initialize Kinesis client: {e}")
+        return {"Error": "Client initialization failed"}
+
+    # 2. Prepare all records in the batch format
+    with metrics.timer("serialize"):
+        records = build_records(data_list)
+
+    # 3. Send in limit-sized batches, retrying failed entries
+    try:
+        with metrics.timer("send"):
+            response = sender.send(records)
+        metrics.count("records_sent", response["records"])
+        metrics.count("bytes_sent", response["bytes"], "Bytes")
+        metrics.count("failed_records", response["FailedRecordCount"])
+        metrics.count("retried_records", response["retried_records"])
         return response
-        
-    except ClientError as e:
-        # Catch specific AWS API errors (e.g., throttling, stream not found)
-        print(f"Kinesis ClientError: Failed to send records: {e}")
-        return {"Error": f"Kinesis API failure: {e.response['Error']['Message']}"}
-        
+
     except Exception as e:
         # Catch general errors (e.g., network issues)
         print(f"General Error during Kinesis send: {e}")
         return {"Error": "General send failure"}
 
 
+_kinematics_missing = False
+
+
+def get_derive_kinematics():
+    """
+    kinematics.derive_kinematics, or None when numpy is not installed (no
+    layer): the stage is then skipped with a warning instead of failing.
+    """
+    global _kinematics_missing
+    if _kinematics_missing:
+        return None
+    try:
+        from kinematics import derive_kinematics
+    except ImportError as e:
+        print(f"⚠️ {e} (add the AWS SDK for pandas layer), skipping speed/heading derivation.")
+        _kinematics_missing = True
+        return None
+    return derive_kinematics
+
+
+def prewarm():
+    """
+    Creates the Kinesis client(s), the feed's HTTP session and the schedule
+    index, and imports numpy for kinematics, up front. Run at import inside Lambda, so that work happens once
+    in the init phase (full CPU) rather than in the first billed poll. A missing numpy only logs a
+    warning here (see get_derive_kinematics).
+    """
+    get_sender(CONFIG.stream_name)
+    if CONFIG.headway_stream_name:
+        get_sender(CONFIG.headway_stream_name)
+    get_fetcher()
+    if CONFIG.kinematics:
+        get_derive_kinematics()
+    if CONFIG.adherence_index:
+        get_adherence_engine()
+
+
+if CONFIG.prewarm:
+    prewarm()
+
+
 def lambda_handler(event, context):
     """
     AWS Lambda entry point.
-    Fetches GTFS data, prints a tabular log, and sends the data to Kinesis.
+    Fetches GTFS data, sends it to Kinesis and logs one metrics line.
     """
-    
+    metrics = Metrics(dimensions={"Stream": CONFIG.stream_name})
+    try:
+        with metrics.timer("invocation"):
+            return poll_and_send(metrics)
+    finally:
+        metrics.emit()
+
+
+def poll_and_send(metrics):
+    """One poll: fetch, enrich, (optionally) log the table, and send to Kinesis."""
     # 1. Fetch the data (list of dictionaries)
-    entity_list = fetch_realtime_data()
+    entity_list = fetch_realtime_data(metrics=metrics)
+
+    # Feed unchanged since the last poll (304 or same header.timestamp):
+    # nothing new to log or send downstream. An empty feed ([]) goes on, so
+    # delta mode sends tombstones for the vehicles that left.
+    if entity_list is None:
+        print("💤 Feed unchanged since the last poll, nothing sent.")
+        return {
+            "statusCode": 200,
+            "body": json.dumps([])
+        }
     
-    # 2. Format and Print the tabular log for CloudWatch
-    table_string = format_list_to_table_string(entity_list)
-    print("--- Organized Vehicle Data (Tabular Log Print) ---")
-    print(table_string)
+    # 2. Speed and heading for the whole batch (numpy is only imported when enabled)
+    derive_kinematics = get_derive_kinematics() if CONFIG.kinematics and entity_list else None
+    if derive_kinematics is not None:
+        with metrics.timer("kinematics"):
+            kinematics_summary = derive_kinematics(entity_list, kinematics_store)
+        print(f"--- Kinematics --- {kinematics_summary}")
+
+    # Schedule adherence (delay against stop_times) when an index is configured
+    if CONFIG.adherence_index and entity_list:
+        with metrics.timer("adherence"):
+            adherence_summary = get_adherence_engine().update(entity_list)
+        print(f"--- Adherence --- {adherence_summary}")
+
+        # Headways and bunching per route, from the distances adherence just added
+        if CONFIG.headway_stream_name:
+            with metrics.timer("headway"):
+                publish_headway_events(entity_list)
+
+    # 3. Debug only: the full tabular log, on a sample of invocations
+    if CONFIG.debug_table_sample_rate and random.random() < CONFIG.debug_table_sample_rate:
+        table_string = format_list_to_table_string(entity_list)
+        print("--- Organized Vehicle Data (Tabular Log Print) ---")
+        print(table_string)
+
+    # 4. In delta mode, keep only what changed since the last emitted state
+    records_to_send = entity_list
+    delta_state = None
+    if CONFIG.emit_mode == "delta":
+        records_to_send, delta_summary, delta_state = compute_deltas(
+            entity_list, state_store, CONFIG.snapshot_every_n_polls,
+            source_timestamp=get_fetcher().last_timestamp)
+        print(f"--- Delta Emission --- {delta_summary}")
+        metrics.count("unchanged_vehicles", delta_summary["unchanged"])
+        if not records_to_send:
+            state_store.save(delta_state)
+            print("💤 No vehicle moved since the last poll, nothing sent.")
+            return {
+                "statusCode": 200,
+                "body": json.dumps([])
+            }
+    elif not records_to_send:
+        print("💤 The feed has no vehicles, nothing sent.")
+        return {
+            "statusCode": 200,
+            "body": json.dumps([])
+        }
 
-    # 3. Send the structured data to Kinesis
-    kinesis_response = send_to_kinesis(KINESIS_STREAM_NAME, entity_list)
+    # 5. Send the structured data to Kinesis
+    kinesis_response = send_to_kinesis(CONFIG.stream_name, records_to_send, metrics)
     
     print("--- Kinesis Send Response ---")
     
     failed_count = kinesis_response.get('FailedRecordCount', 0)
     
     if failed_count > 0:
-        print(f"⚠️ WARNING: {failed_count} records failed to send.")
-        # Print the full response for debugging failed records
+        print(f"⚠️ WARNING: {failed_count} records lost after retries.")
+        # Print the full summary for debugging failed records
         print(kinesis_response)
     elif kinesis_response.get("Error"):
         # Print custom error from the send_to_kinesis function
@@ -105,12 +351,16 @@ def lambda_handler(event, context):
         # Optionally, raise an exception here to fail the Lambda run:
         # raise Exception("Kinesis sending failed.")
     else:
-        print("✅ All records sent successfully.")
+        print(f"✅ All records sent successfully: {kinesis_response}")
+        # Only now is this what consumers have seen; after a failure the
+        # old state stays, and the next poll sends the changes again
+        if delta_state is not None:
+            state_store.save(delta_state)
         
-    # 4. Return success status and the original data 
+    # 6. Return success status and the data that was sent
     return {
         "statusCode": 200,
-        "body": json.dumps(entity_list)
+        "body": json.dumps(records_to_send)
     }
 
 """
@@ -0,0 +1,506 @@
+"""
+Compiled, memory-mapped index of the static schedule (trips, stop_times,
+stops, shapes) for realtime-to-schedule work.
+
+Loading stop_times from CSV or Athena on every start takes tens of seconds
+and a lot of memory. Instead, a day's GTFS partition is compiled once into
+one binary file, and readers open it with mmap:
+
+- every id (trip, route, service, stop) is interned into a sorted string
+  table, and the other arrays refer to it by int32 position
+- stop_times are sorted by (trip, stop_sequence); trip i's rows are
+  st_*[trip_offsets[i]:trip_offsets[i + 1]]
+- arrival/departure are int32 seconds after midnight (GTFS allows > 24h),
+  -1 when blank
+- (version 2) shape points are grouped per shape behind shape_offsets, with
+  the distance along the shape in metres; every stop_time also has st_dist,
+  the stop's distance along its trip's shape (or along the straight lines
+  between its stops when the trip has no shape)
+
+numpy arrays are views straight onto the mapped file (no copy, nothing
+parsed at open), so opening takes milliseconds and every process that opens
+the same file shares one copy in the page cache.
+
+File layout (little-endian):
+
+    b"UTASCHED"  magic
+    u32          format version (INDEX_VERSION)
+    u32          number of sections
+    per section: 24-byte name (utf-8, NUL padded), 4-byte numpy dtype
+                 string, u64 byte offset, u64 item count
+    section data, each aligned to 8 bytes
+
+String tables are two sections: "<name>.offsets" (uint32, n + 1) and
+"<name>.blob" (uint8).
+
+    python scripts/schedule_index.py compile --gtfs GTFS.zip --out schedule.idx
+    python scripts/schedule_index.py compile --bucket my-bucket --date 2025-01-31 --out schedule.idx
+    python scripts/schedule_index.py info schedule.idx --trip 123456
+"""
+import argparse
+import csv
+import io
+import json
+import mmap
+import os
+import struct
+import time
+import zipfile
+
+import numpy as np
+
+MAGIC = b"UTASCHED"
+INDEX_VERSION = 2
+EARTH_RADIUS_M = 6371008.8
+NAME_BYTES = 24
+SECTION_ENTRY = struct.Struct(f"<{NAME_BYTES}s4sQQ")
+
+
+def parse_gtfs_time(value):
+    """'HH:MM:SS' (hours may be >= 24) -> seconds after midnight, -1 when blank."""
+    if not value:
+        return -1
+    hours, minutes, seconds = value.strip().split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+# --- Sources -----------------------------------------------------------
+
+def open_gtfs_zip(path):
+    """Returns a function table_name -> text stream for a local GTFS zip or folder."""
+    if os.path.isdir(path):
+        return lambda table: open(os.path.join(path, f"{table}.txt"), encoding="utf-8-sig", newline="")
+    archive = zipfile.ZipFile(path)
+    return lambda table: io.TextIOWrapper(archive.open(f"{table}.txt"), encoding="utf-8-sig", newline="")
+
+
+def open_s3_partition(bucket_name, date):
+    """
+    Returns a function table_name -> text stream reading the raw zone. The
+    day's manifest says which partition holds the current copy of each
+    table (unchanged tables are not re-uploaded by the incremental ingest).
+    """
+    import boto3
+
+    s3 = boto3.client("s3")
+    manifest = json.loads(s3.get_object(Bucket=bucket_name, Key=f"manifests/{date}.json")["Body"].read())
+    tables = manifest["tables"]
+
+    def open_table(table):
+        if table not in tables:
+            raise FileNotFoundError(f"{table} is not in manifests/{date}.json")
+        partition = tables[table].get("partition", f"raw/{date}")
+        body = s3.get_object(Bucket=bucket_name, Key=f"{partition}/{table}/{table}.txt")["Body"]
+        return io.TextIOWrapper(body, encoding="utf-8-sig", newline="")
+
+    return open_table
+
+
+# --- Compiler ----------------------------------------------------------
+
+def local_xy(lat, lon, lat0):
+    """Equirectangular projection to metres around latitude lat0 (fine at city scale)."""
+    x = np.radians(np.asarray(lon, dtype=np.float64)) * EARTH_RADIUS_M * np.cos(np.radians(lat0))
+    y = np.radians(np.asarray(lat, dtype=np.float64)) * EARTH_RADIUS_M
+    return x, y
+
+
+def cumulative_distance(x, y):
+    steps = np.hypot(np.diff(x), np.diff(y))
+    return np.concatenate([[0.0], np.cumsum(steps)])
+
+
+def project_onto_polyline(x, y, cum, px, py, min_along=0.0):
+    """
+    Distance along the polyline (x, y, cumulative cum) of the closest point
+    to (px, py), only considering the part at or after min_along.
+    Returns (along, offset from the line).
+    """
+    if len(x) < 2:
+        return 0.0, float(np.hypot(px - x[0], py - y[0])) if len(x) else float("inf")
+    dx, dy = np.diff(x), np.diff(y)
+    length_sq = dx * dx + dy * dy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.clip(((px - x[:-1]) * dx + (py - y[:-1]) * dy) / length_sq, 0.0, 1.0)
+    t = np.nan_to_num(t)
+    along = cum[:-1] + t * np.sqrt(length_sq)
+    offset = np.hypot(x[:-1] + t * dx - px, y[:-1] + t * dy - py)
+    offset = np.where(along >= min_along - 1.0, offset, np.inf)
+    best = int(np.argmin(offset))
+    return float(along[best]), float(offset[best])
+
+
+def stop_distances(shape_x, shape_y, shape_cum, stop_x, stop_y):
+    """Distance along the shape of each stop, never going backwards."""
+    distances = []
+    along = 0.0
+    for px, py in zip(stop_x, stop_y):
+        along, _ = project_onto_polyline(shape_x, shape_y, shape_cum, px, py, along)
+        distances.append(along)
+    return distances
+
+
+def compile_shapes(open_table):
+    """(shape_ids, shape_pos, offsets, lat, lon, dist) from shapes.txt, or None when the feed has none."""
+    try:
+        f = open_table("shapes")
+    except (KeyError, FileNotFoundError, OSError):
+        return None
+    points = {}
+    with f:
+        for row in csv.DictReader(f):
+            points.setdefault(row["shape_id"], []).append(
+                (int(row["shape_pt_sequence"]), float(row["shape_pt_lat"]), float(row["shape_pt_lon"])))
+
+    shape_ids, shape_pos = intern_strings(points)
+    offsets = np.zeros(len(shape_ids) + 1, dtype=np.uint32)
+    lats, lons, dists = [], [], []
+    for i, shape_id in enumerate(shape_ids):
+        shape = sorted(points[shape_id])
+        lat = np.array([p[1] for p in shape])
+        lon = np.array([p[2] for p in shape])
+        x, y = local_xy(lat, lon, lat.mean())
+        lats.append(lat)
+        lons.append(lon)
+        dists.append(cumulative_distance(x, y))
+        offsets[i + 1] = offsets[i] + len(shape)
+    return (shape_ids, shape_pos, offsets, np.concatenate(lats or [np.zeros(0)]),
+            np.concatenate(lons or [np.zeros(0)]), np.concatenate(dists or [np.zeros(0)]).astype(np.float32))
+
+
+def compile_stop_distances(trip_shape, trip_offsets, st_stop, stop_lat, stop_lon, shapes):
+    """st_dist for every stop_time. Trips sharing a shape and stop pattern are projected once."""
+    st_dist = np.zeros(len(st_stop), dtype=np.float32)
+    cache = {}
+    for trip in range(len(trip_shape)):
+        start, end = int(trip_offsets[trip]), int(trip_offsets[trip + 1])
+        if start == end:
+            continue
+        stops = st_stop[start:end]
+        shape = int(trip_shape[trip])
+        key = (shape, stops.tobytes())
+        if key not in cache:
+            lat0 = float(stop_lat[stops].mean())
+            stop_x, stop_y = local_xy(stop_lat[stops], stop_lon[stops], lat0)
+            if shape >= 0 and shapes is not None:
+                _, _, offsets, lat, lon, _ = shapes
+                lo, hi = int(offsets[shape]), int(offsets[shape + 1])
+                shape_x, shape_y = local_xy(lat[lo:hi], lon[lo:hi], lat0)
+                cache[key] = stop_distances(shape_x, shape_y, cumulative_distance(shape_x, shape_y), stop_x, stop_y)
+            else:
+                # No shape: straight lines between consecutive stops
+                cache[key] = cumulative_distance(stop_x, stop_y)
+        st_dist[start:end] = cache[key]
+    return st_dist
+
+
+def intern_strings(values):
+    """Sorted unique strings and a dict string -> position."""
+    table = sorted(set(values))
+    return table, {value: i for i, value in enumerate(table)}
+
+
+def string_sections(name, strings):
+    """The .offsets / .blob sections for a list of strings."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return {f"{name}.offsets": offsets, f"{name}.blob": np.frombuffer(b"".join(encoded), dtype=np.uint8)}
+
+
+def compile_schedule(open_table):
+    """
+    Reads trips, stop_times, stops and (when present) shapes through
+    open_table(name) and returns {section name: numpy array}, ready for
+    write_index.
+    """
+    # 1. Stops: ids sorted, coordinates and names in the same order
+    with open_table("stops") as f:
+        stop_rows = {row["stop_id"]: row for row in csv.DictReader(f)}
+    stop_ids, stop_pos = intern_strings(stop_rows)
+    stop_lat = np.array([float(stop_rows[s].get("stop_lat") or "nan") for s in stop_ids])
+    stop_lon = np.array([float(stop_rows[s].get("stop_lon") or "nan") for s in stop_ids])
+    stop_names = [stop_rows[s].get("stop_name") or "" for s in stop_ids]
+
+    # 2. Trips: ids sorted, route/service interned
+    with open_table("trips") as f:
+        trip_rows = {row["trip_id"]: row for row in csv.DictReader(f)}
+    trip_ids, trip_pos = intern_strings(trip_rows)
+    route_ids, route_pos = intern_strings(row["route_id"] for row in trip_rows.values())
+    service_ids, service_pos = intern_strings(row.get("service_id", "") for row in trip_rows.values())
+    trip_route = np.array([route_pos[trip_rows[t]["route_id"]] for t in trip_ids], dtype=np.int32)
+    trip_service = np.array([service_pos[trip_rows[t].get("service_id", "")] for t in trip_ids], dtype=np.int32)
+    trip_direction = np.array([int(trip_rows[t].get("direction_id") or -1) for t in trip_ids], dtype=np.int32)
+
+    # 3. Shapes (optional in GTFS); trips without one get -1
+    shapes = compile_shapes(open_table)
+    shape_pos = shapes[1] if shapes else {}
+    trip_shape = np.array([shape_pos.get(trip_rows[t].get("shape_id") or "", -1) for t in trip_ids], dtype=np.int32)
+
+    # 4. Stop times, streamed row by row into typed columns
+    st_trip, st_seq, st_stop, st_arr, st_dep = (np.zeros(0, dtype=np.int32) for _ in range(5))
+    columns = ([], [], [], [], [])
+    chunk = 500000
+
+    def flush():
+        nonlocal st_trip, st_seq, st_stop, st_arr, st_dep
+        arrays = [np.array(c, dtype=np.int32) for c in columns]
+        st_trip, st_seq, st_stop, st_arr, st_dep = (
+            np.concatenate([old, new]) for old, new in zip((st_trip, st_seq, st_stop, st_arr, st_dep), arrays))
+        for c in columns:
+            c.clear()
+
+    skipped = 0
+    with open_table("stop_times") as f:
+        for row in csv.DictReader(f):
+            trip = trip_pos.get(row["trip_id"])
+            stop = stop_pos.get(row["stop_id"])
+            if trip is None or stop is None:
+                skipped += 1
+                continue
+            columns[0].append(trip)
+            columns[1].append(int(row["stop_sequence"]))
+            columns[2].append(stop)
+            columns[3].append(parse_gtfs_time(row.get("arrival_time")))
+            columns[4].append(parse_gtfs_time(row.get("departure_time")))
+            if len(columns[0]) >= chunk:
+                flush()
+    flush()
+    if skipped:
+        print(f"⚠️ Skipped {skipped} stop_times rows with an unknown trip_id or stop_id")
+
+    order = np.lexsort((st_seq, st_trip))
+    st_trip = st_trip[order]
+    trip_offsets = np.searchsorted(st_trip, np.arange(len(trip_ids) + 1)).astype(np.uint32)
+
+    st_stop = st_stop[order]
+
+    # 5. Distance along the shape of every stop_time
+    st_dist = compile_stop_distances(trip_shape, trip_offsets, st_stop, stop_lat, stop_lon, shapes)
+
+    sections = {
+        "trip_route": trip_route,
+        "trip_service": trip_service,
+        "trip_direction": trip_direction,
+        "trip_shape": trip_shape,
+        "trip_offsets": trip_offsets,
+        "st_seq": st_seq[order],
+        "st_stop": st_stop,
+        "st_arr": st_arr[order],
+        "st_dep": st_dep[order],
+        "st_dist": st_dist,
+        "stop_lat": stop_lat,
+        "stop_lon": stop_lon,
+    }
+    shape_ids = []
+    if shapes:
+        shape_ids, _, sections["shape_offsets"], sections["shape_lat"], sections["shape_lon"], \
+            sections["shape_dist"] = shapes
+    else:
+        sections["shape_offsets"] = np.zeros(1, dtype=np.uint32)
+        sections["shape_lat"] = sections["shape_lon"] = np.zeros(0)
+        sections["shape_dist"] = np.zeros(0, dtype=np.float32)
+    for name, strings in (("trip_ids", trip_ids), ("route_ids", route_ids), ("service_ids", service_ids),
+                          ("stop_ids", stop_ids), ("stop_names", stop_names), ("shape_ids", shape_ids)):
+        sections.update(string_sections(name, strings))
+    return sections
+
+
+def write_index(sections, path, version=INDEX_VERSION):
+    """Writes the sections to `path` (atomically, through a .tmp file)."""
+    header_size = len(MAGIC) + 8 + SECTION_ENTRY.size * len(sections)
+    offset = (header_size + 7) & ~7
+    entries = []
+    for name, values in sections.items():
+        values = np.ascontiguousarray(values)
+        entries.append((name, values, offset))
+        offset = (offset + values.nbytes + 7) & ~7
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<II", version, len(sections)))
+        for name, values, data_offset in entries:
+            dtype = values.dtype.newbyteorder("<").str.encode("ascii")
+            f.write(SECTION_ENTRY.pack(name.encode("utf-8"), dtype, data_offset, len(values)))
+        for name, values, data_offset in entries:
+            f.seek(data_offset)
+            f.write(values.astype(values.dtype.newbyteorder("<"), copy=False).tobytes())
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+# --- Reader ------------------------------------------------------------
+
+class StringTable:
+    """Read-only view of a string table section pair."""
+
+    def __init__(self, offsets, blob, is_sorted=True):
+        self.offsets = offsets
+        self.blob = blob
+        self.is_sorted = is_sorted
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def find(self, value):
+        """Position of `value` (binary search), or -1."""
+        if not self.is_sorted:
+            raise TypeError("find() needs a sorted string table")
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if self[mid] < value:
+                low = mid + 1
+            else:
+                high = mid
+        return low if low < len(self) and self[low] == value else -1
+
+
+class ScheduleIndex:
+    """
+    Memory-mapped schedule index. Arrays are numpy views on the file:
+
+        trip_route, trip_service, trip_offsets      per trip
+        st_seq, st_stop, st_arr, st_dep             per stop_time, grouped by trip
+        stop_lat, stop_lon                          per stop
+        trip_ids, route_ids, service_ids, stop_ids, stop_names   StringTables
+
+    Version 2 files add trip_shape, st_dist, shape_offsets, shape_lat,
+    shape_lon, shape_dist and shape_ids (has_shapes is True), and newer
+    ones trip_direction (direction_id, -1 when blank).
+    """
+
+    STRING_TABLES = ["trip_ids", "route_ids", "service_ids", "stop_ids", "stop_names", "shape_ids"]
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a schedule index")
+        self.version, count = struct.unpack_from("<II", self._mmap, len(MAGIC))
+        if self.version > INDEX_VERSION:
+            raise ValueError(f"Unsupported schedule index version {self.version}")
+
+        self.sections = {}
+        pos = len(MAGIC) + 8
+        for _ in range(count):
+            name, dtype, offset, items = SECTION_ENTRY.unpack_from(self._mmap, pos)
+            pos += SECTION_ENTRY.size
+            name = name.rstrip(b"\0").decode("utf-8")
+            dtype = np.dtype(dtype.rstrip(b"\0").decode("ascii"))
+            # Empty sections at the end of the file point past its last byte
+            self.sections[name] = (np.frombuffer(self._mmap, dtype=dtype, count=items, offset=offset)
+                                   if items else np.zeros(0, dtype=dtype))
+
+        for name, values in self.sections.items():
+            if "." not in name:
+                setattr(self, name, values)
+        for name in self.STRING_TABLES:
+            if f"{name}.offsets" in self.sections:
+                setattr(self, name, StringTable(self.sections[f"{name}.offsets"], self.sections[f"{name}.blob"],
+                                                is_sorted=name != "stop_names"))
+        self.has_shapes = "st_dist" in self.sections
+
+    @classmethod
+    def open(cls, path):
+        return cls(path)
+
+    def trip_position(self, trip_id):
+        return self.trip_ids.find(trip_id)
+
+    def trip_rows(self, trip):
+        """slice into the st_* arrays for trip position `trip`."""
+        return slice(int(self.trip_offsets[trip]), int(self.trip_offsets[trip + 1]))
+
+    def stop_times(self, trip_id):
+        """Scheduled stops of one trip as [{stop_sequence, stop_id, arrival, departure[, shape_dist_m]}]."""
+        trip = self.trip_position(trip_id)
+        if trip < 0:
+            return []
+        rows = self.trip_rows(trip)
+        stop_times = [
+            {"stop_sequence": int(seq), "stop_id": self.stop_ids[stop], "arrival": int(arr), "departure": int(dep)}
+            for seq, stop, arr, dep in zip(self.st_seq[rows], self.st_stop[rows], self.st_arr[rows], self.st_dep[rows])
+        ]
+        if self.has_shapes:
+            for row, dist in zip(stop_times, self.st_dist[rows].tolist()):
+                row["shape_dist_m"] = round(dist, 1)
+        return stop_times
+
+    def shape_rows(self, shape):
+        """slice into the shape_* arrays for shape position `shape`."""
+        return slice(int(self.shape_offsets[shape]), int(self.shape_offsets[shape + 1]))
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "trips": len(self.trip_ids),
+            "stop_times": len(self.st_seq),
+            "shapes": len(self.shape_ids) if self.has_shapes else 0,
+            "stops": len(self.stop_ids),
+            "routes": len(self.route_ids),
+            "bytes": len(self._mmap),
+        }
+
+    def close(self):
+        # Views must be dropped before the map can be closed
+        self.sections = {}
+        for name in list(vars(self)):
+            if isinstance(getattr(self, name), (np.ndarray, StringTable)):
+                delattr(self, name)
+        self._mmap.close()
+
+
+# --- CLI ---------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile or inspect the schedule index")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compile_cmd = commands.add_parser("compile", help="Compile a GTFS partition into an index file")
+    compile_cmd.add_argument("--gtfs", help="Local GTFS zip or folder of .txt files")
+    compile_cmd.add_argument("--bucket", help="Read the raw zone of this bucket instead")
+    compile_cmd.add_argument("--date", help="Partition date (YYYY-MM-DD) with --bucket")
+    compile_cmd.add_argument("--out", required=True)
+    compile_cmd.add_argument("--upload", action="store_true", help="Also upload to s3://<bucket>/indexes/<date>/")
+
+    info_cmd = commands.add_parser("info", help="Open an index and print its contents")
+    info_cmd.add_argument("path")
+    info_cmd.add_argument("--trip", help="Print the stop times of this trip_id")
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        if args.gtfs:
+            open_table = open_gtfs_zip(args.gtfs)
+        elif args.bucket and args.date:
+            open_table = open_s3_partition(args.bucket, args.date)
+        else:
+            parser.error("compile needs --gtfs or --bucket with --date")
+        start = time.perf_counter()
+        size = write_index(compile_schedule(open_table), args.out)
+        print(f"✅ Wrote {args.out} ({size / 1e6:.1f} MB) in {time.perf_counter() - start:.1f}s")
+        if args.upload and args.bucket:
+            import boto3
+            key = f"indexes/{args.date}/{os.path.basename(args.out)}"
+            boto3.client("s3").upload_file(args.out, args.bucket, key)
+            print(f"☁️ Uploaded s3://{args.bucket}/{key}")
+        return
+
+    start = time.perf_counter()
+    index = ScheduleIndex.open(args.path)
+    opened_ms = (time.perf_counter() - start) * 1000
+    print(f"📂 Opened in {opened_ms:.2f} ms: {index.stats()}")
+    if args.trip:
+        start = time.perf_counter()
+        stop_times = index.stop_times(args.trip)
+        print(f"🔎 Lookup in {(time.perf_counter() - start) * 1e6:.0f} µs")
+        for row in stop_times:
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
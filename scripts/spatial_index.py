@@ -0,0 +1,252 @@
+"""
+Spatial lookups for stops without scanning everything.
+
+GridIndex buckets points into fixed lat/lon cells (CELL_DEG, ~1.1 km north
+to south). It is updated incrementally: moving a point only touches the
+index when it crosses into another cell. It answers:
+
+    nearest(lat, lon, k)                   k nearest keys, searching rings
+                                           of cells outward from the point
+
+StopIndex wraps a GridIndex over uta_gtfs_clean.stops (loaded from the
+GTFS zip, stops.txt or the typed Parquet table). REGIONS holds the named
+polygons used by the dashboards' region filter; points_in_polygon tests a
+whole column of points at once with numpy (for a fleet of vehicles that
+mask is cheaper than keeping them in a grid).
+
+Benchmark against a brute-force scan: python scripts/bench_spatial_index.py
+"""
+import csv
+import io
+import math
+import os
+import zipfile
+
+import numpy as np
+
+CELL_DEG = 0.01
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEG_LAT = 111195.0
+STOPS_PER_CELL = 4    # StopIndex sizes its cells for about this many stops each
+
+# Named regions as (lat, lon) polygons. Rough outlines of the UTA service
+# area counties, good enough for a map filter.
+REGIONS = {
+    "Ogden (North)": [
+        (41.45, -112.25), (41.45, -111.75), (41.07, -111.75), (41.07, -112.25),
+    ],
+    "Davis County": [
+        (41.07, -112.25), (41.07, -111.75), (40.87, -111.80), (40.87, -112.25),
+    ],
+    "Salt Lake City": [
+        (40.87, -112.25), (40.87, -111.80), (40.81, -111.68), (40.49, -111.68),
+        (40.49, -112.25),
+    ],
+    "Provo (South)": [
+        (40.49, -112.05), (40.49, -111.55), (39.90, -111.55), (39.90, -112.05),
+    ],
+}
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres between two points (degrees)."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a)))
+
+
+def polygon_bbox(polygon):
+    lats = [p[0] for p in polygon]
+    lons = [p[1] for p in polygon]
+    return min(lats), min(lons), max(lats), max(lons)
+
+
+def points_in_polygon(lats, lons, polygon):
+    """Ray casting over numpy arrays of points; returns a boolean mask."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    south, west, north, east = polygon_bbox(polygon)
+    inside = np.zeros(len(lats), dtype=bool)
+    # Only points in the polygon's bounding box need the edge tests
+    candidates = np.flatnonzero((lats >= south) & (lats <= north) & (lons >= west) & (lons <= east))
+    if not len(candidates):
+        return inside
+    lat = lats[candidates]
+    lon = lons[candidates]
+    hit = np.zeros(len(candidates), dtype=bool)
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if lat_i != lat_j:
+            crosses = (lat_i > lat) != (lat_j > lat)
+            edge_lon = (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i
+            hit ^= crosses & (lon < edge_lon)
+        j = i
+    inside[candidates] = hit
+    return inside
+
+
+class GridIndex:
+    """Incremental uniform-grid index of keyed points."""
+
+    def __init__(self, cell_deg=CELL_DEG):
+        self.cell_deg = cell_deg
+        self.points = {}   # key -> (lat, lon, cell)
+        self.cells = {}    # cell -> set of keys
+        self._extent = None   # (min row, max row, min col, max col) of occupied cells
+
+    def __len__(self):
+        return len(self.points)
+
+    def cell_of(self, lat, lon):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def upsert(self, key, lat, lon):
+        """Adds or moves a point. Returns True when it changed cell."""
+        if lat is None or lon is None or lat != lat or lon != lon:
+            self.remove(key)
+            return False
+        cell = self.cell_of(lat, lon)
+        old = self.points.get(key)
+        self.points[key] = (lat, lon, cell)
+        if old is not None and old[2] == cell:
+            return False
+        if old is not None:
+            self._discard(key, old[2])
+        if cell not in self.cells:
+            self.cells[cell] = set()
+            self._extent = None
+        self.cells[cell].add(key)
+        return True
+
+    def remove(self, key):
+        old = self.points.pop(key, None)
+        if old is not None:
+            self._discard(key, old[2])
+
+    def _discard(self, key, cell):
+        members = self.cells.get(cell)
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self.cells[cell]
+                self._extent = None
+
+    def _occupied_extent(self):
+        if self._extent is None:
+            rows = [c[0] for c in self.cells]
+            cols = [c[1] for c in self.cells]
+            self._extent = (min(rows), max(rows), min(cols), max(cols))
+        return self._extent
+
+    def nearest(self, lat, lon, k=1, max_distance_m=None):
+        """
+        The k nearest keys as [(distance_m, key)], closest first. Searches
+        rings of cells around the point and stops once no unvisited cell can
+        hold anything closer than the k-th result.
+        """
+        if not self.points:
+            return []
+        row, col = self.cell_of(lat, lon)
+        min_row, max_row, min_col, max_col = self._occupied_extent()
+        max_ring = max(abs(row - min_row), abs(row - max_row), abs(col - min_col), abs(col - max_col))
+
+        best = []
+        ring = 0
+        while ring <= max_ring:
+            for cell in self._ring(row, col, ring):
+                for key in self.cells.get(cell, ()):
+                    p_lat, p_lon, _ = self.points[key]
+                    best.append((haversine_m(lat, lon, p_lat, p_lon), key))
+            if best:
+                best.sort(key=lambda item: item[0])
+                del best[k:]
+            # Anything outside the rings searched so far is at least `ring` cells
+            # away; measure a cell by its narrowest (most poleward) side
+            cos_lat = math.cos(math.radians(min(abs(lat) + (ring + 1) * self.cell_deg, 89.9)))
+            reach = ring * self.cell_deg * METERS_PER_DEG_LAT * cos_lat
+            if len(best) >= k and best[-1][0] <= reach:
+                break
+            if max_distance_m is not None and reach > max_distance_m:
+                break
+            ring += 1
+        if max_distance_m is not None:
+            best = [item for item in best if item[0] <= max_distance_m]
+        return best
+
+    def _ring(self, row, col, ring):
+        if ring == 0:
+            return [(row, col)]
+        cells = []
+        for c in range(col - ring, col + ring + 1):
+            cells.append((row - ring, c))
+            cells.append((row + ring, c))
+        for r in range(row - ring + 1, row + ring):
+            cells.append((r, col - ring))
+            cells.append((r, col + ring))
+        return cells
+
+
+def _read_stop_rows(path):
+    """(stop_id, stop_name, lat, lon) rows from a GTFS zip, stops.txt or Parquet file/folder."""
+    if path.endswith(".parquet") or os.path.isdir(path):
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=["stop_id", "stop_name", "stop_lat", "stop_lon"])
+        return zip(*(table.column(name).to_pylist() for name in table.column_names))
+
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            text = archive.read("stops.txt").decode("utf-8-sig")
+    else:
+        with open(path, encoding="utf-8-sig") as f:
+            text = f.read()
+    return ((row["stop_id"], row.get("stop_name"), row["stop_lat"], row["stop_lon"])
+            for row in csv.DictReader(io.StringIO(text)))
+
+
+class StopIndex:
+    """Grid index over the stops table, with nearest-stop lookups."""
+
+    def __init__(self, rows, cell_deg=None):
+        stops = []
+        for stop_id, stop_name, lat, lon in rows:
+            try:
+                lat, lon = float(lat), float(lon)
+            except (TypeError, ValueError):
+                continue
+            # Same coordinate filter as the uta_gtfs_clean.stops view
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                stops.append((str(stop_id), stop_name, lat, lon))
+
+        self.grid = GridIndex(cell_deg or self._cell_size(stops))
+        self.names = {}
+        for stop_id, stop_name, lat, lon in stops:
+            self.grid.upsert(stop_id, lat, lon)
+            self.names[stop_id] = stop_name
+
+    @staticmethod
+    def _cell_size(stops, per_cell=STOPS_PER_CELL):
+        """Cell side giving about `per_cell` stops per cell over their extent."""
+        if len(stops) < 2:
+            return CELL_DEG
+        lats = [s[2] for s in stops]
+        lons = [s[3] for s in stops]
+        area = max(max(lats) - min(lats), CELL_DEG) * max(max(lons) - min(lons), CELL_DEG)
+        return min(max(math.sqrt(area * per_cell / len(stops)), 0.002), 0.2)
+
+    @classmethod
+    def load(cls, path, cell_deg=None):
+        return cls(_read_stop_rows(path), cell_deg)
+
+    def __len__(self):
+        return len(self.grid)
+
+    def nearest(self, lat, lon, k=3, max_distance_m=None):
+        """[{stop_id, stop_name, distance_m}] for the k nearest stops."""
+        return [
+            {"stop_id": stop_id, "stop_name": self.names.get(stop_id), "distance_m": round(distance, 1)}
+            for distance, stop_id in self.grid.nearest(lat, lon, k, max_distance_m)
+        ]
@@ -0,0 +1,206 @@
+"""
+Compact record encoding for the vehicle stream, shared by the poller and
+both dashboards.
+
+Two record formats can be on the stream at the same time:
+
+- JSON (original): one vehicle per record, json.dumps(entity).
+- Aggregated: many vehicles per record, stored column by column.
+
+Aggregated layout (all integers little-endian):
+
+    b"UTAV"  magic
+    u8       format version (AGGREGATE_VERSION)
+    u8       flags (bit 0: body is zlib-compressed)
+    body:
+      u32    number of vehicles
+      u16    number of columns
+      per column:
+        u8 name length, name (utf-8), u8 type code, u32 byte length, bytes
+
+Type codes: 's' strings (u16 lengths array + utf-8 blob, length 0xFFFF
+for None), 'f' float32, 'q' int64, 'B' uint8. Float columns use NaN for
+missing values. Version 2 added the None length so that aggregated and
+JSON records agree on null strings (version 1 wrote None as ""); deploy
+the consumers before the poller. Decoders skip columns they do not know,
+so new fields can be added without a version bump. Lat/lon are stored as float32, the same precision as the
+GTFS-RT Position message.
+"""
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b"UTAV"
+AGGREGATE_VERSION = 2
+FLAG_ZLIB = 0x01
+NULL_LENGTH = 0xFFFF   # string length that stands for None
+
+# Field name -> type code. Order is the order written to the record.
+FIELDS = [
+    ("id", "s"),
+    ("trip_id", "s"),
+    ("route_id", "s"),
+    ("latitude", "f"),
+    ("longitude", "f"),
+    ("speed_mph", "f"),
+    ("bearing", "f"),
+    ("delay_seconds", "f"),
+    ("shape_dist_m", "f"),
+    ("last_stop_id", "s"),
+    ("next_stop_id", "s"),
+    ("schedule_status", "s"),
+    ("vehicle_timestamp", "q"),
+    ("source_timestamp", "q"),
+    ("deleted", "B"),
+]
+
+# Vehicles per aggregated record. ~30 bytes per vehicle after compression,
+# so this stays far below the 1 MB Kinesis record limit.
+MAX_VEHICLES_PER_RECORD = 1000
+
+_LITTLE_ENDIAN = sys.byteorder == "little"
+_NAN = float("nan")
+
+
+def _to_bytes(values):
+    if not _LITTLE_ENDIAN:
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(type_code, raw):
+    values = array(type_code)
+    values.frombytes(raw)
+    if not _LITTLE_ENDIAN:
+        values.byteswap()
+    return values
+
+
+def _encode_column(type_code, values):
+    if type_code == "s":
+        encoded = [None if v is None else str(v).encode("utf-8") for v in values]
+        lengths = array("H", [NULL_LENGTH if e is None else len(e) for e in encoded])
+        return _to_bytes(lengths) + b"".join(e for e in encoded if e is not None)
+    if type_code == "f":
+        return _to_bytes(array("f", [_NAN if v is None else v for v in values]))
+    if type_code == "q":
+        return _to_bytes(array("q", [0 if v is None else int(v) for v in values]))
+    return _to_bytes(array("B", [1 if v else 0 for v in values]))
+
+
+def _decode_column(type_code, raw, count):
+    if type_code == "s":
+        lengths = _from_bytes("H", raw[:2 * count])
+        blob = raw[2 * count:]
+        values = []
+        pos = 0
+        for length in lengths:
+            if length == NULL_LENGTH:
+                values.append(None)
+                continue
+            values.append(blob[pos:pos + length].decode("utf-8"))
+            pos += length
+        return values
+    return _from_bytes(type_code, raw)
+
+
+def encode_aggregated(entities, compress=True):
+    """Packs a list of vehicle dicts into one aggregated record (bytes)."""
+    parts = [struct.pack("<IH", len(entities), len(FIELDS))]
+    for name, type_code in FIELDS:
+        column = _encode_column(type_code, [e.get(name) for e in entities])
+        name_bytes = name.encode("utf-8")
+        parts.append(struct.pack("<B", len(name_bytes)) + name_bytes
+                     + struct.pack("<cI", type_code.encode("ascii"), len(column)))
+        parts.append(column)
+    body = b"".join(parts)
+    flags = 0
+    if compress:
+        body = zlib.compress(body, 6)
+        flags |= FLAG_ZLIB
+    return MAGIC + struct.pack("<BB", AGGREGATE_VERSION, flags) + body
+
+
+def encode_records(entities, partition_key_prefix="agg"):
+    """
+    Splits entities into aggregated Kinesis records of at most
+    MAX_VEHICLES_PER_RECORD vehicles. Returns put_records entries.
+    """
+    records = []
+    for n, start in enumerate(range(0, len(entities), MAX_VEHICLES_PER_RECORD)):
+        chunk = entities[start:start + MAX_VEHICLES_PER_RECORD]
+        records.append({
+            "Data": encode_aggregated(chunk),
+            "PartitionKey": f"{partition_key_prefix}-{n}",
+        })
+    return records
+
+
+def is_aggregated(data):
+    return data[:4] == MAGIC
+
+
+def decode_columns(data):
+    """
+    Decodes an aggregated record into {column name: values}. Numeric columns
+    come back as array.array objects, which numpy/pandas accept without a copy.
+    """
+    data = bytes(data)
+    version, flags = struct.unpack_from("<BB", data, 4)
+    if version > AGGREGATE_VERSION:
+        raise ValueError(f"Unsupported aggregated record version {version}")
+    body = data[6:]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+
+    count, column_count = struct.unpack_from("<IH", body, 0)
+    pos = 6
+    columns = {}
+    for _ in range(column_count):
+        (name_length,) = struct.unpack_from("<B", body, pos)
+        pos += 1
+        name = body[pos:pos + name_length].decode("utf-8")
+        pos += name_length
+        type_code, length = struct.unpack_from("<cI", body, pos)
+        pos += 5
+        type_code = type_code.decode("ascii")
+        if type_code in "sfqB":
+            columns[name] = _decode_column(type_code, body[pos:pos + length], count)
+        pos += length
+    columns["_count"] = count
+    return columns
+
+
+def columns_to_records(columns):
+    """Turns decoded columns back into the same dicts the JSON format carries."""
+    count = columns.pop("_count")
+    names = list(columns)
+    deleted = columns.get("deleted")
+    records = []
+    for i in range(count):
+        if deleted is not None and deleted[i]:
+            records.append({"id": columns["id"][i], "deleted": True,
+                            "source_timestamp": columns["source_timestamp"][i]})
+            continue
+        record = {}
+        for name in names:
+            if name == "deleted":
+                continue
+            value = columns[name][i]
+            if isinstance(value, float) and value != value:
+                value = None   # NaN marks a missing float
+            record[name] = value
+        records.append(record)
+    return records
+
+
+def decode_record(data):
+    """
+    Decodes one Kinesis record in either format. Always returns a list of
+    vehicle dicts (one for JSON records, many for aggregated ones).
+    """
+    if is_aggregated(data):
+        return columns_to_records(decode_columns(data))
+    return [json.loads(data)]
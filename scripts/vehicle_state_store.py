@@ -0,0 +1,133 @@
+"""
+Last-emitted vehicle state for delta emission in poll_lambda.
+
+Only vehicles that are new, have moved, or have disappeared since the last
+emitted state are sent to Kinesis. Disappeared vehicles are sent as
+tombstones ({"id": ..., "deleted": true}). Every SNAPSHOT_EVERY polls the
+whole fleet is sent again, so consumers that join late (or missed a record)
+converge within a few minutes.
+
+The store is swappable: FileStateStore (default, /tmp survives between warm
+Lambda invocations) or MemoryStateStore, a key-value stand-in for tests and
+local runs.
+"""
+import json
+import os
+import time
+
+# A vehicle has "moved" when lat or lon changes by more than this many
+# degrees (~1 m). GPS jitter below that is treated as parked.
+POSITION_EPSILON = 0.00001
+
+
+class FileStateStore:
+    """Keeps the state as one compact JSON file on local disk."""
+
+    def __init__(self, path="/tmp/vehicle_state.json"):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {"polls": 0, "vehicles": {}}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # A half-written file from a killed invocation: start over
+            return {"polls": 0, "vehicles": {}}
+
+    def save(self, state):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+
+class MemoryStateStore:
+    """Key-value stand-in: keeps the state under one key in a dict."""
+
+    def __init__(self, kv=None, key="vehicle_state"):
+        self.kv = kv if kv is not None else {}
+        self.key = key
+
+    def load(self):
+        return json.loads(self.kv[self.key]) if self.key in self.kv else {"polls": 0, "vehicles": {}}
+
+    def save(self, state):
+        self.kv[self.key] = json.dumps(state, separators=(",", ":"))
+
+
+def _compact(entity):
+    """The part of a record we compare on: [lat, lon, trip_id]."""
+    return [entity.get("latitude"), entity.get("longitude"), entity.get("trip_id")]
+
+
+def _has_changed(previous, current):
+    if previous is None:
+        return True
+    if previous[2] != current[2]:
+        return True
+    try:
+        return (abs(previous[0] - current[0]) > POSITION_EPSILON
+                or abs(previous[1] - current[1]) > POSITION_EPSILON)
+    except TypeError:
+        return previous[:2] != current[:2]
+
+
+def compute_deltas(entity_list, store, snapshot_every=10, source_timestamp=None):
+    """
+    Compares entity_list with the last emitted state in `store` and returns
+    (records_to_emit, summary, new_state).
+
+    The state is not saved here: call store.save(new_state) only once the
+    records were delivered, so a failed send is retried on the next poll
+    instead of being forgotten. Every `snapshot_every` polls every vehicle is
+    emitted, not just the changes.
+
+    Tombstones carry `source_timestamp` (the feed's header.timestamp, needed
+    when the feed is empty), else the records' own, else the current time.
+    """
+    state = store.load()
+    previous = state.get("vehicles", {})
+    polls = state.get("polls", 0) + 1
+    is_snapshot = snapshot_every > 0 and polls % snapshot_every == 0
+
+    source_timestamp = (source_timestamp or (entity_list[0].get("source_timestamp") if entity_list else None)
+                        or int(time.time()))
+    emit = []
+    current = {}
+    new_count = moved_count = 0
+
+    for entity in entity_list:
+        vehicle_id = entity.get("id")
+        compact = _compact(entity)
+        before = previous.get(vehicle_id)
+        if before is None:
+            new_count += 1
+            emit.append(entity)
+        elif _has_changed(before, compact):
+            moved_count += 1
+            emit.append(entity)
+        elif is_snapshot:
+            emit.append(entity)
+        else:
+            # Not emitted: remember what consumers last saw, so slow GPS
+            # drift adds up until it crosses POSITION_EPSILON
+            compact = before
+        current[vehicle_id] = compact
+
+    # Vehicles we emitted before that are no longer in the feed
+    removed = [vehicle_id for vehicle_id in previous if vehicle_id not in current]
+    for vehicle_id in removed:
+        emit.append({"id": vehicle_id, "deleted": True, "source_timestamp": source_timestamp})
+
+    summary = {
+        "snapshot": is_snapshot,
+        "vehicles": len(entity_list),
+        "new": new_count,
+        "moved": moved_count,
+        "removed": len(removed),
+        "unchanged": len(entity_list) - new_count - moved_count,
+        "emitted": len(emit),
+    }
+    return emit, summary, {"polls": polls, "vehicles": current}
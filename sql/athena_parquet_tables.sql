@@ -0,0 +1,119 @@
+/* ================================================================
+PART 5: TYPED PARQUET TABLES
+Description: External tables over the Parquet files written by
+             scripts/ingest_lambda.py (PARQUET_OUTPUT=true).
+Source: s3://[YOUR_BUCKET_NAME]/parquet/<table>/dt=YYYY-MM-DD/
+Target: uta_gtfs_typed (Physical, typed, compressed tables)
+Notes:  Column types match the uta_gtfs_clean views, so no CAST is
+        needed at query time. Partition projection on `dt` means new
+        days are queryable without running the Glue crawler.
+        With incremental ingest a table only gets a new dt when it
+        changed, so "today" is usually empty: the current copy of each
+        table is the dt of its partition in manifests/_state.json
+        (tables.<table>.partition = raw/<dt>).
+================================================================
+*/
+
+CREATE DATABASE IF NOT EXISTS uta_gtfs_typed;
+
+/* ----------------------------------------------------------------
+TABLE: STOPS (invalid coordinates already filtered out)
+----------------------------------------------------------------
+*/
+CREATE EXTERNAL TABLE IF NOT EXISTS uta_gtfs_typed.stops (
+  stop_id        STRING,
+  stop_name      STRING,
+  stop_lat       DOUBLE,
+  stop_lon       DOUBLE,
+  parent_station STRING
+)
+PARTITIONED BY (dt STRING)
+STORED AS PARQUET
+LOCATION 's3://[YOUR_BUCKET_NAME]/parquet/stops/'
+TBLPROPERTIES (
+  'projection.enabled' = 'true',
+  'projection.dt.type' = 'date',
+  'projection.dt.format' = 'yyyy-MM-dd',
+  'projection.dt.range' = '2025-11-01,NOW',
+  'storage.location.template' = 's3://[YOUR_BUCKET_NAME]/parquet/stops/dt=${dt}/'
+);
+
+/* ----------------------------------------------------------------
+TABLE: ROUTES
+----------------------------------------------------------------
+*/
+CREATE EXTERNAL TABLE IF NOT EXISTS uta_gtfs_typed.routes (
+  route_id         STRING,
+  route_short_name STRING,
+  route_long_name  STRING,
+  route_type       INT
+)
+PARTITIONED BY (dt STRING)
+STORED AS PARQUET
+LOCATION 's3://[YOUR_BUCKET_NAME]/parquet/routes/'
+TBLPROPERTIES (
+  'projection.enabled' = 'true',
+  'projection.dt.type' = 'date',
+  'projection.dt.format' = 'yyyy-MM-dd',
+  'projection.dt.range' = '2025-11-01,NOW',
+  'storage.location.template' = 's3://[YOUR_BUCKET_NAME]/parquet/routes/dt=${dt}/'
+);
+
+/* ----------------------------------------------------------------
+TABLE: TRIPS
+----------------------------------------------------------------
+*/
+CREATE EXTERNAL TABLE IF NOT EXISTS uta_gtfs_typed.trips (
+  route_id      STRING,
+  service_id    STRING,
+  trip_id       STRING,
+  trip_headsign STRING,
+  direction_id  INT,
+  shape_id      STRING
+)
+PARTITIONED BY (dt STRING)
+STORED AS PARQUET
+LOCATION 's3://[YOUR_BUCKET_NAME]/parquet/trips/'
+TBLPROPERTIES (
+  'projection.enabled' = 'true',
+  'projection.dt.type' = 'date',
+  'projection.dt.format' = 'yyyy-MM-dd',
+  'projection.dt.range' = '2025-11-01,NOW',
+  'storage.location.template' = 's3://[YOUR_BUCKET_NAME]/parquet/trips/dt=${dt}/'
+);
+
+/* ----------------------------------------------------------------
+TABLE: STOP_TIMES
+Split into 8 files per day by crc32(trip_id); each file is sorted by
+(trip_id, stop_sequence), so trip_id filters skip most row groups.
+----------------------------------------------------------------
+*/
+CREATE EXTERNAL TABLE IF NOT EXISTS uta_gtfs_typed.stop_times (
+  trip_id        STRING,
+  arrival_time   STRING,
+  departure_time STRING,
+  stop_id        STRING,
+  stop_sequence  INT
+)
+PARTITIONED BY (dt STRING)
+STORED AS PARQUET
+LOCATION 's3://[YOUR_BUCKET_NAME]/parquet/stop_times/'
+TBLPROPERTIES (
+  'projection.enabled' = 'true',
+  'projection.dt.type' = 'date',
+  'projection.dt.format' = 'yyyy-MM-dd',
+  'projection.dt.range' = '2025-11-01,NOW',
+  'storage.location.template' = 's3://[YOUR_BUCKET_NAME]/parquet/stop_times/dt=${dt}/'
+);
+
+/* ----------------------------------------------------------------
+Example: latest day's schedule for one trip (each bucket file is
+sorted by trip_id, so Athena skips row groups by trip_id min/max)
+----------------------------------------------------------------
+*/
+-- dt is the stop_times partition from manifests/_state.json, e.g.
+--   aws s3 cp s3://[YOUR_BUCKET_NAME]/manifests/_state.json - | jq -r '.tables.stop_times.partition'
+--   raw/2025-11-18  ->  dt = '2025-11-18'
+-- SELECT * FROM uta_gtfs_typed.stop_times
+-- WHERE dt = '2025-11-18' AND trip_id = '1234567'
+-- ORDER BY stop_sequence;
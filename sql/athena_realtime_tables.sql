@@ -0,0 +1,117 @@
+/* ================================================================
+PART 6: REALTIME HISTORY (Vehicle Positions)
+Description: External table over the realtime archive written by
+             scripts/archive.py (or archive_lambda.write_handler) and
+             compacted hourly by archive_lambda.compact_handler.
+Source: s3://[YOUR_BUCKET_NAME]/archive/vehicles/dt=YYYY-MM-DD/hour=HH/
+Target: uta_gtfs_typed.vehicle_positions (Physical, typed Parquet)
+        uta_gtfs_clean.vehicle_positions (Logical view)
+        uta_gtfs_clean.route_hourly_performance (Logical view)
+Notes:  Partition projection on `dt` and `hour`, so new hours are
+        queryable without a crawler. Compacted hours are one file sorted
+        by route_id/trip_id: always filter on dt (and hour when you can),
+        and a route filter skips most row groups.
+        `ts` is the poll time (unix seconds, UTC); `dt`/`hour` are UTC.
+================================================================
+*/
+
+CREATE DATABASE IF NOT EXISTS uta_gtfs_typed;
+CREATE DATABASE IF NOT EXISTS uta_gtfs_clean;
+
+/* ----------------------------------------------------------------
+TABLE: VEHICLE_POSITIONS (one row per vehicle per poll, tombstones included)
+----------------------------------------------------------------
+*/
+CREATE EXTERNAL TABLE IF NOT EXISTS uta_gtfs_typed.vehicle_positions (
+  ts                BIGINT,
+  id                STRING,
+  trip_id           STRING,
+  route_id          STRING,
+  latitude          DOUBLE,
+  longitude         DOUBLE,
+  speed_mph         FLOAT,
+  bearing           FLOAT,
+  delay_seconds     FLOAT,
+  shape_dist_m      FLOAT,
+  last_stop_id      STRING,
+  next_stop_id      STRING,
+  schedule_status   STRING,
+  vehicle_timestamp BIGINT,
+  source_timestamp  BIGINT,
+  deleted           BOOLEAN
+)
+PARTITIONED BY (dt STRING, hour STRING)
+STORED AS PARQUET
+LOCATION 's3://[YOUR_BUCKET_NAME]/archive/vehicles/'
+TBLPROPERTIES (
+  'projection.enabled' = 'true',
+  'projection.dt.type' = 'date',
+  'projection.dt.format' = 'yyyy-MM-dd',
+  'projection.dt.range' = '2025-11-01,NOW',
+  'projection.hour.type' = 'integer',
+  'projection.hour.range' = '0,23',
+  'projection.hour.digits' = '2',
+  'storage.location.template' = 's3://[YOUR_BUCKET_NAME]/archive/vehicles/dt=${dt}/hour=${hour}/'
+);
+
+/* ----------------------------------------------------------------
+VIEW: VEHICLE_POSITIONS
+Transformations: Drop tombstones and invalid coordinates, Unix -> timestamp,
+                 Local service date (America/Denver)
+----------------------------------------------------------------
+*/
+CREATE OR REPLACE VIEW uta_gtfs_clean.vehicle_positions AS
+SELECT
+  id AS vehicle_id,
+  trip_id,
+  route_id,
+  latitude,
+  longitude,
+  speed_mph,
+  bearing,
+  delay_seconds,
+  shape_dist_m,
+  last_stop_id,
+  next_stop_id,
+  schedule_status,
+  from_unixtime(ts) AS observed_at,
+  from_unixtime(NULLIF(vehicle_timestamp, 0)) AS vehicle_time,
+  CAST(at_timezone(from_unixtime(ts), 'America/Denver') AS DATE) AS service_date,
+  dt,
+  hour
+FROM uta_gtfs_typed.vehicle_positions
+WHERE
+  NOT COALESCE(deleted, false)
+  AND latitude BETWEEN -90 AND 90
+  AND longitude BETWEEN -180 AND 180;
+
+/* ----------------------------------------------------------------
+VIEW: ROUTE_HOURLY_PERFORMANCE
+Transformations: Per route and hour: fleet size, speed, delay, on-time share
+                 (matched vehicles only, same 1 min early / 5 min late window
+                 as scripts/adherence.py)
+----------------------------------------------------------------
+*/
+CREATE OR REPLACE VIEW uta_gtfs_clean.route_hourly_performance AS
+SELECT
+  route_id,
+  dt,
+  hour,
+  COUNT(DISTINCT vehicle_id) AS vehicles,
+  COUNT(*) AS positions,
+  AVG(speed_mph) AS avg_speed_mph,
+  approx_percentile(delay_seconds, 0.5) AS median_delay_seconds,
+  AVG(CASE WHEN schedule_status = 'on_time' THEN 1.0
+           WHEN schedule_status IN ('early', 'late') THEN 0.0 END) AS on_time_share
+FROM uta_gtfs_clean.vehicle_positions
+GROUP BY route_id, dt, hour;
+
+/* ----------------------------------------------------------------
+EXAMPLE: a week of one route, pruned to 7 days of partitions
+----------------------------------------------------------------
+SELECT dt, hour, vehicles, avg_speed_mph, median_delay_seconds, on_time_share
+FROM uta_gtfs_clean.route_hourly_performance
+WHERE route_id = '2'
+  AND dt BETWEEN '2025-11-17' AND '2025-11-23'
+ORDER BY dt, hour;
+*/
@@ -3,6 +3,9 @@ PART 4: BATCH TRANSFORMATION (Views)
 Description: Creates logical views that clean data on-the-fly.
 Source: uta_gtfs_raw (CSV/Text)
 Target: uta_gtfs_clean (Logical Views)
+Notes:  The daily DAG re-creates the view of each changed table with
+        the same SELECT limited to its new partition (WHERE dt = ...),
+        see CLEAN_VIEWS in dags/gtfs_catalog.py.
 ================================================================
 */
 